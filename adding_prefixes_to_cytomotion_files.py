@@ -1,6 +1,7 @@
 import os
 import sys
-import re
+
+from cytomotion_catalog import ResultsCatalog, parse_results_tag
 
 def extract_tag_from_subfolder(subfolder_name):
     """
@@ -8,30 +9,33 @@ def extract_tag_from_subfolder(subfolder_name):
     Expected format: CPxxx_Dxx_Pxxx_yyy-Contr-Results
     Example: CP012_D33_P001_001-Contr-Results -> CP012_D33_P001_001
     """
-    # Match pattern: CPxxx_Dxx_Pxxx_yyy-Contr-Results
-    match = re.match(r"(CP\d+)_([D]\d+)_P(\d+)_(\d+)-Contr-Results", subfolder_name)
-    if not match:
+    tag = parse_results_tag(subfolder_name)
+    if not tag:
         print(f"Warning: Subfolder name '{subfolder_name}' doesn't match expected pattern")
-        return None
-
-    cp, dxx, plate_num, last_number = match.groups()
-    tag = f"{cp}_{dxx}_P{plate_num.zfill(3)}_{last_number}"
     return tag
 
-def prepend_tag_to_files(base_path):
-    for subfolder in os.listdir(base_path):
+def prepend_tag_to_files(base_path, subfolders=None, catalog=None):
+    """
+    Prefix every file in the -Contr-Results subfolders of base_path with the folder's tag.
+    If subfolders is given, only those subfolder names are processed. Listings come from
+    `catalog` (scanned here if not given), and the renames are applied to it in place.
+    """
+    if catalog is None:
+        catalog = ResultsCatalog(base_path)
+    known = set(catalog.subfolders())
+
+    for subfolder in (catalog.subfolders() if subfolders is None else subfolders):
         subfolder_path = os.path.join(base_path, subfolder)
-        if not os.path.isdir(subfolder_path):
+        if subfolder not in known:
             continue
 
-        tag = extract_tag_from_subfolder(subfolder)
+        tag = catalog.tag(subfolder)
         if not tag:
+            print(f"Warning: Subfolder name '{subfolder}' doesn't match expected pattern")
             continue
 
-        for filename in os.listdir(subfolder_path):
+        for filename in catalog.regular_files(subfolder_path):
             old_path = os.path.join(subfolder_path, filename)
-            if not os.path.isfile(old_path):
-                continue
 
             # Skip if file already has the tag
             if filename.startswith(tag):
@@ -40,12 +44,12 @@ def prepend_tag_to_files(base_path):
             new_filename = f"{tag}_{filename}"
             new_path = os.path.join(subfolder_path, new_filename)
 
-            if os.path.exists(new_path):
+            if catalog.contains(new_path):
                 print(f" Skipping {old_path}, target {new_path} already exists")
                 continue
 
             print(f"Renaming {old_path} -> {new_path}")
-            os.rename(old_path, new_path)
+            catalog.rename_file(old_path, new_path)
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
@@ -0,0 +1,6 @@
+"""
+Throughput benchmarks for the CytoMotion pipeline.
+
+Run from the repository root:
+    python -m benchmarks.run_benchmarks --wells 1 96 960 --baseline benchmarks/baseline.json
+"""
@@ -0,0 +1,240 @@
+import os
+import sys
+import json
+import time
+import queue
+import shutil
+import platform
+import argparse
+import tempfile
+import contextlib
+import multiprocessing
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows: peak RSS is not reported
+    resource = None
+
+from rename_videos_mp4 import rename_videos, DEFAULT_STAGING_MODE, STAGING_MODES
+from cytomotion_preprocess_validation import validate_files
+from cytomotion_preprocessing import get_results_path
+from cytomotion_motion_analysis import analyze_directory
+from update_csv_file_headers_2 import process_directory
+from generate_summary_file import generate_summary_table
+from adding_prefixes_to_cytomotion_files import prepend_tag_to_files
+from cytomotion_postprocessing import check_file_count, HEADERS
+from benchmarks.synthetic import generate_plates, generate_results_tree, DEFAULT_FRAME_COUNT, DEFAULT_WIDTH, DEFAULT_HEIGHT
+
+# -------------------------------
+# Pipeline benchmarks
+# -------------------------------
+# For each well count, synthetic plates and a synthetic results tree are generated
+# (not timed), then every stage runs in its own spawned process so its peak RSS can be
+# measured: rename_videos, validate_files, the motion analysis, and the four
+# postprocessing steps in pipeline order. Results go to a JSON file; with --baseline,
+# a run is compared against an earlier one and stages that got slower or bigger than
+# the tolerance are reported (exit code 1).
+
+BENCHMARK_VERSION = 1
+DEFAULT_WELL_COUNTS = (1, 96, 960)
+DEFAULT_TOLERANCE = 0.2
+MIN_COMPARED_SECONDS = 0.05  # shorter stages are mostly timer and process noise
+STAGE_POLL_SECONDS = 1.0
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+def get_peak_rss_mb():
+    """Peak resident set size of this process in MB (None where unsupported)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _stage_child(func, args, workdir, result_queue):
+    os.chdir(workdir)  # validation writes its logs to the working directory
+    error = None
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        try:
+            func(*args)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        seconds = time.perf_counter() - start
+    result_queue.put({"seconds": seconds, "peak_rss_mb": get_peak_rss_mb(), "error": error})
+
+
+def run_stage(func, args, workdir):
+    """
+    Run func(*args) in a fresh process; returns its duration, peak RSS and error.
+    If the process dies without reporting (killed, crashed), the error says so and the
+    duration is the wall time until it was noticed.
+    """
+    context = multiprocessing.get_context("spawn")
+    result_queue = context.Queue()
+    process = context.Process(target=_stage_child, args=(func, args, workdir, result_queue))
+    start = time.perf_counter()
+    process.start()
+    while True:
+        try:
+            result = result_queue.get(timeout=STAGE_POLL_SECONDS)
+            break
+        except queue.Empty:
+            if process.is_alive():
+                continue
+        # Exited: the result may still be on its way through the queue's pipe
+        try:
+            result = result_queue.get(timeout=STAGE_POLL_SECONDS)
+        except queue.Empty:
+            result = {"seconds": time.perf_counter() - start, "peak_rss_mb": None,
+                      "error": f"stage process exited with code {process.exitcode} without a result"}
+        break
+    process.join()
+    return result
+
+
+# --- Stage functions (module level so the spawned process can import them) ---
+
+def rename_plates(plates, staging_mode):
+    for plate in plates:
+        rename_videos(plate, staging_mode)
+
+
+def validate_plates(plates):
+    for plate in plates:
+        validate_files(plate)
+
+
+def analyze_plates(plates, renamed):
+    for plate, renamed_path in zip(plates, renamed):
+        analyze_directory(renamed_path, get_results_path(plate))
+
+
+def benchmark_wells(wells, workdir, frame_count=DEFAULT_FRAME_COUNT, width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT,
+                    staging_mode=DEFAULT_STAGING_MODE, analysis=True):
+    """Generate data for `wells` wells in workdir and time every stage. Returns {stage: metrics}."""
+    print(f"--- {wells} wells: generating synthetic data ---")
+    plates = generate_plates(os.path.join(workdir, "raw"), wells, frame_count=frame_count, width=width, height=height)
+    renamed = [os.path.join(os.path.dirname(p), f"{os.path.basename(p)}_renamed") for p in plates]
+    results_dir = generate_results_tree(os.path.join(workdir, "results"), wells, frame_count=frame_count)
+
+    stages = [
+        ("rename_videos", rename_plates, (plates, staging_mode)),
+        ("validate_files", validate_plates, (renamed,)),
+    ]
+    if analysis:
+        stages.append(("motion_analysis", analyze_plates, (plates, renamed)))
+    stages += [
+        ("add_headers", process_directory, (results_dir,)),
+        ("generate_summary_table", generate_summary_table, (results_dir, HEADERS)),
+        ("prepend_tag_to_files", prepend_tag_to_files, (results_dir,)),
+        ("check_file_count", check_file_count, (results_dir,)),
+    ]
+
+    metrics = {}
+    for name, func, args in stages:
+        result = run_stage(func, args, workdir)
+        seconds = result["seconds"]
+        metrics[name] = {
+            "seconds": round(seconds, 4),
+            "files_per_s": round(wells / seconds, 2) if seconds > 0 else None,
+            "peak_rss_mb": round(result["peak_rss_mb"], 1) if result["peak_rss_mb"] is not None else None,
+        }
+        if name == "motion_analysis" and seconds > 0:
+            metrics[name]["frames_per_s"] = round(wells * frame_count / seconds, 1)
+        if result["error"]:
+            metrics[name]["error"] = result["error"]
+        line = f"{name:>24}: {seconds:8.3f} s  {metrics[name]['files_per_s']} files/s"
+        if "frames_per_s" in metrics[name]:
+            line += f"  {metrics[name]['frames_per_s']} frames/s"
+        line += f"  peak {metrics[name]['peak_rss_mb']} MB"
+        print(line + (f"  ERROR: {result['error']}" if result["error"] else ""))
+    return metrics
+
+
+def compare_to_baseline(run, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Lines comparing a run with a baseline, and whether any stage regressed beyond the tolerance."""
+    lines = []
+    regressed = False
+    for wells, stages in run["results"].items():
+        for name, metrics in stages.items():
+            old = baseline.get("results", {}).get(wells, {}).get(name)
+            if not old or not old.get("seconds") or not metrics.get("seconds"):
+                continue
+            time_ratio = metrics["seconds"] / old["seconds"]
+            status = "ok"
+            if time_ratio > 1 + tolerance and metrics["seconds"] >= MIN_COMPARED_SECONDS:
+                status = "SLOWER"
+                regressed = True
+            if old.get("peak_rss_mb") and metrics.get("peak_rss_mb") and \
+                    metrics["peak_rss_mb"] / old["peak_rss_mb"] > 1 + tolerance:
+                status = "MORE MEMORY" if status == "ok" else status + ", MORE MEMORY"
+                regressed = True
+            lines.append(f"{wells:>5} wells {name:>24}: {time_ratio:6.2f}x time  {status}")
+    return lines, regressed
+
+
+def main(well_counts, baseline_path=None, save_baseline=False, output=None, tolerance=DEFAULT_TOLERANCE,
+         keep=False, **kwargs):
+    run = {
+        "version": BENCHMARK_VERSION,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "machine": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "config": dict(kwargs),
+        "results": {},
+    }
+    for wells in well_counts:
+        workdir = tempfile.mkdtemp(prefix=f"cytomotion_bench_{wells}_")
+        try:
+            run["results"][str(wells)] = benchmark_wells(wells, workdir, **kwargs)
+        finally:
+            if keep:
+                print(f"Kept benchmark data in {workdir}")
+            else:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(run, f, indent=2)
+        print(f"Results written to {output}")
+
+    regressed = False
+    if baseline_path and os.path.isfile(baseline_path) and not save_baseline:
+        with open(baseline_path, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("config") != run["config"]:
+            print("Warning: baseline was recorded with a different configuration")
+        lines, regressed = compare_to_baseline(run, baseline, tolerance)
+        print(f"\nComparison with {baseline_path} (baseline from {baseline.get('created')}):")
+        for line in lines:
+            print(line)
+    elif baseline_path and save_baseline:
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump(run, f, indent=2)
+        print(f"Baseline written to {baseline_path}")
+    return run, regressed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the CytoMotion pipeline on synthetic plates.")
+    parser.add_argument("--wells", type=int, nargs="+", default=list(DEFAULT_WELL_COUNTS), help="Well counts to run")
+    parser.add_argument("--frames", type=int, default=DEFAULT_FRAME_COUNT, help="Frames per synthetic video")
+    parser.add_argument("--width", type=int, default=DEFAULT_WIDTH)
+    parser.add_argument("--height", type=int, default=DEFAULT_HEIGHT)
+    parser.add_argument("--staging", choices=STAGING_MODES, default=DEFAULT_STAGING_MODE, help="rename_videos staging mode")
+    parser.add_argument("--skip-analysis", action="store_true", help="Do not time the motion analysis")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Write this run as the new baseline instead")
+    parser.add_argument("--output", default=None, help="Also write this run's results to a JSON file")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="Allowed slowdown (0.2 = 20%%)")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated data")
+    args = parser.parse_args()
+
+    _, regressed = main(
+        args.wells, args.baseline, args.save_baseline, args.output, args.tolerance, args.keep,
+        frame_count=args.frames, width=args.width, height=args.height,
+        staging_mode=args.staging, analysis=not args.skip_analysis,
+    )
+    sys.exit(1 if regressed else 0)
@@ -0,0 +1,166 @@
+import os
+import sys
+import shutil
+
+import numpy as np
+import pandas as pd
+import cv2
+
+from cytomotion_motion_analysis import write_trace_file, get_file_name
+from cytomotion_transient_analysis import get_result_columns, write_results_csv, RESULTS_FILE
+
+# -------------------------------
+# Synthetic beating-cell data
+# -------------------------------
+# Videos: a blurred random texture (the cell layer) that contracts towards the frame
+# centre once per beat, with a raised-cosine contraction of known rate, amplitude and
+# duration, plus sensor noise. Results trees: -Contr-Results folders with the files the
+# motion analysis writes, whose per-beat rows follow the same ground truth.
+
+DEFAULT_FRAME_COUNT = 300
+DEFAULT_FPS = 100
+DEFAULT_WIDTH = 256
+DEFAULT_HEIGHT = 256
+DEFAULT_BPM = 60
+DEFAULT_AMPLITUDE = 0.03  # relative shrink of the cell layer at peak contraction
+DEFAULT_CONTRACTION_MS = 300
+DEFAULT_NOISE = 2.0
+WELLS_PER_PLATE = 96
+
+
+def contraction_profile(frame_count, fps=DEFAULT_FPS, bpm=DEFAULT_BPM, contraction_ms=DEFAULT_CONTRACTION_MS,
+                        first_beat_ms=None):
+    """Contraction (0 at rest, 1 at peak) per frame: one raised-cosine pulse per beat."""
+    period_ms = 60000.0 / bpm
+    first_beat_ms = period_ms / 2 if first_beat_ms is None else first_beat_ms
+    t = np.arange(frame_count) * 1000.0 / fps - first_beat_ms
+    phase = np.mod(t, period_ms)
+    profile = 0.5 * (1 - np.cos(2 * np.pi * phase / contraction_ms))
+    profile[(phase >= contraction_ms) | (t < 0)] = 0
+    return profile
+
+
+def make_texture(width, height, rng):
+    """Blurred noise stretched to 8-bit, standing in for a monolayer of cells."""
+    texture = cv2.GaussianBlur(rng.random((height, width), dtype=np.float32), (0, 0), 3)
+    texture -= texture.min()
+    return 40 + 160 * texture / max(texture.max(), 1e-6)
+
+
+def generate_video(path, frame_count=DEFAULT_FRAME_COUNT, fps=DEFAULT_FPS, width=DEFAULT_WIDTH,
+                   height=DEFAULT_HEIGHT, bpm=DEFAULT_BPM, amplitude=DEFAULT_AMPLITUDE,
+                   contraction_ms=DEFAULT_CONTRACTION_MS, noise=DEFAULT_NOISE, seed=0):
+    """Write a synthetic grayscale MP4 and return its ground truth."""
+    rng = np.random.default_rng(seed)
+    texture = make_texture(width, height, rng)
+    profile = contraction_profile(frame_count, fps, bpm, contraction_ms)
+    ys, xs = np.mgrid[0:height, 0:width].astype(np.float32)
+    cx, cy = (width - 1) / 2, (height - 1) / 2
+
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height), isColor=False)
+    if not writer.isOpened():
+        raise IOError(f"Could not open video writer for {path}")
+    try:
+        for value in profile:
+            # Contraction pulls the layer towards the centre: sample further out
+            scale = np.float32(1 + amplitude * value)
+            frame = cv2.remap(texture, cx + (xs - cx) * scale, cy + (ys - cy) * scale,
+                              cv2.INTER_LINEAR, borderMode=cv2.BORDER_REFLECT)
+            if noise:
+                frame = frame + rng.normal(0, noise, frame.shape).astype(np.float32)
+            writer.write(np.clip(frame, 0, 255).astype(np.uint8))
+    finally:
+        writer.release()
+
+    return {
+        "frame_count": frame_count, "fps": fps, "width": width, "height": height, "bpm": bpm,
+        "amplitude": amplitude, "contraction_ms": contraction_ms,
+        "beats": int(np.count_nonzero(np.diff((profile > 0).astype(np.int8)) == 1)),
+    }
+
+
+def generate_plates(root, wells, cp="CP900", date="20250101", day="D01", variants=4, **video_kwargs):
+    """
+    Raw plate folders <root>/<cp>_<date>_<day>/Plate_N with `wells` videos named
+    <anything>_NNN.mp4, 96 per plate. `variants` distinct videos (different beat rates)
+    are encoded once and copied into the wells. Returns the plate folder paths.
+    """
+    experiment = os.path.join(root, f"{cp}_{date}_{day}")
+    templates = []
+    template_dir = os.path.join(root, "templates")
+    os.makedirs(template_dir, exist_ok=True)
+    for i in range(variants):
+        path = os.path.join(template_dir, f"variant_{i}.mp4")
+        generate_video(path, bpm=DEFAULT_BPM + 15 * i, seed=i, **video_kwargs)
+        templates.append(path)
+
+    plates = []
+    for well in range(wells):
+        plate_number, index = divmod(well, WELLS_PER_PLATE)
+        plate_dir = os.path.join(experiment, f"Plate_{plate_number + 1}")
+        if index == 0:
+            os.makedirs(plate_dir, exist_ok=True)
+            plates.append(plate_dir)
+        shutil.copyfile(templates[well % variants], os.path.join(plate_dir, f"Well_{index + 1:03d}.mp4"))
+    return plates
+
+
+def synthetic_beat_table(beats, bpm, contraction_ms, amplitude, rng):
+    """Per-beat table in the Overview-results layout, consistent with the ground truth."""
+    period_ms = 60000.0 / bpm
+    columns = get_result_columns()
+    jitter = rng.normal(1, 0.02, (beats, len(columns)))
+    rows = {
+        "Contraction Duration [10% baseline] (ms)": contraction_ms * 0.8,
+        "Time to Peak (ms)": contraction_ms / 2,
+        "Relaxation Time (ms)": contraction_ms / 2,
+        "90-90 Transient (ms)": contraction_ms * 0.2,
+        "50-50 Transient (ms)": contraction_ms * 0.5,
+        "10-10 Transient (ms)": contraction_ms * 0.8,
+        "Baseline Value (a.u.)": 1.0,
+        "Peak Amplitude (a.u.)": 1.0 + amplitude * 100,
+        "Contraction Amplitude (a.u.)": amplitude * 100,
+        "Peak to Peak Interval (ms)": period_ms,
+    }
+    table = pd.DataFrame({column: rows[column] * jitter[:, i] for i, column in enumerate(columns)})
+    if beats:
+        table.loc[0, "Peak to Peak Interval (ms)"] = 0  # the macro has no interval before the first peak
+    return table
+
+
+def generate_results_tree(base_dir, wells, frame_count=DEFAULT_FRAME_COUNT, fps=DEFAULT_FPS, cp="CP900",
+                          day="D01", contraction_ms=DEFAULT_CONTRACTION_MS, amplitude=DEFAULT_AMPLITUDE, seed=0):
+    """
+    <base_dir>/<cp>_<day>_Pxxx_yyy-Contr-Results folders as the motion analysis writes them
+    (Log_file, contraction, speed-of-contraction, Overview-results). Returns base_dir.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(base_dir, exist_ok=True)
+    for well in range(wells):
+        plate_number, index = divmod(well, WELLS_PER_PLATE)
+        bpm = DEFAULT_BPM + 15 * (well % 4)
+        save_path = os.path.join(base_dir, f"{cp}_{day}_P{plate_number + 1:03d}_{index + 1:03d}-Contr-Results")
+        os.makedirs(save_path, exist_ok=True)
+
+        profile = contraction_profile(frame_count, fps, bpm, contraction_ms)
+        contraction = 1 + amplitude * 100 * profile + rng.normal(0, 0.01, frame_count)
+        speed = np.abs(np.diff(contraction, prepend=contraction[0]))
+        write_trace_file(get_file_name(save_path, "contraction"), contraction, fps)
+        write_trace_file(get_file_name(save_path, "speed-of-contraction"), speed, fps)
+
+        beats = int(np.count_nonzero(np.diff((profile > 0).astype(np.int8)) == 1))
+        write_results_csv(os.path.join(save_path, RESULTS_FILE),
+                          synthetic_beat_table(beats, bpm, contraction_ms, amplitude, rng))
+
+        with open(get_file_name(save_path, "Log_file"), "w") as f:
+            f.write(f"recordedFramerate: {fps}\nSlices: {frame_count}\nElapsed time (ms): 0\n")
+    return base_dir
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python -m benchmarks.synthetic <output_video.mp4> <frame_count>")
+        sys.exit(1)
+
+    truth = generate_video(sys.argv[1], frame_count=int(sys.argv[2]))
+    print(f"Wrote {sys.argv[1]}: {truth}")
@@ -0,0 +1,150 @@
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from cytomotion_frame_reader import iter_frames
+from cytomotion_frame_cache import open_cached_frames, DEFAULT_CACHE_DIR
+from cytomotion_motion_analysis import (
+    compute_motion_traces, build_max_projection_mask, check_compute_mode,
+    BLUR_MODES, BINNING_FACTORS, DEFAULT_RECORDED_FRAMERATE, DEFAULT_SPEED_WINDOW,
+)
+from cytomotion_transient_analysis import transient_analysis, get_result_columns
+
+# -------------------------------
+# Compute mode accuracy report
+# -------------------------------
+# Runs one well with the exact full-resolution computation and with every requested
+# (blur mode, binning) setting, then compares the traces (correlation) and the
+# transient parameters. Time parameters (ms) have to stay within the tolerance: relative
+# to the full-resolution median, or within one frame. Amplitudes are not compared,
+# since binning averages noise out of the differences and lowers them. The cheapest
+# setting within tolerance is recommended.
+
+DEFAULT_TOLERANCE = 0.05
+
+
+def get_time_columns():
+    return [column for column in get_result_columns() if column.endswith("(ms)")]
+
+
+def run_setting(video_path, blur, blur_mode, binning, reference_frame, speed_window, max_project, cached=None):
+    """Traces of one video (or its cached frames) for one compute setting, and the seconds it took."""
+    def open_frames():
+        return iter(cached) if cached is not None else iter_frames(video_path)
+
+    start = time.perf_counter()
+    mask = None
+    if max_project:
+        mask = build_max_projection_mask(open_frames(), reference_frame=reference_frame,
+                                         blur=blur, blur_mode=blur_mode, binning=binning)
+    contraction, speed, _ = compute_motion_traces(
+        open_frames(), reference_frame=reference_frame, speed_window=speed_window,
+        blur=blur, mask=mask, blur_mode=blur_mode, binning=binning,
+    )
+    return contraction, speed, time.perf_counter() - start
+
+
+def compare_tables(reference, table, sampling_ms, tolerance=DEFAULT_TOLERANCE):
+    """Worst relative error of the time parameter medians, and whether all are within tolerance."""
+    worst = 0.0
+    within = len(reference) == len(table)
+    for column in get_time_columns():
+        ref = reference[column].median()
+        value = table[column].median() if len(table) else np.nan
+        if np.isnan(ref) and np.isnan(value):
+            continue
+        if np.isnan(ref) or np.isnan(value):
+            return np.inf, False
+        error = abs(value - ref)
+        relative = error / abs(ref) if ref else (0.0 if error == 0 else np.inf)
+        worst = max(worst, relative)
+        if relative > tolerance and error > sampling_ms:
+            within = False
+    return worst, within
+
+
+def accuracy_report(video_path, settings=None, blur=True, tolerance=DEFAULT_TOLERANCE,
+                    recorded_framerate=DEFAULT_RECORDED_FRAMERATE, reference_frame=1,
+                    speed_window=DEFAULT_SPEED_WINDOW, max_project=False, frame_cache=None):
+    """
+    Compare compute settings against the exact full-resolution result of one video.
+    settings is a list of (blur mode, binning); by default every combination.
+    With a frame cache directory, the video is decoded once and the timings are compute only.
+    Returns a DataFrame with one row per setting (the first row is the reference).
+    """
+    if settings is None:
+        modes = BLUR_MODES if blur else ("exact",)
+        settings = [(mode, binning) for binning in BINNING_FACTORS for mode in modes]
+    for blur_mode, binning in settings:
+        check_compute_mode(blur_mode, binning)
+
+    sampling_ms = 1000 / recorded_framerate
+    cached, _ = open_cached_frames(video_path, frame_cache)
+    ref_contraction, ref_speed, ref_seconds = run_setting(
+        video_path, blur, "exact", 1, reference_frame, speed_window, max_project, cached)
+    ref_tables, _ = transient_analysis([ref_contraction], reference_frame, recorded_framerate)
+
+    rows = []
+    for blur_mode, binning in [("exact", 1)] + [s for s in settings if s != ("exact", 1)]:
+        if (blur_mode, binning) == ("exact", 1):
+            contraction, speed, seconds = ref_contraction, ref_speed, ref_seconds
+        else:
+            contraction, speed, seconds = run_setting(
+                video_path, blur, blur_mode, binning, reference_frame, speed_window, max_project, cached)
+        tables, _ = transient_analysis([contraction], reference_frame, recorded_framerate)
+        worst, within = compare_tables(ref_tables[0], tables[0], sampling_ms, tolerance)
+        rows.append({
+            "blur_mode": blur_mode if blur else "none",
+            "binning": binning,
+            "seconds": round(seconds, 3),
+            "speedup": round(ref_seconds / seconds, 2) if seconds > 0 else np.nan,
+            "contraction_corr": round(float(np.corrcoef(ref_contraction, contraction)[0, 1]), 5),
+            "speed_corr": round(float(np.corrcoef(ref_speed, speed)[0, 1]), 5) if len(speed) > 1 else np.nan,
+            "beats": len(tables[0]),
+            "reference_beats": len(ref_tables[0]),
+            "max_time_error": round(worst, 4),
+            "within_tolerance": within,
+        })
+    report = pd.DataFrame(rows)
+    report["recommended"] = False
+    candidates = report[report["within_tolerance"]]
+    if len(candidates):
+        report.loc[candidates["seconds"].idxmin(), "recommended"] = True
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare fast blur / binning modes with the exact full-resolution analysis of one video.")
+    parser.add_argument("video", help="Well video (MP4 or AVI)")
+    parser.add_argument("--no-blur", action="store_true", help="Analysis without guassianBlur10 (only binning is compared)")
+    parser.add_argument("--modes", nargs="+", choices=BLUR_MODES, default=None, help="Blur modes to compare (box differs most from exact, up to ~20-30 grey levels)")
+    parser.add_argument("--binning", type=int, nargs="+", choices=BINNING_FACTORS, default=None, help="Binning factors to compare")
+    parser.add_argument("--framerate", type=float, default=DEFAULT_RECORDED_FRAMERATE, help="recordedFramerate")
+    parser.add_argument("--reference-frame", type=int, default=1, help="referenceFrameSlice")
+    parser.add_argument("--max-project", action="store_true", help="Apply the SNR mask, as maxProject=1")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="Allowed relative error of the time parameters")
+    parser.add_argument("--frame-cache", nargs="?", const=DEFAULT_CACHE_DIR, default=None,
+                        help=f"Decode the video once into this cache directory (default: {DEFAULT_CACHE_DIR})")
+    parser.add_argument("--output", default=None, help="Also write the report to this CSV")
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.video):
+        print(f"Error: {args.video} is not a file")
+        sys.exit(1)
+
+    settings = None
+    if args.modes or args.binning:
+        modes = args.modes or (["exact"] if args.no_blur else list(BLUR_MODES))
+        settings = [(mode, binning) for binning in (args.binning or BINNING_FACTORS) for mode in modes]
+
+    report = accuracy_report(args.video, settings, blur=not args.no_blur, tolerance=args.tolerance,
+                             recorded_framerate=args.framerate, reference_frame=args.reference_frame,
+                             max_project=args.max_project, frame_cache=args.frame_cache)
+    print(report.to_string(index=False))
+    if args.output:
+        report.to_csv(args.output, index=False)
+        print(f"Report written to {args.output}")
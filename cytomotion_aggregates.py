@@ -0,0 +1,247 @@
+import os
+import sys
+import math
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from generate_summary_file import METRICS
+
+# -------------------------------
+# Mergeable per-well aggregates
+# -------------------------------
+# For every well and metric the results store keeps a small aggregate record instead
+# of only the raw per-beat rows:
+#   count, mean, m2  Welford state (merged with Chan's formula), so mean/std/CI/CV of
+#                    any group of wells are exact without re-reading a CSV
+#   min, max
+#   values           the sorted values themselves while there are at most EXACT_LIMIT
+#                    (a well has tens of beats), so a well's median is exact
+#   sketch           above that, a log-bucket quantile sketch (DDSketch) with relative
+#                    accuracy SKETCH_ACCURACY; merging two sketches adds bucket counts
+#
+# The records sit next to the Parquet tables, partitioned the same way:
+#   <store>/aggregates/cp=CP012/day=D33/plate=P001/well=001/aggregate.json
+# A plate, day or compound (CP) rollup merges the records under that partition, and
+# re-running a well only rewrites its own record.
+
+AGGREGATE_VERSION = 1
+EXACT_LIMIT = 256
+SKETCH_ACCURACY = 0.01
+ROLLUP_LEVELS = ("cp", "day", "plate", "well")
+
+
+class MetricAggregate:
+    """Mergeable summary of the values of one metric: Welford state plus exact values or a quantile sketch."""
+
+    def __init__(self, values=None):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.values = []  # sorted, while count <= EXACT_LIMIT
+        self.sketch = None  # {"pos": {index: count}, "neg": {index: count}, "zero": count}
+        if values is not None:
+            self.add(values)
+
+    # --- Building and merging ---
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        other = MetricAggregate()
+        other.count = len(values)
+        other.mean = float(values.mean())
+        other.m2 = float(((values - other.mean) ** 2).sum())
+        other.min = float(values.min())
+        other.max = float(values.max())
+        other.values = sorted(values.tolist())
+        self.merge(other)
+
+    def merge(self, other):
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+        else:
+            count = self.count + other.count
+            delta = other.mean - self.mean
+            self.mean += delta * other.count / count
+            self.m2 += other.m2 + delta * delta * self.count * other.count / count
+            self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+        if self.sketch is None and other.sketch is None and len(self.values) + len(other.values) <= EXACT_LIMIT:
+            self.values = sorted(self.values + other.values)
+            return self
+        self._to_sketch()
+        other_sketch = other.sketch if other.sketch is not None else _sketch_values(other.values)
+        for side in ("pos", "neg"):
+            for index, n in other_sketch[side].items():
+                self.sketch[side][index] = self.sketch[side].get(index, 0) + n
+        self.sketch["zero"] += other_sketch["zero"]
+        return self
+
+    def _to_sketch(self):
+        if self.sketch is None:
+            self.sketch = _sketch_values(self.values)
+            self.values = []
+
+    # --- Statistics ---
+
+    def quantile(self, q):
+        """q-quantile: exact (linear interpolation) for exact values, within SKETCH_ACCURACY otherwise."""
+        if self.count == 0:
+            return np.nan
+        if self.sketch is None:
+            return float(np.quantile(self.values, q))
+        rank = q * (self.count - 1)
+        seen = 0
+        gamma = _gamma()
+        buckets = [(-_bucket_value(i, gamma), n) for i, n in sorted(self.sketch["neg"].items(), reverse=True)]
+        buckets.append((0.0, self.sketch["zero"]))
+        buckets += [(_bucket_value(i, gamma), n) for i, n in sorted(self.sketch["pos"].items())]
+        for value, n in buckets:
+            seen += n
+            if seen > rank:
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def stats(self):
+        """Mean, Std, Median, 95% CI, CV% and Count, as the summary computes them per well."""
+        n = self.count
+        mean = self.mean if n else np.nan
+        std = math.sqrt(self.m2 / (n - 1)) if n > 1 else np.nan
+        ci_95 = 1.96 * std / np.sqrt(n) if n > 1 else np.nan
+        cv = (std / mean) * 100 if mean != 0 else np.nan
+        return {"Mean": mean, "Std": std, "Median": self.quantile(0.5), "95% CI": ci_95, "CV%": cv, "Count": n}
+
+    # --- Serialization ---
+
+    def to_dict(self):
+        record = {"count": self.count, "mean": self.mean, "m2": self.m2}
+        if self.count:
+            record.update(min=self.min, max=self.max)
+        if self.sketch is None:
+            record["values"] = self.values
+        else:
+            record["sketch"] = {
+                "accuracy": SKETCH_ACCURACY, "zero": self.sketch["zero"],
+                "pos": {str(i): n for i, n in self.sketch["pos"].items()},
+                "neg": {str(i): n for i, n in self.sketch["neg"].items()},
+            }
+        return record
+
+    @classmethod
+    def from_dict(cls, record):
+        aggregate = cls()
+        aggregate.count, aggregate.mean, aggregate.m2 = record["count"], record["mean"], record["m2"]
+        aggregate.min = record.get("min", math.inf)
+        aggregate.max = record.get("max", -math.inf)
+        if "sketch" in record:
+            sketch = record["sketch"]
+            if sketch.get("accuracy") != SKETCH_ACCURACY:
+                raise ValueError(f"sketch accuracy {sketch.get('accuracy')} differs from {SKETCH_ACCURACY}")
+            aggregate.sketch = {
+                "zero": sketch["zero"],
+                "pos": {int(i): n for i, n in sketch["pos"].items()},
+                "neg": {int(i): n for i, n in sketch["neg"].items()},
+            }
+        else:
+            aggregate.values = list(record["values"])
+        return aggregate
+
+
+def _gamma():
+    return (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+
+
+def _bucket_value(index, gamma):
+    """Representative value of a bucket: within SKETCH_ACCURACY of every value in it."""
+    return 2 * gamma ** index / (gamma + 1)
+
+
+def _sketch_values(values):
+    gamma = _gamma()
+    sketch = {"pos": {}, "neg": {}, "zero": 0}
+    for value in values:
+        if value == 0:
+            sketch["zero"] += 1
+            continue
+        side = sketch["pos"] if value > 0 else sketch["neg"]
+        index = int(math.ceil(math.log(abs(value), gamma)))
+        side[index] = side.get(index, 0) + 1
+    return sketch
+
+
+# -------------------------------
+# Well records and rollups
+# -------------------------------
+
+def build_well_aggregate(fields, folder, metric_values):
+    """Aggregate record of one well from {metric prefix: array of per-beat values}."""
+    return {
+        "version": AGGREGATE_VERSION,
+        "folder": folder,
+        "fields": fields,
+        "metrics": {metric: MetricAggregate(metric_values.get(metric, ())).to_dict() for metric, _ in METRICS},
+    }
+
+
+def rollup_aggregates(records, level="plate"):
+    """
+    Statistics per cp, day, plate or well (level), merged from well aggregate records.
+    Returns a DataFrame with the group fields, the well count and, per metric,
+    the summary's Mean / Std / Median / 95% CI / CV% / Count columns.
+    """
+    if level not in ROLLUP_LEVELS:
+        raise ValueError(f"Unknown level {level}, expected one of {', '.join(ROLLUP_LEVELS)}")
+    group_fields = ROLLUP_LEVELS[:ROLLUP_LEVELS.index(level) + 1]
+
+    groups = {}
+    for record in records:
+        key = tuple(record["fields"][field] for field in group_fields)
+        group = groups.setdefault(key, {"wells": 0, "metrics": {metric: MetricAggregate() for metric, _ in METRICS}})
+        group["wells"] += 1
+        for metric, state in record["metrics"].items():
+            if metric in group["metrics"]:
+                group["metrics"][metric].merge(MetricAggregate.from_dict(state))
+
+    rows = []
+    for key, group in sorted(groups.items()):
+        row = dict(zip(group_fields, key))
+        row["Wells"] = group["wells"]
+        for metric, aggregate in group["metrics"].items():
+            for stat, value in aggregate.stats().items():
+                row[f"{metric} {stat}"] = round(value, 3) if pd.notna(value) else np.nan
+        rows.append(row)
+    return pd.DataFrame(rows, columns=None if rows else list(group_fields) + ["Wells"])
+
+
+if __name__ == "__main__":
+    from cytomotion_results_store import rollup
+
+    parser = argparse.ArgumentParser(description="Roll per-well aggregates of the results store up to plate, day or compound level.")
+    parser.add_argument("store", help="Results store directory")
+    parser.add_argument("--level", choices=ROLLUP_LEVELS, default="plate", help="Level to roll up to")
+    parser.add_argument("--cp", nargs="+", default=None, help="Only these compounds, e.g. CP012")
+    parser.add_argument("--day", nargs="+", default=None, help="Only these days, e.g. D33")
+    parser.add_argument("--plate", nargs="+", default=None, help="Only these plates, e.g. P001")
+    parser.add_argument("--output", default=None, help="Write the rollup to this CSV")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.store):
+        print(f"Error: '{args.store}' is not a valid directory.")
+        sys.exit(1)
+
+    table = rollup(args.store, args.level, args.cp, args.day, args.plate)
+    if args.output:
+        table.to_csv(args.output, index=False)
+        print(f"Rollup of {len(table)} groups written to {args.output}")
+    else:
+        print(table.to_string(index=False))
@@ -0,0 +1,184 @@
+import os
+import re
+import sys
+import stat
+
+# -------------------------------
+# Results directory catalog
+# -------------------------------
+# The postprocessing steps used to walk base_dir independently (os.walk, os.listdir +
+# isdir/isfile per entry), which on a network share means the same metadata round trips
+# several times. The catalog scans the tree once with os.scandir, keeps the stat result
+# of every file and parses the CPxxx_Dxx_Pxxx_yyy-Contr-Results tags up front. Steps that
+# rename or rewrite files update it in place instead of rescanning.
+
+# <tag>-Contr-Results, or <tag>-Contr-Results-N when the well was analysed again into the same folder
+RESULTS_FOLDER_PATTERN = re.compile(r"^(CP\d+)_(D\d+)_P(\d+)_(\d+)-Contr-Results(?:-(\d+))?$")
+
+
+def parse_results_fields(folder_name):
+    """
+    {"cp", "day", "plate", "well", "run"} of a results folder name, or None if it does not match.
+    "run" is N of a -Contr-Results-N folder, 0 for the first one.
+    Example: CP012_D33_P1_001-Contr-Results-2 -> CP012, D33, P001, 001, 2
+    """
+    match = RESULTS_FOLDER_PATTERN.match(folder_name)
+    if not match:
+        return None
+    cp, dxx, plate_num, last_number, run = match.groups()
+    return {"cp": cp, "day": dxx, "plate": f"P{plate_num.zfill(3)}", "well": last_number, "run": int(run or 0)}
+
+
+def parse_results_tag(folder_name):
+    """
+    CPxxx_Dxx_Pxxx_yyy tag of a results folder name, or None if it does not match.
+    Example: CP012_D33_P001_001-Contr-Results -> CP012_D33_P001_001
+    """
+    fields = parse_results_fields(folder_name)
+    if not fields:
+        return None
+    return f"{fields['cp']}_{fields['day']}_{fields['plate']}_{fields['well']}"
+
+
+class ResultsCatalog:
+    """
+    Snapshot of a results tree: for every directory (in os.walk order) its files with
+    their stat results (None if the entry could not be stat'ed, e.g. a broken link) and
+    its subdirectories, plus the parsed tag of every direct subfolder of base_dir.
+    """
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+        self.dirs = {}
+        self.tags = {}
+        self._scan(base_dir)
+        for name in self.subfolders():
+            self.tags[name] = parse_results_tag(name)
+
+    def _scan(self, dir_path):
+        files = {}
+        subdirs = []
+        try:
+            with os.scandir(dir_path) as entries:
+                entries = list(entries)
+        except OSError as e:
+            print(f"Warning: could not scan {dir_path}: {e}")
+            entries = []
+
+        recurse = []
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                subdirs.append(entry.name)
+                # Like os.walk, list symlinked directories but do not follow them
+                if not entry.is_symlink():
+                    recurse.append(entry.path)
+                continue
+            try:
+                files[entry.name] = entry.stat()
+            except OSError:
+                files[entry.name] = None
+
+        self.dirs[dir_path] = {"files": files, "subdirs": subdirs}
+        for path in recurse:
+            self._scan(path)
+
+    def walk(self, top=None):
+        """Yield (dir path, file names) top-down in the order os.walk(top) would (default: base_dir)."""
+        def walk_dir(dir_path):
+            entry = self.dirs.get(dir_path)
+            if entry is None:
+                return
+            yield dir_path, list(entry["files"])
+            for name in entry["subdirs"]:
+                yield from walk_dir(os.path.join(dir_path, name))
+        yield from walk_dir(self.base_dir if top is None else top)
+
+    def subfolders(self):
+        """Names of the direct subfolders of base_dir."""
+        return list(self.dirs[self.base_dir]["subdirs"])
+
+    def files(self, dir_path):
+        """{file name: stat result} of the files directly inside dir_path (empty if unknown)."""
+        entry = self.dirs.get(dir_path)
+        return dict(entry["files"]) if entry else {}
+
+    def regular_files(self, dir_path):
+        """Names of the entries of dir_path that are regular files (os.path.isfile)."""
+        return [name for name, st in self.files(dir_path).items()
+                if st is not None and stat.S_ISREG(st.st_mode)]
+
+    def contains(self, path):
+        """os.path.exists for a path inside the catalog, answered from the snapshot."""
+        dir_path, name = os.path.split(path)
+        entry = self.dirs.get(dir_path)
+        return entry is not None and (name in entry["files"] or name in entry["subdirs"])
+
+    def tag(self, folder_name):
+        """Parsed tag of a direct subfolder of base_dir (None if it does not match)."""
+        if folder_name not in self.tags:
+            self.tags[folder_name] = parse_results_tag(folder_name)
+        return self.tags[folder_name]
+
+    def scan_folder(self, path):
+        """(Re)scan one folder inside the tree, e.g. a results folder written after the catalog was built."""
+        parent, name = os.path.split(path)
+        entry = self.dirs.get(parent)
+        if entry is None:
+            return
+        if name not in entry["subdirs"]:
+            entry["subdirs"].append(name)
+        for dir_path in [d for d in self.dirs if d == path or d.startswith(path + os.sep)]:
+            del self.dirs[dir_path]
+        self._scan(path)
+        if parent == self.base_dir:
+            self.tags[name] = parse_results_tag(name)
+
+    def reorder_subfolders(self):
+        """Put the subfolders of base_dir back in directory (os.walk) order after scan_folder appended new ones."""
+        order = {name: i for i, name in enumerate(os.listdir(self.base_dir))}
+        self.dirs[self.base_dir]["subdirs"].sort(key=lambda name: order.get(name, len(order)))
+
+    def refresh_file(self, path):
+        """Re-stat one file after it was written, adding it if it is new."""
+        dir_path, name = os.path.split(path)
+        entry = self.dirs.get(dir_path)
+        if entry is None:
+            return
+        try:
+            entry["files"][name] = os.stat(path)
+        except OSError:
+            entry["files"].pop(name, None)
+
+    def rename_file(self, old_path, new_path):
+        """Rename a file on disk and in the catalog (same directory), keeping its cached stat."""
+        os.rename(old_path, new_path)
+        dir_path, old_name = os.path.split(old_path)
+        entry = self.dirs.get(dir_path)
+        if entry is None:
+            return
+        st = entry["files"].pop(old_name, None)
+        new_dir, new_name = os.path.split(new_path)
+        if new_dir == dir_path:
+            entry["files"][new_name] = st
+        else:
+            self.refresh_file(new_path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python cytomotion_catalog.py <base_directory>")
+        sys.exit(1)
+
+    base_dir = sys.argv[1]
+    if not os.path.isdir(base_dir):
+        print(f"Error: '{base_dir}' is not a valid directory.")
+        sys.exit(1)
+
+    catalog = ResultsCatalog(base_dir)
+    for name in catalog.subfolders():
+        path = os.path.join(base_dir, name)
+        print(f"{name}: tag={catalog.tag(name)}, files={len(catalog.regular_files(path))}")
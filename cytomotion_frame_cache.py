@@ -0,0 +1,237 @@
+import os
+import sys
+import json
+import struct
+import argparse
+import tempfile
+from datetime import datetime
+
+import numpy as np
+
+from cytomotion_frame_reader import iter_frames, get_video_info, open_avi_writer, DEFAULT_BUFFER_SIZE
+from cytomotion_video_probe import quick_hash
+
+# -------------------------------
+# Decoded frame cache
+# -------------------------------
+# The macro re-opens a well for every pass (reference frame, pixelsOfInterest,
+# getContractionData, getSpeedData); with autodetectReferenceFrame and maxProject the
+# analysis also reads a well up to three times. With the cache, a well is decoded once
+# into a raw (frames, height, width) array on scratch disk and every pass, and every
+# later run with other parameters, reads it through a read-only memory map.
+#
+# One file per well, <video name>-<source hash>.frames:
+#   bytes 0..4095  header: b"CYTOFRM1", uint32 JSON length, JSON
+#                  {"version", "shape", "dtype", "fps", "source": {"name", "size", "hash"}, "created"}
+#   bytes 4096..   the frames, C order (uint8 for 8-bit videos)
+# The source hash is the probe's quick hash, so a re-encoded or replaced video gets a new
+# file. Files are written as .part and renamed when complete. The cache is kept under a
+# size cap by deleting the least recently used files (mtime is touched on every hit).
+# The cache directory is set with configure_frame_cache() or CYTOMOTION_FRAME_CACHE,
+# which worker processes inherit; without it the analysis streams from the video.
+
+FRAME_CACHE_ENV = "CYTOMOTION_FRAME_CACHE"
+FRAME_CACHE_LIMIT_ENV = "CYTOMOTION_FRAME_CACHE_MB"
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), "cytomotion_frame_cache")
+DEFAULT_LIMIT_MB = 20480
+CACHE_MAGIC = b"CYTOFRM1"
+CACHE_VERSION = 1
+HEADER_SIZE = 4096
+CACHE_EXTENSION = ".frames"
+
+
+def configure_frame_cache(cache_dir=None, limit_mb=None):
+    """Set the cache directory (and size cap) for this process and its children; None disables the cache."""
+    for env, value in ((FRAME_CACHE_ENV, os.path.abspath(cache_dir) if cache_dir else None),
+                       (FRAME_CACHE_LIMIT_ENV, str(limit_mb) if limit_mb else None)):
+        if value:
+            os.environ[env] = value
+        else:
+            os.environ.pop(env, None)
+
+
+def get_frame_cache_dir():
+    return os.environ.get(FRAME_CACHE_ENV)
+
+
+def get_limit_bytes(limit_mb=None):
+    if limit_mb is None:
+        limit_mb = float(os.environ.get(FRAME_CACHE_LIMIT_ENV) or DEFAULT_LIMIT_MB)
+    return int(limit_mb * 1024 * 1024)
+
+
+def get_cache_path(cache_dir, video_path, source_hash):
+    name = os.path.splitext(os.path.basename(video_path))[0]
+    return os.path.join(cache_dir, f"{name}-{source_hash[:16]}{CACHE_EXTENSION}")
+
+
+def encode_header(header):
+    data = json.dumps(header, sort_keys=True).encode("utf-8")
+    if len(CACHE_MAGIC) + 4 + len(data) > HEADER_SIZE:
+        raise ValueError("frame cache header too large")
+    return (CACHE_MAGIC + struct.pack("<I", len(data)) + data).ljust(HEADER_SIZE, b"\0")
+
+
+def read_header(path):
+    """Header of a cache file, or None if it is not a complete cache file."""
+    try:
+        with open(path, "rb") as f:
+            raw = f.read(HEADER_SIZE)
+        if len(raw) < HEADER_SIZE or not raw.startswith(CACHE_MAGIC):
+            return None
+        (length,) = struct.unpack_from("<I", raw, len(CACHE_MAGIC))
+        header = json.loads(raw[len(CACHE_MAGIC) + 4:len(CACHE_MAGIC) + 4 + length].decode("utf-8"))
+        if header.get("version") != CACHE_VERSION:
+            return None
+        expected = HEADER_SIZE + int(np.prod(header["shape"])) * np.dtype(header["dtype"]).itemsize
+        if os.path.getsize(path) != expected:
+            return None
+        return header
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def map_frames(path, header):
+    """Read-only memory map of the frames of a cache file."""
+    return np.memmap(path, dtype=np.dtype(header["dtype"]), mode="r", offset=HEADER_SIZE,
+                     shape=tuple(header["shape"]))
+
+
+def list_cache_files(cache_dir):
+    """[(path, size, mtime)] of the complete cache files, least recently used first."""
+    files = []
+    try:
+        entries = list(os.scandir(cache_dir))
+    except OSError:
+        return files
+    for entry in entries:
+        if entry.name.endswith(CACHE_EXTENSION) and entry.is_file():
+            st = entry.stat()
+            files.append((entry.path, st.st_size, st.st_mtime))
+    files.sort(key=lambda item: item[2])
+    return files
+
+
+def evict(cache_dir, limit_bytes, incoming=0, keep=()):
+    """Delete least recently used files until the cache plus `incoming` bytes fits the cap. Returns bytes freed."""
+    files = list_cache_files(cache_dir)
+    total = sum(size for _, size, _ in files) + incoming
+    freed = 0
+    for path, size, _ in files:
+        if total <= limit_bytes:
+            break
+        if path in keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue  # removed by another worker
+        total -= size
+        freed += size
+    return freed
+
+
+def build_cache_file(video_path, path, header, buffer_size=DEFAULT_BUFFER_SIZE, avi_path=None):
+    """Decode a video into a cache file. Returns the completed header."""
+    part_path = f"{path}.{os.getpid()}.part"
+    shape = None
+    dtype = None
+    count = 0
+    try:
+        with open(part_path, "wb") as f:
+            f.write(b"\0" * HEADER_SIZE)
+            for frame in iter_frames(video_path, buffer_size=buffer_size, avi_path=avi_path):
+                if shape is None:
+                    shape, dtype = frame.shape, frame.dtype
+                elif frame.shape != shape:
+                    raise ValueError(f"frame {count + 1} of {video_path} is {frame.shape}, expected {shape}")
+                f.write(np.ascontiguousarray(frame).data)
+                count += 1
+            if shape is None:
+                raise ValueError(f"{video_path} has no frames")
+            header = dict(header, shape=[count] + list(shape), dtype=np.dtype(dtype).name)
+            f.seek(0)
+            f.write(encode_header(header))
+        os.replace(part_path, path)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    return header
+
+
+def write_avi_from_frames(frames, avi_path, fps):
+    writer = open_avi_writer(avi_path, fps, frames.shape[2], frames.shape[1])
+    try:
+        for frame in frames:
+            writer.write(np.asarray(frame))
+    finally:
+        writer.release()
+
+
+def open_cached_frames(video_path, cache_dir=None, limit_mb=None, buffer_size=DEFAULT_BUFFER_SIZE, avi_path=None):
+    """
+    Frames of a video as a read-only (frames, height, width) memory map, decoding the video
+    into the cache first if it is not there yet. Returns (frames, header), or (None, None)
+    when the cache is disabled or the decoded video would not fit under the size cap.
+    If avi_path is given, an uncompressed AVI copy is written as well.
+    """
+    cache_dir = cache_dir or get_frame_cache_dir()
+    if not cache_dir:
+        return None, None
+    os.makedirs(cache_dir, exist_ok=True)
+    limit_bytes = get_limit_bytes(limit_mb)
+
+    size = os.path.getsize(video_path)
+    source = {"name": os.path.basename(video_path), "size": size, "hash": quick_hash(video_path, size)}
+    path = get_cache_path(cache_dir, video_path, source["hash"])
+
+    header = read_header(path)
+    if header is not None and header["source"] == source:
+        os.utime(path)  # most recently used
+        frames = map_frames(path, header)
+        if avi_path:
+            write_avi_from_frames(frames, avi_path, header["fps"])
+        return frames, header
+
+    info = get_video_info(video_path)
+    expected = info["frame_count"] * info["width"] * info["height"]
+    if HEADER_SIZE + expected > limit_bytes:
+        print(f"Frame cache: {video_path} does not fit in the cache ({expected / 1e6:.0f} MB), streaming it")
+        return None, None
+    evict(cache_dir, limit_bytes, incoming=HEADER_SIZE + expected, keep={path})
+
+    header = build_cache_file(video_path, path, {
+        "version": CACHE_VERSION, "fps": info["fps"], "source": source,
+        "created": datetime.now().isoformat(timespec="seconds"),
+    }, buffer_size, avi_path)
+    evict(cache_dir, limit_bytes, keep={path})
+    return map_frames(path, header), header
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show, trim or clear the decoded frame cache.")
+    parser.add_argument("cache_dir", nargs="?", default=None,
+                        help=f"Cache directory (default: ${FRAME_CACHE_ENV} or {DEFAULT_CACHE_DIR})")
+    parser.add_argument("--limit-mb", type=float, default=None, help="Trim the cache to this size")
+    parser.add_argument("--clear", action="store_true", help="Delete every cached well")
+    args = parser.parse_args()
+
+    cache_dir = args.cache_dir or get_frame_cache_dir() or DEFAULT_CACHE_DIR
+    if not os.path.isdir(cache_dir):
+        print(f"Error: {cache_dir} is not a valid directory")
+        sys.exit(1)
+
+    if args.clear:
+        freed = evict(cache_dir, 0)
+        print(f"Removed {freed / 1e6:.1f} MB")
+    elif args.limit_mb is not None:
+        freed = evict(cache_dir, get_limit_bytes(args.limit_mb))
+        print(f"Removed {freed / 1e6:.1f} MB")
+
+    files = list_cache_files(cache_dir)
+    for path, size, mtime in files:
+        header = read_header(path)
+        shape = "x".join(map(str, header["shape"])) if header else "unreadable"
+        print(f"{datetime.fromtimestamp(mtime):%Y-%m-%d %H:%M}  {size / 1e6:10.1f} MB  {shape:>16}  {os.path.basename(path)}")
+    print(f"{len(files)} wells, {sum(size for _, size, _ in files) / 1e6:.1f} MB in {cache_dir}")
@@ -0,0 +1,147 @@
+import os
+import sys
+import queue
+import threading
+
+import cv2
+
+# -------------------------------
+# Streaming frame reader
+# -------------------------------
+# Decodes MP4 (or AVI) wells straight into the analysis, without the intermediate
+# uncompressed-AVI stage. A background thread decodes ahead of the consumer into a
+# bounded queue, so at most `buffer_size` frames of a well are held in memory.
+# Writing an uncompressed AVI is still possible as an opt-in side output.
+
+DEFAULT_BUFFER_SIZE = 64
+
+_END_OF_STREAM = object()
+
+
+def get_video_info(path):
+    """Return container metadata of a video: frame count, fps, width and height."""
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise IOError(f"Could not open video {path}")
+    try:
+        return {
+            "frame_count": int(capture.get(cv2.CAP_PROP_FRAME_COUNT)),
+            "fps": capture.get(cv2.CAP_PROP_FPS),
+            "width": int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            "height": int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        }
+    finally:
+        capture.release()
+
+
+def _decode_frames(path):
+    """Yield the frames of a video as 2-D uint8 grayscale arrays (decoded in the calling thread)."""
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise IOError(f"Could not open video {path}")
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            if frame.ndim == 3:
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            yield frame
+    finally:
+        capture.release()
+
+
+def open_avi_writer(avi_path, fps, width, height):
+    """Open an uncompressed 8-bit grayscale AVI writer (the format the macro's openVirtualStack reads)."""
+    writer = cv2.VideoWriter(avi_path, 0, fps, (width, height), isColor=False)
+    if not writer.isOpened():
+        raise IOError(f"Could not open AVI writer for {avi_path}")
+    return writer
+
+
+def iter_frames(path, buffer_size=DEFAULT_BUFFER_SIZE, avi_path=None):
+    """
+    Yield the frames of a video as 2-D uint8 grayscale arrays.
+
+    Decoding runs in a background thread that stays at most `buffer_size` frames ahead
+    of the consumer. If avi_path is given, every decoded frame is also written to an
+    uncompressed AVI there (opt-in side output).
+    """
+    frames = queue.Queue(maxsize=max(1, buffer_size))
+    stop = threading.Event()
+
+    def put(item):
+        # Give up if the consumer went away, so the thread never blocks forever
+        while not stop.is_set():
+            try:
+                frames.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def decode():
+        writer = None
+        try:
+            if avi_path:
+                info = get_video_info(path)
+                writer = open_avi_writer(avi_path, info["fps"], info["width"], info["height"])
+            for frame in _decode_frames(path):
+                if writer is not None:
+                    writer.write(frame)
+                if not put(frame):
+                    return
+            put(_END_OF_STREAM)
+        except Exception as e:
+            put(e)
+        finally:
+            if writer is not None:
+                writer.release()
+
+    thread = threading.Thread(target=decode, name=f"decode-{os.path.basename(path)}", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = frames.get()
+            if item is _END_OF_STREAM:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def export_avi(video_path, avi_path=None):
+    """Write an uncompressed AVI copy of a video (next to it by default) and return its path."""
+    if avi_path is None:
+        avi_path = os.path.splitext(video_path)[0] + ".avi"
+    for _ in iter_frames(video_path, avi_path=avi_path):
+        pass
+    print(f"[✓] Exported: {video_path} -> {avi_path}")
+    return avi_path
+
+
+def export_all_avi(path):
+    """Write an uncompressed AVI copy of every MP4 directly inside path."""
+    for filename in sorted(os.listdir(path)):
+        video_path = os.path.join(path, filename)
+        if os.path.isfile(video_path) and filename.lower().endswith(".mp4"):
+            try:
+                export_avi(video_path)
+            except Exception as e:
+                print(f"[!] Failed to export {video_path}: {e}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python cytomotion_frame_reader.py <path_to_folder>")
+        sys.exit(1)
+
+    path = sys.argv[1]
+    if not os.path.isdir(path):
+        print(f"Error: {path} is not a valid directory")
+        sys.exit(1)
+
+    export_all_avi(path)
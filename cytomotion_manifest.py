@@ -0,0 +1,156 @@
+import os
+import sys
+import json
+import hashlib
+
+# -------------------------------
+# Postprocessing manifest
+# -------------------------------
+# Records, per results folder in base_dir, the size / mtime / SHA-256 of every file
+# and which postprocessing stages have completed. An incremental run only touches
+# folders whose files changed since they were last recorded (or that are new).
+#
+# {
+#   "version": 1,
+#   "folders": {
+#     "CP012_D33_P001_001-Contr-Results": {
+#       "files": {"Log_file.txt": [size, mtime_ns, sha256], ...},
+#       "stages": ["headers", "summary", "prefixes"]
+#     }
+#   }
+# }
+
+MANIFEST_FILE = "postprocessing_manifest.json"
+MANIFEST_VERSION = 1
+STAGES = ("headers", "summary", "prefixes")
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def load_manifest(base_dir):
+    """Load the manifest of base_dir, or an empty one if there is none (or it is unreadable)."""
+    path = os.path.join(base_dir, MANIFEST_FILE)
+    if os.path.isfile(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("version") == MANIFEST_VERSION:
+                return manifest
+            print(f"Warning: manifest {path} has an unknown version, starting a new one")
+        except (OSError, ValueError) as e:
+            print(f"Warning: could not read manifest {path}: {e}")
+    return {"version": MANIFEST_VERSION, "folders": {}}
+
+
+def save_manifest(base_dir, manifest):
+    """Write the manifest atomically (temp file + rename), so an interrupted run never leaves it half written."""
+    path = os.path.join(base_dir, MANIFEST_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def file_sha256(path):
+    """SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fingerprint_folder(folder_path, previous=None, catalog=None):
+    """
+    {file name: [size, mtime_ns, sha256]} for the files directly inside folder_path.
+    Hashes from `previous` are reused when size and mtime are unchanged. With a catalog,
+    its cached stat results are used instead of scanning the folder again.
+    """
+    previous = previous or {}
+    if catalog is not None:
+        stats = catalog.files(folder_path)
+        entries = [(name, stats[name]) for name in catalog.regular_files(folder_path)]
+    else:
+        with os.scandir(folder_path) as scan:
+            entries = [(entry.name, entry.stat()) for entry in scan if entry.is_file()]
+
+    files = {}
+    for name, stat in entries:
+        old = previous.get(name)
+        if old and old[0] == stat.st_size and old[1] == stat.st_mtime_ns:
+            files[name] = old
+        else:
+            files[name] = [stat.st_size, stat.st_mtime_ns, file_sha256(os.path.join(folder_path, name))]
+    return files
+
+
+def same_content(old_files, new_files):
+    """True if two fingerprints list the same files with the same sizes and hashes (mtimes may differ)."""
+    if old_files.keys() != new_files.keys():
+        return False
+    return all(old_files[name][0] == new_files[name][0] and old_files[name][2] == new_files[name][2]
+               for name in new_files)
+
+
+def list_results_folders(base_dir):
+    """Names of the subfolders of base_dir (the -Contr-Results folders)."""
+    with os.scandir(base_dir) as entries:
+        return sorted(entry.name for entry in entries if entry.is_dir())
+
+
+def find_changed_folders(base_dir, manifest, folders=None, catalog=None):
+    """
+    Compare base_dir with the manifest.
+    Returns (changed, removed): results folders that are new, changed or have unfinished
+    stages, and recorded folders that no longer exist.
+    """
+    recorded = manifest["folders"]
+    if folders is None:
+        folders = sorted(catalog.subfolders()) if catalog is not None else list_results_folders(base_dir)
+    changed = []
+    for name in folders:
+        entry = recorded.get(name)
+        if entry is None or set(entry.get("stages", [])) != set(STAGES):
+            changed.append(name)
+            continue
+        files = fingerprint_folder(os.path.join(base_dir, name), entry["files"], catalog)
+        if not same_content(entry["files"], files):
+            changed.append(name)
+        else:
+            # Only mtimes moved (e.g. touched or copied): refresh them so the hash is not recomputed next time
+            entry["files"] = files
+    removed = sorted(set(recorded) - set(folders))
+    return changed, removed
+
+
+def record_folder(base_dir, manifest, name, stages=STAGES, catalog=None):
+    """Store the current fingerprint of a results folder and the stages completed on it."""
+    previous = manifest["folders"].get(name, {}).get("files")
+    manifest["folders"][name] = {
+        "files": fingerprint_folder(os.path.join(base_dir, name), previous, catalog),
+        "stages": list(stages),
+    }
+
+
+def forget_folders(manifest, names):
+    """Drop folders from the manifest."""
+    for name in names:
+        manifest["folders"].pop(name, None)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python cytomotion_manifest.py <base_directory>")
+        sys.exit(1)
+
+    base_dir = sys.argv[1]
+    if not os.path.isdir(base_dir):
+        print(f"Error: '{base_dir}' is not a valid directory.")
+        sys.exit(1)
+
+    changed, removed = find_changed_folders(base_dir, load_manifest(base_dir))
+    print(f"Changed or new folders ({len(changed)}):")
+    for name in changed:
+        print(f"  {name}")
+    print(f"Removed folders ({len(removed)}):")
+    for name in removed:
+        print(f"  {name}")
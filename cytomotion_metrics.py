@@ -0,0 +1,252 @@
+import os
+import re
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+import contextlib
+import contextvars
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows: no peak RSS
+    resource = None
+
+# -------------------------------
+# Stage and well instrumentation
+# -------------------------------
+# Every pipeline stage (and every well analysis) can be wrapped in `with stage(...)`,
+# which appends one JSON line to the metrics file when it ends:
+#
+#   {"time": ..., "event": "stage", "stage": "motion_analysis", "well": "CP011_D25_P001_001",
+#    "status": "ok", "wall_s": 12.3, "cpu_s": 11.9, "bytes_read": ..., "bytes_written": ...,
+#    "frames": 1500, "peak_rss_mb": 310.2, "pid": 1234, "host": "..."}
+#
+# Code running inside a stage adds counters with record(frames=...). Bytes come from
+# /proc/self/io (rchar/wchar, so page-cache hits count too) and are process-wide, as is
+# the peak RSS (the process maximum so far). Without a configured metrics file nothing
+# is written. The file is set with configure_metrics() or CYTOMOTION_METRICS_FILE, which
+# worker processes inherit. The macro's own "Elapsed time (ms)" of each well is collected
+# from the Log_file.txt files as "well_log" events.
+
+METRICS_ENV = "CYTOMOTION_METRICS_FILE"
+PROMETHEUS_ENV = "CYTOMOTION_PROMETHEUS_FILE"
+
+_current_event = contextvars.ContextVar("cytomotion_metrics_event", default=None)
+_write_lock = threading.Lock()
+
+
+def configure_metrics(path=None, prometheus_path=None):
+    """Set the JSON-lines file (and optional Prometheus textfile) for this process and its children."""
+    for env, value in ((METRICS_ENV, path), (PROMETHEUS_ENV, prometheus_path)):
+        if value:
+            os.environ[env] = os.path.abspath(value)
+        else:
+            os.environ.pop(env, None)
+
+
+def get_metrics_path():
+    return os.environ.get(METRICS_ENV)
+
+
+def get_io_counters():
+    """(bytes read, bytes written) by this process so far, or (None, None) if unknown."""
+    try:
+        with open("/proc/self/io", "r") as f:
+            counters = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def get_peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def emit(event):
+    """Append one event to the metrics file (no-op when metrics are not configured)."""
+    path = get_metrics_path()
+    if not path:
+        return
+    event = dict({"time": datetime.now().isoformat(timespec="milliseconds")}, **event)
+    line = json.dumps(event, default=str) + "\n"
+    # One write per line in append mode, so lines of concurrent processes do not interleave
+    with _write_lock:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+def record(**counters):
+    """Add counters (e.g. frames=1500) to the innermost running stage, if any."""
+    event = _current_event.get()
+    if event is not None:
+        for key, value in counters.items():
+            event[key] = event.get(key, 0) + value if isinstance(value, (int, float)) else value
+
+
+@contextlib.contextmanager
+def stage(name, **fields):
+    """Measure a stage and emit its event when it ends (also when it raises)."""
+    event = {"event": "stage", "stage": name}
+    event.update(fields)
+    token = _current_event.set(event)
+    read_start, written_start = get_io_counters()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield event
+        event.setdefault("status", "ok")
+    except BaseException as e:
+        event["status"] = "error"
+        event["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_event.reset(token)
+        event["wall_s"] = round(time.perf_counter() - wall_start, 4)
+        event["cpu_s"] = round(time.process_time() - cpu_start, 4)
+        read_end, written_end = get_io_counters()
+        if read_start is not None and read_end is not None:
+            event["bytes_read"] = read_end - read_start
+            event["bytes_written"] = written_end - written_start
+        event["peak_rss_mb"] = get_peak_rss_mb()
+        event["pid"] = os.getpid()
+        event["host"] = socket.gethostname()
+        emit(event)
+
+
+def read_log_elapsed(log_path):
+    """(elapsed ms, slices) from a Log_file.txt; None for values that are missing."""
+    elapsed = slices = None
+    try:
+        with open(log_path, "r") as f:
+            for line in f:
+                match = re.match(r"\s*Elapsed time \(ms\):\s*(\d+)", line)
+                if match:
+                    elapsed = int(match.group(1))
+                match = re.match(r"\s*Slices:\s*(\d+)", line)
+                if match:
+                    slices = int(match.group(1))
+    except OSError:
+        pass
+    return elapsed, slices
+
+
+def collect_log_elapsed(base_dir, catalog=None):
+    """
+    Emit a "well_log" event with the macro's Elapsed time of every results folder of
+    base_dir, and return them as a list of dicts.
+    """
+    from generate_summary_file import find_log_file
+
+    if catalog is not None:
+        folders = catalog.subfolders()
+    else:
+        folders = sorted(f for f in os.listdir(base_dir) if os.path.isdir(os.path.join(base_dir, f)))
+
+    wells = []
+    for name in folders:
+        log_path = find_log_file(os.path.join(base_dir, name), catalog)
+        elapsed, slices = read_log_elapsed(log_path)
+        if elapsed is None:
+            continue
+        event = {"event": "well_log", "well": name, "elapsed_ms": elapsed, "slices": slices}
+        if slices and elapsed:
+            event["frames_per_s"] = round(slices / (elapsed / 1000), 1)
+        emit(event)
+        wells.append(event)
+    return wells
+
+
+def read_events(path):
+    events = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    continue
+    return events
+
+
+def summarize_events(events):
+    """Totals per stage: runs, errors, wall/CPU seconds, frames, bytes and max peak RSS."""
+    totals = {}
+    for event in events:
+        if event.get("event") == "stage":
+            key = event["stage"]
+            wall = event.get("wall_s", 0)
+        elif event.get("event") == "well_log":
+            key = "macro_elapsed"
+            wall = event.get("elapsed_ms", 0) / 1000
+        else:
+            continue
+        total = totals.setdefault(key, {"runs": 0, "errors": 0, "wall_s": 0.0, "cpu_s": 0.0, "frames": 0,
+                                        "bytes_read": 0, "bytes_written": 0, "peak_rss_mb": 0.0})
+        total["runs"] += 1
+        total["errors"] += event.get("status") == "error"
+        total["wall_s"] += wall
+        total["frames"] += event.get("frames", event.get("slices", 0)) or 0
+        for field in ("cpu_s", "bytes_read", "bytes_written"):
+            total[field] += event.get(field) or 0
+        total["peak_rss_mb"] = max(total["peak_rss_mb"], event.get("peak_rss_mb") or 0)
+    return totals
+
+
+def write_prometheus(totals, path):
+    """Write stage totals in the Prometheus text format (for node_exporter's textfile collector)."""
+    metrics = [
+        ("cytomotion_stage_runs_total", "counter", "Stage executions", "runs", 1),
+        ("cytomotion_stage_errors_total", "counter", "Stage executions that failed", "errors", 1),
+        ("cytomotion_stage_seconds_total", "counter", "Wall time spent in the stage", "wall_s", 1),
+        ("cytomotion_stage_cpu_seconds_total", "counter", "CPU time spent in the stage", "cpu_s", 1),
+        ("cytomotion_stage_frames_total", "counter", "Frames processed in the stage", "frames", 1),
+        ("cytomotion_stage_read_bytes_total", "counter", "Bytes read during the stage", "bytes_read", 1),
+        ("cytomotion_stage_written_bytes_total", "counter", "Bytes written during the stage", "bytes_written", 1),
+        ("cytomotion_stage_peak_rss_bytes", "gauge", "Largest peak RSS of a process running the stage",
+         "peak_rss_mb", 1024 * 1024),
+    ]
+    lines = []
+    for metric, kind, help_text, field, scale in metrics:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for name, total in sorted(totals.items()):
+            lines.append(f'{metric}{{stage="{name}"}} {total[field] * scale:g}')
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(path + ".tmp", path)
+
+
+def export_prometheus(metrics_path=None, prometheus_path=None):
+    """Rewrite the Prometheus textfile from the metrics file, if both are configured."""
+    metrics_path = metrics_path or get_metrics_path()
+    prometheus_path = prometheus_path or os.environ.get(PROMETHEUS_ENV)
+    if metrics_path and prometheus_path and os.path.isfile(metrics_path):
+        write_prometheus(summarize_events(read_events(metrics_path)), prometheus_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize a CytoMotion metrics file.")
+    parser.add_argument("metrics_file", help="JSON-lines file written by the pipeline")
+    parser.add_argument("--prometheus", default=None, help="Also write a Prometheus textfile here")
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.metrics_file):
+        print(f"Error: {args.metrics_file} is not a file")
+        sys.exit(1)
+
+    totals = summarize_events(read_events(args.metrics_file))
+    print(f"{'stage':>28} {'runs':>6} {'errors':>6} {'wall s':>10} {'cpu s':>10} {'frames':>10} {'peak MB':>8}")
+    for name, total in sorted(totals.items(), key=lambda item: -item[1]["wall_s"]):
+        print(f"{name:>28} {total['runs']:>6} {total['errors']:>6} {total['wall_s']:>10.1f} "
+              f"{total['cpu_s']:>10.1f} {total['frames']:>10} {total['peak_rss_mb']:>8.1f}")
+    if args.prometheus:
+        write_prometheus(totals, args.prometheus)
+        print(f"Prometheus textfile written to {args.prometheus}")
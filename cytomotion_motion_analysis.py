@@ -0,0 +1,677 @@
+import os
+import sys
+import time
+import itertools
+from datetime import datetime
+
+import numpy as np
+import cv2
+
+from cytomotion_frame_reader import iter_frames, DEFAULT_BUFFER_SIZE
+from cytomotion_frame_cache import open_cached_frames
+from cytomotion_transient_analysis import transient_analysis, write_results_csv, RESULTS_FILE
+from cytomotion_metrics import stage, record
+from cytomotion_trace_container import write_trace_container, TRACE_FILE
+
+# -------------------------------
+# NumPy port of the MUSCLEMOTION contraction / speed loops
+# -------------------------------
+# getContractionData() : mean(|frame[i] - reference|) for every frame except the reference
+# getSpeedData()       : mean(|frame[i] - frame[i + speedWindow]|) on the same stack
+# Both traces are computed in a single decode of the video, in blocks of frames,
+# keeping only the last `speed_window` frames between blocks (ring buffer).
+# Passes that need the stack again (autodetect, maxProject) decode it again, unless the
+# decoded frame cache is enabled (cytomotion_frame_cache).
+
+VERSION_NUMBER = "1.0"
+
+# Defaults mirror the DEFAULT VALUES block of MUSCLEMOTION v1.0.ijm
+DEFAULT_RECORDED_FRAMERATE = 100
+DEFAULT_SPEED_WINDOW = 2
+DEFAULT_MP_START_RANGE = 1
+DEFAULT_MP_END_RANGE = -1  # -1 is infinite
+DEFAULT_AUTO_DETECT_START = 1
+DEFAULT_AUTO_DETECT_STOP = 300
+DEFAULT_LOW_VALUE_N = 20
+DEFAULT_UNITY_SELECTION_N = 10
+GAUSSIAN_SIGMA = 10
+GAUSSIAN_ACCURACY = 0.002  # ImageJ kernel accuracy for 8-bit images
+DEFAULT_CHUNK_SIZE = 32
+
+# Compute modes for guassianBlur10 and the difference images:
+#   exact     - 8-bit Gaussian blur per frame, the closest to the macro (see gaussian_blur)
+#   separable - truncated Gaussian as two 1-D passes over the whole float32 block
+#   box       - three box-filter passes approximating the Gaussian (cost independent of sigma);
+#               differs from exact by up to ~20-30 grey levels on fine, high-contrast texture
+#   fft       - Gaussian transfer function applied in the frequency domain, per block
+# With binning > 1, frames are averaged over binning x binning tiles before the blur and
+# the differences; the non-exact blurs then run at sigma / binning on the binned frames.
+BLUR_MODES = ("exact", "separable", "box", "fft")
+BINNING_FACTORS = (1, 2, 4, 8)
+BOX_PASSES = 3
+FFT_BATCH_SIZE = 4
+
+VIDEO_EXTENSIONS = (".mp4", ".avi")
+
+
+def gaussian_radius(sigma=GAUSSIAN_SIGMA):
+    """Kernel radius ImageJ uses for a given sigma at 8-bit accuracy."""
+    return int(np.ceil(sigma * np.sqrt(-2 * np.log(GAUSSIAN_ACCURACY)))) + 1
+
+
+def gaussian_blur(frame, sigma=GAUSSIAN_SIGMA):
+    """
+    Gaussian blur of one 8-bit frame approximating run("Gaussian Blur...", "sigma=10"):
+    a full-resolution kernel truncated at ImageJ's 8-bit accuracy, edge pixels extended,
+    result rounded to 8-bit. It is not bit-identical to ImageJ, which for sigma > 4.5
+    downscales, blurs and upscales again and corrects the edges with the kernel sum.
+    """
+    ksize = 2 * gaussian_radius(sigma) + 1
+    return cv2.GaussianBlur(frame, (ksize, ksize), sigma, borderType=cv2.BORDER_REPLICATE)
+
+
+def _filter_block(block, kernel_x, kernel_y):
+    """
+    Separable filter of a whole (frames, height, width) float32 block with two cv2 passes:
+    rows on the (frames * height, width) view, columns on a (height, frames * width) layout,
+    so neither pass mixes pixels of different frames.
+    """
+    n, h, w = block.shape
+    one = np.ones(1, dtype=np.float32)
+    rows = cv2.sepFilter2D(np.ascontiguousarray(block).reshape(n * h, w), cv2.CV_32F, kernel_x, one,
+                           borderType=cv2.BORDER_REPLICATE)
+    columns = np.ascontiguousarray(rows.reshape(n, h, w).transpose(1, 0, 2)).reshape(h, n * w)
+    columns = cv2.sepFilter2D(columns, cv2.CV_32F, one, kernel_y, borderType=cv2.BORDER_REPLICATE)
+    return np.ascontiguousarray(columns.reshape(h, n, w).transpose(1, 0, 2))
+
+
+def box_sizes(sigma, passes=BOX_PASSES):
+    """Odd box widths whose repeated application approximates a Gaussian of sigma (Kovesi)."""
+    ideal = np.sqrt(12 * sigma * sigma / passes + 1)
+    lower = int(np.floor(ideal))
+    lower -= (lower + 1) % 2
+    upper = lower + 2
+    m = int(round((12 * sigma * sigma - passes * lower * lower - 4 * passes * lower - 3 * passes) / (-4 * lower - 4)))
+    return [lower if i < m else upper for i in range(passes)]
+
+
+def _fft_blur(block, sigma):
+    """Gaussian blur in the frequency domain, edges extended by the kernel radius to avoid wrap-around."""
+    radius = gaussian_radius(sigma)
+    n, h, w = block.shape
+    fy = np.fft.fftfreq(h + 2 * radius)[:, None]
+    fx = np.fft.rfftfreq(w + 2 * radius)[None, :]
+    transfer = np.exp(-2 * np.pi ** 2 * sigma ** 2 * (fy * fy + fx * fx))
+    out = np.empty_like(block)
+    for start in range(0, n, FFT_BATCH_SIZE):
+        padded = np.pad(block[start:start + FFT_BATCH_SIZE], ((0, 0), (radius, radius), (radius, radius)), mode="edge")
+        spectrum = np.fft.rfft2(padded, axes=(1, 2)) * transfer
+        blurred = np.fft.irfft2(spectrum, s=padded.shape[1:], axes=(1, 2))
+        out[start:start + FFT_BATCH_SIZE] = blurred[:, radius:radius + h, radius:radius + w]
+    return out
+
+
+def blur_block(block, sigma=GAUSSIAN_SIGMA, mode="separable"):
+    """Gaussian blur of a whole float32 (frames, height, width) block in one of the batch modes."""
+    block = np.asarray(block, dtype=np.float32)
+    if sigma <= 0 or block.size == 0:
+        return block
+    if mode == "separable":
+        radius = gaussian_radius(sigma)
+        kernel = np.exp(-0.5 * (np.arange(-radius, radius + 1) / sigma) ** 2).astype(np.float32)
+        kernel /= kernel.sum()
+        return _filter_block(block, kernel, kernel)
+    if mode == "box":
+        for size in box_sizes(sigma):
+            kernel = np.full(size, 1.0 / size, dtype=np.float32)
+            block = _filter_block(block, kernel, kernel)
+        return block
+    if mode == "fft":
+        return _fft_blur(block, sigma)
+    raise ValueError(f"Unknown blur mode {mode}, expected one of {', '.join(BLUR_MODES)}")
+
+
+def preprocess_frames(frames, blur=False, blur_mode="exact", binning=1):
+    """
+    Convert a block of frames to float32 (the macro's 32-bit difference images), blurring
+    first if requested. With binning > 1 the frames are tile-averaged as well.
+    """
+    if blur and blur_mode == "exact":
+        frames = [gaussian_blur(f) for f in frames]
+    data = np.asarray(frames, dtype=np.float32)
+    if binning > 1:
+        data = downsample_frames(data, binning)
+    if blur and blur_mode != "exact":
+        data = blur_block(data, GAUSSIAN_SIGMA / binning, blur_mode)
+    return data
+
+
+def check_compute_mode(blur_mode, binning):
+    if blur_mode not in BLUR_MODES:
+        raise ValueError(f"Unknown blur mode {blur_mode}, expected one of {', '.join(BLUR_MODES)}")
+    if binning not in BINNING_FACTORS:
+        raise ValueError(f"Binning must be one of {', '.join(map(str, BINNING_FACTORS))} (got {binning})")
+
+
+def frame_means(diff, mask=None):
+    """Per-frame mean of a block of difference images, optionally multiplied by the binary mask first."""
+    if mask is not None:
+        diff = diff * mask
+    return diff.reshape(len(diff), -1).mean(axis=1, dtype=np.float64)
+
+
+def iter_reference_blocks(frames, reference_frame=1, blur=False, chunk_size=DEFAULT_CHUNK_SIZE,
+                          blur_mode="exact", binning=1):
+    """
+    Split a stack into its reference frame and blocks of the remaining frames, as
+    openVirtualStack(name, true) does by deleting the reference slice.
+
+    Yields (reference, block, position) with both preprocessed, where position is the
+    0-based index of the block's first frame in the reference-removed stack.
+    Frames read before the reference slice stay buffered until it arrives.
+    """
+    reference = None
+    block = []
+    position = 0
+    slices = 0
+    for slices, frame in enumerate(frames, start=1):
+        if slices == reference_frame:
+            reference = preprocess_frames([frame], blur, blur_mode, binning)[0]
+            continue
+        block.append(frame)
+        if reference is not None and len(block) >= chunk_size:
+            yield reference, preprocess_frames(block, blur, blur_mode, binning), position
+            position += len(block)
+            block = []
+
+    if reference is None:
+        raise ValueError(f"Reference frame {reference_frame} is outside the stack ({slices} slices)")
+    if block:
+        yield reference, preprocess_frames(block, blur, blur_mode, binning), position
+
+
+def build_max_projection_mask(frames, reference_frame=1, start_range=DEFAULT_MP_START_RANGE,
+                              end_range=DEFAULT_MP_END_RANGE, blur=False, chunk_size=DEFAULT_CHUNK_SIZE,
+                              blur_mode="exact", binning=1):
+    """
+    Binary SNR mask of pixelsOfInterest(), built in a single streaming pass.
+
+    The macro re-projects a growing stack for every frame; the result is the same as an
+    element-wise running maximum of |frame - reference| over slices
+    start_range .. end_range - 1 of the reference-removed stack (end_range == -1: all).
+    Pixels in [mean + stdDev, max] of the projection are 255, all others 0.
+    """
+    max_projection = None
+    slices = 1
+    for reference, block, position in iter_reference_blocks(frames, reference_frame, blur, chunk_size,
+                                                            blur_mode, binning):
+        if max_projection is None:
+            # newImage("maxProjectStack", "32-bit black", ...)
+            max_projection = np.zeros_like(reference)
+        slices += len(block)
+
+        # lfhIndex runs over 1-based slices; only the part of the block inside the range counts.
+        # An end range beyond the stack is clipped to the stack, like MPendRange > slices.
+        first = max(start_range - 1 - position, 0)
+        last = len(block) if end_range == -1 else min(end_range - 1 - position, len(block))
+        if first < last:
+            diff = np.abs(block[first:last] - reference)
+            np.maximum(max_projection, diff.max(axis=0), out=max_projection)
+
+    if max_projection is None:
+        raise ValueError("Image was not a stack. Stack required for this analysis.")
+    threshold = max_projection.mean(dtype=np.float64) + max_projection.std(dtype=np.float64, ddof=1)
+    return np.where(max_projection >= threshold, 255, 0).astype(np.float32)
+
+
+def compute_motion_traces(frames, reference_frame=1, speed_window=DEFAULT_SPEED_WINDOW,
+                          blur=False, mask=None, chunk_size=DEFAULT_CHUNK_SIZE, blur_mode="exact", binning=1):
+    """
+    Compute the contraction and speed-of-contraction traces in one pass over `frames`.
+
+    frames          : iterable of 2-D uint8 arrays (the full stack, reference frame included)
+    reference_frame : 1-based slice number of the reference frame (referenceFrameSlice)
+    speed_window    : speedWindow in frames
+    mask            : optional binary mask (0/255) from build_max_projection_mask(),
+                      applied to both traces (built with the same binning)
+    blur_mode       : one of BLUR_MODES, how guassianBlur10 is computed
+    binning         : 1, 2, 4 or 8, tile averaging before the differences
+
+    Returns (contraction, speed, slices). As in the macro, the reference slice is removed
+    from the stack first, so len(contraction) == slices - 1 and
+    len(speed) == slices - 1 - speed_window.
+    """
+    if speed_window < 1:
+        raise ValueError(f"speed_window must be at least 1 (got {speed_window})")
+
+    weights = None if mask is None else np.asarray(mask, dtype=np.float32)
+    tail = None  # last `speed_window` frames of the previous block
+    contraction_parts = []
+    speed_parts = []
+    slices = 1
+
+    for reference, data, _ in iter_reference_blocks(frames, reference_frame, blur, chunk_size, blur_mode, binning):
+        slices += len(data)
+        contraction_parts.append(frame_means(np.abs(data - reference), weights))
+
+        joined = data if tail is None else np.concatenate([tail, data])
+        if len(joined) > speed_window:
+            speed_parts.append(frame_means(np.abs(joined[:-speed_window] - joined[speed_window:]), weights))
+        tail = joined[-speed_window:]
+
+    if slices < 2:
+        raise ValueError("Image was not a stack. Stack required for this analysis.")
+
+    contraction = np.concatenate(contraction_parts) if contraction_parts else np.zeros(0)
+    speed = np.concatenate(speed_parts) if speed_parts else np.zeros(0)
+    return contraction, speed, slices
+
+
+def adjust_autodetect_parameters(slices, speed_window, auto_detect_start, auto_detect_stop,
+                                 low_value_n, unity_selection_n):
+    """
+    The macro's sanity checks on the reference frame autodetection parameters.
+    Returns (auto_detect_start, auto_detect_stop, low_value_n, unity_selection_n, warnings).
+    """
+    warnings = []
+    if auto_detect_stop <= auto_detect_start:
+        auto_detect_start = auto_detect_stop - 1
+        warnings.append(f"WARNING: autoDetectStart set to {auto_detect_start} since it should be smaller than autoDetectStop ({auto_detect_stop}).")
+    if auto_detect_stop >= slices:
+        auto_detect_stop = slices - speed_window - 1
+        warnings.append(f"WARNING: autoDetectStop set to {auto_detect_stop} since it should be smaller than stack number ({slices}) minus speedWindow ({speed_window}) minus 1 (Reference frame).")
+    if low_value_n >= auto_detect_stop:
+        low_value_n = auto_detect_stop - 1
+        warnings.append(f"WARNING: lowValueN set to {low_value_n} since it should be smaller than autoDetectStop ({auto_detect_stop}).")
+    if low_value_n <= unity_selection_n:
+        unity_selection_n = low_value_n - 1
+        warnings.append(f"WARNING: unitySelectionN set to {unity_selection_n} since it should be smaller than lowValueN ({low_value_n}).")
+    return auto_detect_start, auto_detect_stop, low_value_n, unity_selection_n, warnings
+
+
+def downsample_frames(block, factor):
+    """Average factor x factor pixel tiles of a (frames, height, width) block, cropping partial tiles."""
+    if factor <= 1:
+        return block
+    n, h, w = block.shape
+    h, w = h - h % factor, w - w % factor
+    tiles = np.asarray(block[:, :h, :w], dtype=np.float32).reshape(n, h // factor, factor, w // factor, factor)
+    return tiles.mean(axis=(2, 4))
+
+
+def select_reference_frame(speed_y, auto_detect_start, auto_detect_stop, low_value_n, unity_selection_n):
+    """
+    Pick the reference frame from the autodetection speed trace, with the macro's ranking rules.
+
+    speed_y[k] is mean(|frame[k] - frame[k + speedWindow]|) for k = 0 .. autoDetectStop - autoDetectStart.
+    Returns the 1-based referenceFrameSlice.
+    """
+    speed_y = np.asarray(speed_y, dtype=np.float64)[auto_detect_start:auto_detect_stop]
+    speed_y_shift = speed_y[1:]
+    speed_y = speed_y[:-1]
+
+    # Array.rankPositions is a stable ascending sort of the indices
+    radian_points = np.sqrt(speed_y * speed_y + speed_y_shift * speed_y_shift)
+    indices_val = np.argsort(radian_points, kind="stable")
+
+    # Only the first lowValueN - 1 entries are filled in by the macro; the last one stays 0
+    # and therefore usually ranks first. This is kept so the selected slice matches.
+    unity_selection = np.zeros(low_value_n)
+    lowest = indices_val[:low_value_n - 1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        unity_selection[:len(lowest)] = np.abs(speed_y[lowest] / speed_y_shift[lowest] - 1)
+
+    indices_uni = np.argsort(unity_selection, kind="stable")[:unity_selection_n - 1]
+    if len(indices_uni) == 0:
+        raise ValueError(f"unitySelectionN ({unity_selection_n}) must be at least 2")
+    candidates = indices_val[indices_uni]
+    low_values = speed_y[candidates] * speed_y_shift[candidates] * unity_selection[indices_uni]
+    low_index = candidates[int(np.argmin(low_values))]
+    return int(low_index) + 1
+
+
+def load_frame_block(frames, count, blur=False, downsample=1, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Read up to `count` frames into one (frames, height, width) array, blurred if requested.
+    At full resolution the block stays uint8 (1 byte per pixel); with downsample > 1 the
+    frames are tile-averaged into float32 while reading.
+    """
+    block = None
+    filled = 0
+    for chunk in _iter_chunks(itertools.islice(frames, count), chunk_size):
+        if blur:
+            chunk = [gaussian_blur(f) for f in chunk]
+        data = np.asarray(chunk) if downsample <= 1 else downsample_frames(np.asarray(chunk), downsample)
+        if block is None:
+            block = np.empty((count,) + data.shape[1:], dtype=data.dtype)
+        block[filled:filled + len(data)] = data
+        filled += len(data)
+    if block is None:
+        return np.zeros((0, 0, 0), dtype=np.uint8)
+    return block[:filled]
+
+
+def _iter_chunks(frames, chunk_size):
+    """Group an iterable of frames into lists of chunk_size frames."""
+    chunk = []
+    for frame in frames:
+        chunk.append(frame)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def get_autodetect_frame_count(speed_window=DEFAULT_SPEED_WINDOW, auto_detect_start=DEFAULT_AUTO_DETECT_START,
+                               auto_detect_stop=DEFAULT_AUTO_DETECT_STOP):
+    """Number of leading frames that always covers the autodetection range, whatever the stack length."""
+    return max(auto_detect_stop, auto_detect_stop - auto_detect_start) + speed_window + 1
+
+
+def autodetect_reference_frame(block, slices=None, speed_window=DEFAULT_SPEED_WINDOW,
+                               auto_detect_start=DEFAULT_AUTO_DETECT_START, auto_detect_stop=DEFAULT_AUTO_DETECT_STOP,
+                               low_value_n=DEFAULT_LOW_VALUE_N, unity_selection_n=DEFAULT_UNITY_SELECTION_N):
+    """
+    getReferenceFrame() with autodetection, scored on an in-memory (or memory-mapped)
+    block holding the first frames of the stack, already blurred if guassianBlur10 is on
+    (see load_frame_block).
+
+    All candidate frames are scored with one batched difference over the block instead of
+    walking the stack again. slices is the length of the whole stack (default: len(block)).
+    A downsampled block is faster but approximate; use full resolution to reproduce the
+    macro's slice.
+    Returns (referenceFrameSlice, warnings).
+    """
+    slices = len(block) if slices is None else slices
+    auto_detect_start, auto_detect_stop, low_value_n, unity_selection_n, warnings = adjust_autodetect_parameters(
+        slices, speed_window, auto_detect_start, auto_detect_stop, low_value_n, unity_selection_n)
+
+    count = auto_detect_stop - auto_detect_start + 1
+    needed = count + speed_window
+    if count < 1 or needed > len(block):
+        raise ValueError(f"Reference frame detection needs {needed} frames, only {len(block)} available")
+
+    # speedY[k] = mean(|frame[k] - frame[k + speedWindow]|), scored a chunk of candidates at a time
+    speed_y = np.empty(count, dtype=np.float64)
+    for first in range(0, count, DEFAULT_CHUNK_SIZE):
+        last = min(first + DEFAULT_CHUNK_SIZE, count)
+        current = np.asarray(block[first:last], dtype=np.float32)
+        shifted = np.asarray(block[first + speed_window:last + speed_window], dtype=np.float32)
+        speed_y[first:last] = frame_means(np.abs(current - shifted))
+
+    reference_frame = select_reference_frame(speed_y, auto_detect_start, auto_detect_stop, low_value_n, unity_selection_n)
+    warnings.append(f"Automatic detected reference frame: frame {reference_frame}")
+    return reference_frame, warnings
+
+
+def check_trace(parameter, values):
+    """
+    Apply the customPlotZaxis checks to a trace.
+    Returns the (possibly adjusted) trace and the warnings the macro would print.
+    """
+    warnings = []
+    values = np.array(values, dtype=np.float64)
+    if len(values) == 0:
+        return values, warnings
+
+    sorted_values = np.sort(values)
+    constant = sorted_values[0] == sorted_values[-1]
+    if constant:
+        values[0] = values[0] - 0.01
+        warnings.append(f"Warning: Array of {parameter} was constant. In order to plot, 0.01 has been removed from the first value")
+
+    # warning flag for clipping
+    if len(sorted_values) >= 3 and not constant:
+        if sorted_values[-1] == sorted_values[-2] and sorted_values[-1] == sorted_values[-3]:
+            warnings.append(f"Warning: it seems like your {parameter} plot is clipping!")
+    return values, warnings
+
+
+def format_number(value):
+    """Format a number the way ImageJ's string concatenation does (integers bare, otherwise 4 decimals)."""
+    if np.isnan(value):
+        return "NaN"
+    if value == round(value) and abs(value) < 1e9:
+        return str(int(round(value)))
+    return f"{value:.4f}"
+
+
+def get_recorded_framerate(probed_fps=None, framerate=None):
+    """recordedFramerate of a well: the forced framerate, else the fps probed from the video, else the default."""
+    if framerate:
+        return framerate
+    if probed_fps and probed_fps > 0:
+        return probed_fps
+    return DEFAULT_RECORDED_FRAMERATE
+
+
+def write_trace_file(file_path, values, recorded_framerate):
+    """Write a trace as `time (ms)<TAB>value` lines, like the macro's writeFile()."""
+    sampling_time = (1 / recorded_framerate) * 1000
+    with open(file_path, "w") as f:
+        for i, value in enumerate(values):
+            f.write(f"{format_number(i * sampling_time)}\t{format_number(value)}\n")
+
+
+def get_results_dir(save_dir, output_name):
+    """Create <output_name>-Contr-Results, or the next free -Contr-Results-N, and return its path."""
+    dir_make_name = os.path.join(save_dir, f"{output_name}-Contr-Results")
+    version = 1
+    while os.path.isdir(dir_make_name):
+        dir_make_name = os.path.join(save_dir, f"{output_name}-Contr-Results-{version}")
+        version += 1
+    os.makedirs(dir_make_name)
+    return dir_make_name
+
+
+def get_file_name(save_path, parameter):
+    """Return <parameter>.txt in save_path, adding a version number if it already exists."""
+    version = 1
+    file_name = os.path.join(save_path, f"{parameter}.txt")
+    while os.path.exists(file_name):
+        file_name = os.path.join(save_path, f"{parameter}{version}.txt")
+        version += 1
+    return file_name
+
+
+def analyze_video(video_path, save_dir, recorded_framerate=DEFAULT_RECORDED_FRAMERATE,
+                  speed_window=DEFAULT_SPEED_WINDOW, reference_frame=1, blur=False,
+                  max_project=False, mp_start_range=DEFAULT_MP_START_RANGE, mp_end_range=DEFAULT_MP_END_RANGE,
+                  autodetect_reference=False, auto_detect_start=DEFAULT_AUTO_DETECT_START,
+                  auto_detect_stop=DEFAULT_AUTO_DETECT_STOP, low_value_n=DEFAULT_LOW_VALUE_N,
+                  unity_selection_n=DEFAULT_UNITY_SELECTION_N, reference_downsample=1,
+                  automatic_transient_detection=True, transient_options=None,
+                  buffer_size=DEFAULT_BUFFER_SIZE, chunk_size=DEFAULT_CHUNK_SIZE, avi_path=None,
+                  blur_mode="exact", binning=1, frame_cache=None):
+    """
+    Analyze one well video and write its -Contr-Results folder
+    (contraction.txt, speed-of-contraction.txt, both traces in the binary traces.cmtrace,
+    Log_file.txt and, with automatic_transient_detection, the per-beat Overview-results.csv).
+    transient_options are passed on to transient_analysis (peak_threshold, ...).
+    With autodetect_reference=True the reference frame is detected from the first frames
+    instead of using reference_frame.
+    With max_project=True the SNR mask is built first and applied to both traces.
+    Frames are streamed from the video with at most buffer_size frames decoded ahead
+    and processed chunk_size frames at a time;
+    if avi_path is given an uncompressed AVI copy is written on the way.
+    blur_mode and binning select a faster compute mode (see BLUR_MODES); the defaults
+    follow the macro most closely.
+    frame_cache is a cache directory (default: the configured one, see
+    cytomotion_frame_cache); when set, the well is decoded once and every pass reads
+    the cached frames.
+    Returns the results folder path.
+    """
+    check_compute_mode(blur_mode, binning)
+    start_time = time.time()
+    output_name = os.path.splitext(os.path.basename(video_path))[0]
+    now = datetime.now()
+    log_lines = [
+        "Log started...",
+        f"Date: {now.day}-{now.month - 1}-{now.year}",
+        f"Time: {now.hour}:{now.minute}:{now.second}",
+        "***",
+        f"Algorithm tool version number: {VERSION_NUMBER}",
+        f"recordedFramerate: {recorded_framerate}",
+        f"speedWindow: {speed_window}",
+        f"referenceFrameSlice: {reference_frame}",
+        f"maxProject: {int(max_project)}",
+    ]
+    if max_project:
+        log_lines.append(f"MPstartRange: {mp_start_range}")
+        log_lines.append(f"MPendRange: {mp_end_range}")
+    log_lines.append(f"autodetectReferenceFrame: {int(autodetect_reference)}")
+    if autodetect_reference:
+        log_lines.extend([
+            "***autodetectReferenceFrame parameters",
+            f"*lowValueN: {low_value_n}",
+            f"*unitySelectionN: {unity_selection_n}",
+            f"*autoDetectStart: {auto_detect_start}",
+            f"*autoDetectStop: {auto_detect_stop}",
+        ])
+        if reference_downsample > 1:
+            log_lines.append(f"*referenceDownsample: {reference_downsample}")
+        log_lines.append("***")
+    transient_options = dict(transient_options or {})
+    log_lines.append(f"automaticTransientDetection: {int(automatic_transient_detection)}")
+    if automatic_transient_detection:
+        log_lines.append("***automaticTransientDetection parameters")
+        log_lines.extend(f"*{name}: {value}" for name, value in transient_options.items())
+        log_lines.append("***")
+    log_lines.extend([
+        f"guassianBlur10: {'Yes' if blur else 'No'}",
+    ])
+    if blur and blur_mode != "exact":
+        log_lines.append(f"blurMode: {blur_mode}")
+    if binning > 1:
+        log_lines.append(f"binning: {binning}")
+    log_lines.extend([
+        " ",
+        f"----------------- Evaluating file:{output_name} -----------------",
+    ])
+    if recorded_framerate < 50:
+        log_lines.append("WARNING: Recorded framerate is low")
+
+    cached, _ = open_cached_frames(video_path, frame_cache, buffer_size=buffer_size, avi_path=avi_path)
+    if cached is not None:
+        avi_path = None  # written while the cache was read or built
+
+    def open_frames(avi_path=None):
+        """One pass over the frames: from the cache if there is one, else decoded from the video."""
+        if cached is not None:
+            return iter(cached)
+        return iter_frames(video_path, buffer_size=buffer_size, avi_path=avi_path)
+
+    if autodetect_reference:
+        block = load_frame_block(
+            open_frames(),
+            get_autodetect_frame_count(speed_window, auto_detect_start, auto_detect_stop),
+            blur=blur,
+            downsample=reference_downsample,
+            chunk_size=chunk_size,
+        )
+        reference_frame, warnings = autodetect_reference_frame(
+            block,
+            speed_window=speed_window,
+            auto_detect_start=auto_detect_start,
+            auto_detect_stop=auto_detect_stop,
+            low_value_n=low_value_n,
+            unity_selection_n=unity_selection_n,
+        )
+        log_lines.extend(warnings)
+        del block
+
+    mask = None
+    if max_project:
+        mask = build_max_projection_mask(
+            open_frames(),
+            reference_frame=reference_frame,
+            start_range=mp_start_range,
+            end_range=mp_end_range,
+            blur=blur,
+            chunk_size=chunk_size,
+            blur_mode=blur_mode,
+            binning=binning,
+        )
+
+    contraction, speed, slices = compute_motion_traces(
+        open_frames(avi_path),
+        reference_frame=reference_frame,
+        speed_window=speed_window,
+        blur=blur,
+        mask=mask,
+        chunk_size=chunk_size,
+        blur_mode=blur_mode,
+        binning=binning,
+    )
+
+    save_path = get_results_dir(save_dir, output_name)
+    contraction, warnings = check_trace("Contraction", contraction)
+    log_lines.extend(warnings)
+    write_trace_file(get_file_name(save_path, "contraction"), contraction, recorded_framerate)
+
+    if automatic_transient_detection:
+        tables, peaks = transient_analysis([contraction], [reference_frame], recorded_framerate, **transient_options)
+        log_lines.append("Peaks detected at points (frames):")
+        log_lines.append(",".join(str(p) for p in peaks[0]))
+        write_results_csv(os.path.join(save_path, RESULTS_FILE), tables[0])
+
+    speed, warnings = check_trace("Speed of contraction", speed)
+    log_lines.extend(warnings)
+    write_trace_file(get_file_name(save_path, "speed-of-contraction"), speed, recorded_framerate)
+    write_trace_container(os.path.join(save_path, TRACE_FILE),
+                          {"contraction": contraction, "speed-of-contraction": speed},
+                          recorded_framerate, reference_frame, output_name, os.path.basename(video_path))
+
+    log_lines.append(f"Slices: {slices}")
+    record(frames=slices)
+    log_lines.append(f"Elapsed time (ms): {int((time.time() - start_time) * 1000)}")
+    log_lines.append("----------------- Evaluation finished -----------------")
+    with open(get_file_name(save_path, "Log_file"), "w") as f:
+        f.write("\n".join(log_lines) + "\n")
+
+    print(f"[✓] Analyzed: {video_path} -> {save_path}")
+    return save_path
+
+
+def analyze_directory(video_dir, save_dir, export_avi=False, **kwargs):
+    """
+    Analyze every video directly inside video_dir, one -Contr-Results folder per well.
+    With export_avi=True an uncompressed AVI copy of each MP4 is written next to it.
+    """
+    os.makedirs(save_dir, exist_ok=True)
+    filenames = sorted(os.listdir(video_dir))
+    mp4_stems = {os.path.splitext(f)[0] for f in filenames if f.lower().endswith(".mp4")}
+    results = []
+    for filename in filenames:
+        video_path = os.path.join(video_dir, filename)
+        if not (os.path.isfile(video_path) and filename.lower().endswith(VIDEO_EXTENSIONS)):
+            continue
+        # An AVI exported from an MP4 is the same well; analyze the MP4 only
+        if filename.lower().endswith(".avi") and os.path.splitext(filename)[0] in mp4_stems:
+            continue
+        avi_path = None
+        if export_avi and filename.lower().endswith(".mp4"):
+            avi_path = os.path.splitext(video_path)[0] + ".avi"
+        try:
+            with stage("analyze_video", well=os.path.splitext(filename)[0]):
+                results.append(analyze_video(video_path, save_dir, avi_path=avi_path, **kwargs))
+        except Exception as e:
+            print(f"[!] Failed to analyze {video_path}: {e}")
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python cytomotion_motion_analysis.py <video_file_or_folder> <save_directory>")
+        sys.exit(1)
+
+    input_path, save_directory = sys.argv[1], sys.argv[2]
+    if os.path.isdir(input_path):
+        analyze_directory(input_path, save_directory)
+    elif os.path.isfile(input_path):
+        os.makedirs(save_directory, exist_ok=True)
+        analyze_video(input_path, save_directory)
+    else:
+        print(f"Error: {input_path} is not a valid file or directory")
+        sys.exit(1)
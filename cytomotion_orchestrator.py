@@ -0,0 +1,360 @@
+import os
+import re
+import sys
+import time
+import queue
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import pandas as pd
+
+from rename_videos_mp4 import plan_renames, stage_file, STAGING_MODES, DEFAULT_STAGING_MODE
+from cytomotion_preprocess_validation import validate_files, get_run_number, write_log
+from cytomotion_preprocessing import get_results_path
+from cytomotion_video_probe import probe_videos, save_probe_cache
+from cytomotion_scheduler import analyze_well, get_worker_count, DEFAULT_MEMORY_BUDGET_MB
+from cytomotion_motion_analysis import get_recorded_framerate
+from update_csv_file_headers_2 import process_directory
+from generate_summary_file import find_csv_files, build_summary_rows, SUMMARY_FILE
+from adding_prefixes_to_cytomotion_files import prepend_tag_to_files
+from cytomotion_postprocessing import check_file_count, update_results_store, HEADERS
+from cytomotion_manifest import load_manifest, save_manifest, record_folder
+from cytomotion_catalog import ResultsCatalog
+from cytomotion_metrics import stage, emit, configure_metrics, export_prometheus
+from cytomotion_plots import render_plate
+from cytomotion_frame_cache import configure_frame_cache, DEFAULT_CACHE_DIR
+
+# -------------------------------
+# Experiment orchestrator
+# -------------------------------
+# Runs every plate of an experiment folder (CPxxx_YYYYMMDD_Dxx/Plate_N) as one pipeline
+# instead of stage after stage:
+#
+#   stager thread    -> staged queue   -> analysis pool  -> finished queue -> postprocess thread
+#   (rename + probe      (bounded)        (process pool)     (bounded)        (headers, summary
+#    one well at a time)                                                       row, prefixes)
+#
+# While well N is analysed, well N+1 is staged and probed, and the summary row of every
+# results folder is appended to the plate's summary as soon as the folder is written.
+# The queues are bounded and at most one well per worker is being analysed, so memory
+# does not grow with the plate size. When the last well of a plate is done, the plate
+# barriers run: the plate-level validation log (probe results come from the cache),
+# the summary rewritten in results-tree order (identical to generate_summary_table),
+# the file count check, the manifest and the results store.
+# The pool starts its workers with forkserver (spawn where that is not available): a
+# worker forked while the stager thread is decoding a video can inherit a held lock
+# and never finish its well.
+
+PLATE_PATTERN = re.compile(r"^Plate_(\d+)$")
+EXPERIMENT_PATTERN = re.compile(r"^CP\d+_\d{8}_D\d+$")
+
+_DONE = object()
+
+
+def get_pool_context():
+    """multiprocessing context for the analysis pool: no fork while other threads run."""
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["cytomotion_scheduler"])  # imported once, not per worker
+    return context
+
+
+def find_plate_folders(experiment_dir):
+    """Raw Plate_N folders of an experiment folder, by plate number."""
+    plates = []
+    for name in os.listdir(experiment_dir):
+        match = PLATE_PATTERN.match(name)
+        if match and os.path.isdir(os.path.join(experiment_dir, name)):
+            plates.append((int(match.group(1)), os.path.join(experiment_dir, name)))
+    return [path for _, path in sorted(plates)]
+
+
+def stage_plates(plate_paths, staged, timings, errors, staging_mode=DEFAULT_STAGING_MODE):
+    """
+    Stager thread: stage and probe the wells one by one and queue (plate, save_dir, video, fps).
+    After the last well of a plate, (plate, save_dir, None, None) marks the end of the plate.
+    """
+    try:
+        for base_path in plate_paths:
+            timings[base_path] = {"start": time.perf_counter(), "first_summary": None, "wells": 0}
+            save_dir = get_results_path(base_path)
+            renamed_base = None
+            try:
+                renamed_base, pairs = plan_renames(base_path)
+                os.makedirs(renamed_base, exist_ok=True)
+                os.makedirs(save_dir, exist_ok=True)
+            except Exception as e:
+                errors.append(f"Plate {base_path}: staging failed: {e}")
+                pairs = []
+
+            probe_caches = {}  # written once per plate, not once per well
+            for old_path, new_path in pairs:
+                well = os.path.splitext(os.path.basename(new_path))[0]
+                try:
+                    with stage("stage_well", well=well):
+                        stage_file(old_path, new_path, staging_mode)
+                        result = probe_videos([new_path], caches=probe_caches)[new_path]
+                except Exception as e:
+                    errors.append(f"Well {new_path}: staging failed: {e}")
+                    continue
+                if result["error"]:
+                    errors.append(f"Well {new_path}: {result['error']}")
+                    continue
+                staged.put((base_path, save_dir, new_path, result["fps"]))
+
+            for folder, cache in probe_caches.items():
+                save_probe_cache(folder, cache)
+
+            # Plate-level checks (count, duplicates, consensus frame count / fps)
+            if renamed_base is not None:
+                try:
+                    with stage("validate_files", plate=base_path):
+                        plate = validate_files(renamed_base)
+                    if plate and plate["frame_count"]:
+                        print(f"Plate recording: {plate['frame_count']} frames at {plate['fps']:g} fps")
+                except Exception as e:
+                    errors.append(f"Plate {base_path}: validation failed: {e}")
+            staged.put((base_path, save_dir, None, None))
+    finally:
+        staged.put(_DONE)
+
+
+class SummaryWriter:
+    """
+    Summary rows of one plate, appended to its summary file as results folders finish,
+    and the plate's results catalog: scanned once, each new results folder added to it.
+    """
+
+    def __init__(self, save_dir):
+        self.save_dir = save_dir
+        self.path = os.path.join(save_dir, SUMMARY_FILE)
+        self.rows = {}  # results folder path -> summary rows
+        if os.path.isfile(self.path):
+            os.remove(self.path)  # rows of an earlier run, rewritten when the plate is done
+        self.catalog = ResultsCatalog(save_dir)
+
+    def add(self, folder, rows):
+        self.rows[folder] = rows
+        if rows:
+            pd.DataFrame(rows).to_csv(self.path, mode="a", header=not os.path.isfile(self.path), index=False)
+
+    def finish(self):
+        """Rewrite the summary with the rows of every results folder, in results-tree order."""
+        catalog = self.catalog
+        catalog.reorder_subfolders()
+        summary_rows = []
+        for folder in dict.fromkeys(root for root, path in find_csv_files(self.save_dir, catalog)
+                                    if path != self.path):
+            if folder not in self.rows:
+                # Folder from an earlier run, or one analysed outside this pipeline
+                self.rows[folder] = build_summary_rows(find_csv_files(folder, catalog), HEADERS, catalog=catalog)
+            summary_rows.extend(self.rows[folder])
+        pd.DataFrame(summary_rows).to_csv(self.path, index=False)
+        catalog.refresh_file(self.path)
+        print(f"\n {SUMMARY_FILE} saved at: {self.path}")
+
+
+def finish_plate(base_path, save_dir, writer, store_dir=None):
+    """Plate barrier: final summary, file count check, manifest and results store."""
+    catalog = writer.catalog
+    writer.finish()
+    with stage("check_file_count", base_dir=save_dir):
+        check_file_count(save_dir, catalog=catalog)
+    folders = [os.path.basename(folder) for folder in writer.rows if os.path.dirname(folder) == save_dir]
+    manifest = load_manifest(save_dir)
+    for name in folders:
+        record_folder(save_dir, manifest, name, catalog=catalog)
+    save_manifest(save_dir, manifest)
+    with stage("results_store", base_dir=save_dir):
+        update_results_store(save_dir, store_dir, folders, catalog=catalog)
+
+
+def postprocess_results(finished, timings, errors, store_dir=None):
+    """
+    Postprocess thread: headers, summary row and prefixes of each results folder as it
+    arrives on the finished queue; the plate barrier when ("plate", ...) arrives.
+    """
+    writers = {}
+    while True:
+        item = finished.get()
+        if item is _DONE:
+            return
+        kind, base_path, save_dir, folder = item
+
+        if kind == "plate":
+            writer = writers.pop(base_path, None)
+            if writer is not None:
+                try:
+                    finish_plate(base_path, save_dir, writer, store_dir)
+                except Exception as e:
+                    errors.append(f"Plate {base_path}: postprocessing failed: {e}")
+            timings[base_path]["end"] = time.perf_counter()
+            report_plate(base_path, timings[base_path])
+            continue
+
+        try:
+            writer = writers.get(base_path)
+            if writer is None:
+                writer = writers[base_path] = SummaryWriter(save_dir)
+            catalog = writer.catalog
+            with stage("postprocess_well", well=os.path.basename(folder)):
+                catalog.scan_folder(folder)
+                process_directory(folder, catalog)
+                writer.add(folder, build_summary_rows(find_csv_files(folder, catalog), HEADERS, catalog=catalog))
+                prepend_tag_to_files(save_dir, [os.path.basename(folder)], catalog)
+        except Exception as e:
+            errors.append(f"Results {folder}: postprocessing failed: {e}")
+            continue
+
+        timing = timings[base_path]
+        timing["wells"] += 1
+        if timing["first_summary"] is None:
+            timing["first_summary"] = time.perf_counter()
+            print(f"First summary row of {base_path} after {timing['first_summary'] - timing['start']:.1f} s")
+
+
+def report_plate(base_path, timing):
+    first = timing["first_summary"] - timing["start"] if timing["first_summary"] is not None else None
+    total = timing["end"] - timing["start"]
+    if first is None:
+        print(f"=== PLATE {base_path}: no wells analyzed, plate time {total:.1f} s ===")
+    else:
+        print(f"=== PLATE {base_path}: {timing['wells']} wells, first summary row after {first:.1f} s, "
+              f"plate time {total:.1f} s ===")
+    emit({"event": "plate", "plate": base_path, "wells": timing["wells"],
+          "time_to_first_summary_s": round(first, 3) if first is not None else None,
+          "plate_s": round(total, 3)})
+
+
+def run_experiment(experiment_dir, workers=None, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB,
+                   staging_mode=DEFAULT_STAGING_MODE, store_dir=None, plots=False, framerate=None, **kwargs):
+    """
+    Stage, validate, analyze and postprocess every plate of an experiment folder as a
+    pipeline. Returns {plate folder: timings} with "start", "first_summary", "end" and "wells".
+    Each well is analyzed at the fps probed from its video, or at framerate if given.
+    With plots=True the plate montages and heatmaps are rendered once every plate is done.
+    """
+    if staging_mode not in STAGING_MODES:
+        raise ValueError(f"Unknown staging mode {staging_mode}, expected one of {', '.join(STAGING_MODES)}")
+    plate_paths = find_plate_folders(experiment_dir)
+    worker_count = get_worker_count(workers, memory_budget_mb)
+    print(f"=== EXPERIMENT {experiment_dir}: {len(plate_paths)} plates, {worker_count} workers ===")
+
+    start = time.perf_counter()
+    errors = []
+    timings = {}
+    staged = queue.Queue(maxsize=worker_count)
+    finished = queue.Queue(maxsize=worker_count)
+    stager = threading.Thread(target=stage_plates, name="stager",
+                              args=(plate_paths, staged, timings, errors, staging_mode))
+    postprocessor = threading.Thread(target=postprocess_results, name="postprocessor",
+                                     args=(finished, timings, errors, store_dir))
+    stager.start()
+    postprocessor.start()
+
+    staging_done = False
+    pending = {}  # future -> (plate, save_dir, video)
+    in_flight = {}  # plate -> wells submitted and not finished
+    staged_plates = set()
+    results_dirs = {}  # plate -> results folder
+
+    def finish_if_done(base_path, save_dir):
+        if base_path in staged_plates and not in_flight.get(base_path):
+            staged_plates.discard(base_path)
+            finished.put(("plate", base_path, save_dir, None))
+
+    try:
+        with stage("motion_analysis", experiment=experiment_dir, workers=worker_count), \
+                ProcessPoolExecutor(max_workers=worker_count, mp_context=get_pool_context()) as pool:
+            while not staging_done or pending:
+                # Keep every worker busy, but take no more wells off the staged queue than that
+                while not staging_done and len(pending) < worker_count:
+                    try:
+                        item = staged.get(timeout=0.05) if pending else staged.get()
+                    except queue.Empty:
+                        break
+                    if item is _DONE:
+                        staging_done = True
+                        break
+                    base_path, save_dir, video, fps = item
+                    if video is None:
+                        results_dirs[base_path] = save_dir
+                        staged_plates.add(base_path)
+                        finish_if_done(base_path, save_dir)
+                        continue
+                    future = pool.submit(analyze_well, video, save_dir, memory_budget_mb,
+                                         recorded_framerate=get_recorded_framerate(fps, framerate), **kwargs)
+                    pending[future] = (base_path, save_dir, video)
+                    in_flight[base_path] = in_flight.get(base_path, 0) + 1
+
+                if not pending:
+                    continue
+                done, _ = wait(list(pending), timeout=0.05, return_when=FIRST_COMPLETED)
+                for future in done:
+                    base_path, save_dir, video = pending.pop(future)
+                    in_flight[base_path] -= 1
+                    try:
+                        finished.put(("well", base_path, save_dir, future.result()))
+                    except Exception as e:
+                        print(f"[!] Failed to analyze {video}: {e}")
+                        errors.append(f"Well {video}: {type(e).__name__}: {e}")
+                    finish_if_done(base_path, save_dir)
+    finally:
+        # After a failure the stager may still be waiting on the staged queue
+        while not staging_done and staged.get() is not _DONE:
+            pass
+        finished.put(_DONE)
+        stager.join()
+        postprocessor.join()
+
+    total = time.perf_counter() - start
+    firsts = [t["first_summary"] for t in timings.values() if t["first_summary"] is not None]
+    first = min(firsts) - start if firsts else None
+    wells = sum(t["wells"] for t in timings.values())
+    emit({"event": "experiment", "experiment": experiment_dir, "plates": len(plate_paths), "wells": wells,
+          "time_to_first_summary_s": round(first, 3) if first is not None else None,
+          "total_s": round(total, 3)})
+
+    if errors:
+        run_number = get_run_number()
+        write_log(run_number, "ORCHESTRATOR", [f"Failed items: {len(errors)}"] + errors)
+    print(f"=== EXPERIMENT COMPLETED: {wells} wells in {total:.1f} s"
+          + (f", first summary row after {first:.1f} s" if first is not None else "") + " ===")
+    if plots:
+        for save_dir in results_dirs.values():
+            render_plate(save_dir, workers=worker_count)
+    export_prometheus()
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run every plate of an experiment folder as one pipeline.")
+    parser.add_argument("experiment", help="Experiment folder, e.g. CP011_20250609_D25")
+    parser.add_argument("--workers", type=int, default=None, help="Analysis processes (default: all cores)")
+    parser.add_argument("--memory-mb", type=int, default=DEFAULT_MEMORY_BUDGET_MB, help="Memory budget per worker in MB")
+    parser.add_argument("--staging", choices=STAGING_MODES, default=DEFAULT_STAGING_MODE, help="How renamed MP4s are staged")
+    parser.add_argument("--store", default=None, help="Results store directory (default: results_store next to each results folder)")
+    parser.add_argument("--frame-cache", nargs="?", const=DEFAULT_CACHE_DIR, default=None,
+                        help=f"Decode each well once into this cache directory (default: {DEFAULT_CACHE_DIR})")
+    parser.add_argument("--frame-cache-mb", type=float, default=None, help="Size cap of the frame cache in MB")
+    parser.add_argument("--framerate", type=float, default=None,
+                        help="recordedFramerate to analyze with (default: each well's fps from the video)")
+    parser.add_argument("--plots", action="store_true", help="Render plate montages and heatmaps when the analysis is done")
+    parser.add_argument("--metrics", default=None, help="Append per-stage/per-well metrics to this JSON-lines file")
+    parser.add_argument("--prometheus", default=None, help="Also export the metrics as a Prometheus textfile")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.experiment):
+        print(f"Error: {args.experiment} is not a valid directory")
+        sys.exit(1)
+    if not EXPERIMENT_PATTERN.match(os.path.basename(os.path.normpath(args.experiment))):
+        print(f"Warning: {args.experiment} does not look like CPxxx_YYYYMMDD_Dxx")
+
+    configure_metrics(args.metrics, args.prometheus)
+    configure_frame_cache(args.frame_cache, args.frame_cache_mb)
+    run_experiment(args.experiment, workers=args.workers, memory_budget_mb=args.memory_mb,
+                   staging_mode=args.staging, store_dir=args.store, plots=args.plots,
+                   framerate=args.framerate)
@@ -0,0 +1,197 @@
+import os
+import io
+import sys
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from cytomotion_transient_analysis import (
+    transient_analysis, read_trace_file, read_log_values, get_reference_frame,
+    DEFAULT_PEAK_DETECTION_WINDOW, DEFAULT_PEAK_THRESHOLD, DEFAULT_BASELINE_THRESHOLD,
+    DEFAULT_BASELINE_NUMBER_OF_POINTS, DEFAULT_HIGH_FREQ_BASELINE_DETECTION,
+)
+from generate_summary_file import summarize_frames, read_log_file, find_log_file
+from cytomotion_trace_container import load_trace_matrix, text_values, is_current_container, TRACE_FILE
+
+# -------------------------------
+# Transient-analysis parameter sweep
+# -------------------------------
+# Only transientAnalysis depends on peakThreshold, PeakDetectionWindow and the baseline
+# detection settings, so a sweep does not need the videos: the contraction traces saved
+# in every -Contr-Results folder are loaded once (in bulk from the binary trace
+# containers, from contraction.txt for folders written without one), and each setting of the grid runs the
+# batched transient_analysis over all wells (one process per setting). The per-beat
+# tables are summarized exactly as the summary does it (after the same 3-decimal
+# round trip as Overview-results.csv), and each setting gets one row in the comparison table:
+# peaks found, BPM from the peak-to-peak intervals vs "Estimated BPM (from log)" (peak
+# count / recording time), and the median CV% of the intervals and contraction durations.
+# Nothing in the results folders is changed.
+
+DEFAULT_BPM_TOLERANCE = 5
+SWEEP_PARAMETERS = ("peak_threshold", "peak_detection_window", "high_freq_baseline_detection",
+                    "baseline_threshold", "baseline_number_of_points")
+
+_wells = None  # traces of the worker process, set by _init_worker
+
+
+def find_result_file(folder, file_name, files):
+    """file_name in a results folder, also after the prefix step renamed it to <tag>_file_name."""
+    if file_name in files:
+        return os.path.join(folder, file_name)
+    prefixed = sorted(f for f in files if f.endswith("_" + file_name))
+    return os.path.join(folder, prefixed[0]) if prefixed else None
+
+
+def load_well_traces(base_dir, recorded_framerate=None):
+    """
+    Contraction trace, reference frame, frame rate and (Slices, recordedFramerate) of the log
+    of every results folder under base_dir. Returns a list of dicts.
+    """
+    wells = []
+    containers = []
+    for root, _, files in os.walk(base_dir):
+        trace_path = find_result_file(root, "contraction.txt", files)
+        if trace_path is None:
+            continue
+        log_path = find_log_file(root)
+        log_values = read_log_values(log_path) if os.path.isfile(log_path) else {}
+        well = {
+            "folder": root,
+            "trace": None,
+            "reference_frame": get_reference_frame(log_values),
+            "framerate": recorded_framerate or float(log_values.get("recordedFramerate", 100)),
+            "log": read_log_file(log_path),
+        }
+        container_path = find_result_file(root, TRACE_FILE, files)
+        if container_path is None or not is_current_container(container_path):
+            well["trace"] = read_trace_file(trace_path)
+        else:
+            containers.append((container_path, well))
+        wells.append(well)
+
+    if containers:
+        matrix, lengths, _ = load_trace_matrix([path for path, _ in containers])
+        for (_, well), row, length in zip(containers, matrix, lengths):
+            well["trace"] = text_values(row[:length])
+    return wells
+
+
+def as_written(table):
+    """A per-beat table as the summary reads it back from Overview-results.csv (3 decimals)."""
+    if not len(table):
+        return table
+    text = table.to_csv(index=False, header=False, float_format="%.3f")
+    return pd.read_csv(io.StringIO(text), header=None, names=list(table.columns))
+
+
+def build_grid(**values):
+    """Every combination of the given parameter values, as a list of dicts."""
+    names = [name for name in SWEEP_PARAMETERS if values.get(name) is not None]
+    return [dict(zip(names, combination)) for combination in itertools.product(*(values[name] for name in names))]
+
+
+def evaluate_setting(wells, setting):
+    """Summary rows of every well for one transient-analysis setting."""
+    batches = {}
+    for well in wells:
+        batches.setdefault(well["framerate"], []).append(well)
+
+    logs = {well["folder"]: well["log"] for well in wells}
+    entries = []
+    frames = []
+    for framerate, batch in batches.items():
+        tables, _ = transient_analysis([well["trace"] for well in batch],
+                                       [well["reference_frame"] for well in batch], framerate, **setting)
+        entries.extend((well["folder"], well["folder"]) for well in batch)
+        frames.extend(as_written(table) for table in tables)
+    return summarize_frames(logs, entries, frames)
+
+
+def compare_setting(setting, rows, bpm_tolerance=DEFAULT_BPM_TOLERANCE):
+    """One comparison row for the summary rows of a setting."""
+    df = pd.DataFrame(rows)
+    bpm = pd.to_numeric(df["Heart Beat (BPM)"], errors="coerce")
+    estimated = pd.to_numeric(df["Estimated BPM (from log)"], errors="coerce")
+    difference = (bpm - estimated).abs()
+    both = difference.notna()
+    return dict(setting, **{
+        "Wells": len(df),
+        "Wells with peaks": int((df["No of Peaks"] > 0).sum()),
+        "Peaks per well (mean)": round(df["No of Peaks"].mean(), 2),
+        "BPM (median)": bpm.median(),
+        "Estimated BPM (median)": estimated.median(),
+        "|BPM - Estimated BPM| (mean)": round(difference.mean(), 2) if both.any() else np.nan,
+        f"BPM within {bpm_tolerance} of Estimated (%)": round(100 * (difference[both] <= bpm_tolerance).mean(), 1)
+        if both.any() else np.nan,
+        "PPT CV% (median)": df["PPT CV%"].median(),
+        "CD CV% (median)": df["CD CV%"].median(),
+    })
+
+
+def _init_worker(wells):
+    global _wells
+    _wells = wells
+
+
+def _evaluate(setting):
+    return evaluate_setting(_wells, setting)
+
+
+def run_sweep(base_dir, grid, workers=None, recorded_framerate=None, bpm_tolerance=DEFAULT_BPM_TOLERANCE):
+    """
+    Evaluate every setting of the grid on the saved traces under base_dir.
+    Returns (comparison table with one row per setting, per-well table of all settings).
+    """
+    wells = load_well_traces(base_dir, recorded_framerate)
+    if not wells:
+        raise ValueError(f"No contraction traces found under {base_dir}")
+    print(f"Sweeping {len(grid)} settings over {len(wells)} wells")
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(wells,)) as pool:
+        results = list(pool.map(_evaluate, grid))
+
+    comparison = []
+    details = []
+    for number, (setting, rows) in enumerate(zip(grid, results), start=1):
+        comparison.append(dict({"Setting": number}, **compare_setting(setting, rows, bpm_tolerance)))
+        details.extend(dict({"Setting": number}, **setting, **row) for row in rows)
+    return pd.DataFrame(comparison), pd.DataFrame(details)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep transient-analysis parameters over the saved traces of a results folder.")
+    parser.add_argument("base_dir", help="Folder containing the -Contr-Results folders")
+    parser.add_argument("--peak-threshold", type=float, nargs="+", default=[DEFAULT_PEAK_THRESHOLD], help="peakThreshold values (%%)")
+    parser.add_argument("--peak-window", type=int, nargs="+", default=[DEFAULT_PEAK_DETECTION_WINDOW], help="PeakDetectionWindow values (frames)")
+    parser.add_argument("--high-freq-baseline", type=int, nargs="+", choices=(0, 1),
+                        default=[int(DEFAULT_HIGH_FREQ_BASELINE_DETECTION)], help="highFreqBaselineDetection values")
+    parser.add_argument("--baseline-threshold", type=float, nargs="+", default=[DEFAULT_BASELINE_THRESHOLD], help="baselineThreshold values")
+    parser.add_argument("--baseline-points", type=int, nargs="+", default=[DEFAULT_BASELINE_NUMBER_OF_POINTS], help="baselineNumberOfPoints values")
+    parser.add_argument("--framerate", type=float, default=None, help="recordedFramerate (default: from each Log_file)")
+    parser.add_argument("--workers", type=int, default=None, help="Processes (default: all cores)")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_BPM_TOLERANCE, help="BPM agreement tolerance")
+    parser.add_argument("--output", default="parameter_sweep.csv", help="Comparison table (one row per setting)")
+    parser.add_argument("--details", default=None, help="Also write the per-well summary rows of every setting here")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.base_dir):
+        print(f"Error: '{args.base_dir}' is not a valid directory.")
+        sys.exit(1)
+
+    grid = build_grid(
+        peak_threshold=args.peak_threshold,
+        peak_detection_window=args.peak_window,
+        high_freq_baseline_detection=[bool(v) for v in args.high_freq_baseline],
+        baseline_threshold=args.baseline_threshold,
+        baseline_number_of_points=args.baseline_points,
+    )
+    comparison, details = run_sweep(args.base_dir, grid, args.workers, args.framerate, args.tolerance)
+    print(comparison.to_string(index=False))
+    comparison.to_csv(args.output, index=False)
+    print(f"Comparison of {len(comparison)} settings written to {args.output}")
+    if args.details:
+        details.to_csv(args.details, index=False)
+        print(f"Per-well rows written to {args.details}")
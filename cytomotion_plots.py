@@ -0,0 +1,353 @@
+import os
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+try:
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+except ImportError:  # optional dependency, nothing is rendered without it
+    plt = None
+
+from cytomotion_catalog import ResultsCatalog, parse_results_fields
+from cytomotion_transient_analysis import read_trace_file
+from cytomotion_trace_container import load_trace_matrix, text_values, is_current_container, TRACE_FILE
+from cytomotion_parameter_sweep import find_result_file
+from generate_summary_file import find_log_file, SUMMARY_FILE
+from cytomotion_metrics import stage
+
+# -------------------------------
+# Deferred plate plots
+# -------------------------------
+# The macro draws customPlotZaxis (contraction, speed of contraction) and speedLinCompare
+# for every well while it analyses it. Here nothing is drawn during the analysis: the
+# plots are rendered afterwards from the stored traces (binary containers, or the text
+# traces of older folders), the peaks in Log_file.txt and the summary rows, into a
+# separate <plate>_results_plots folder so the results folders keep their file count:
+#   montage-<trace>.png      all wells of the plate at their plate positions
+#   heatmap-<column>.png     a summary column (e.g. BPM, TTP Mean) by well position
+#   <folder>/<plot>.jpg      the macro's per-well plots, only for the wells asked for;
+#                            a plot newer than its traces is not drawn again
+# Per-well plots are drawn in a process pool. Wells 001..096 are placed row by row
+# (001 = A1, 012 = A12, 013 = B1, ...).
+
+PLATE_ROWS = 8
+PLATE_COLUMNS = 12
+PLOTS_SUFFIX = "_plots"
+DEFAULT_HEATMAP_COLUMNS = ("Heart Beat (BPM)", "TTP Mean")
+WELL_PLOTS = ("Contraction", "Speed of contraction", "Comparison calculated (red) and measured (black) speed")
+DEFAULT_DPI = 100
+
+
+def get_plots_dir(base_dir):
+    """Default plots location: <base_dir>_plots next to the results folder."""
+    base_dir = os.path.abspath(base_dir)
+    return os.path.join(os.path.dirname(base_dir), os.path.basename(base_dir) + PLOTS_SUFFIX)
+
+
+def well_position(well):
+    """(row, column) of a well number on the plate, or None outside the 96 positions."""
+    index = int(well) - 1
+    if not 0 <= index < PLATE_ROWS * PLATE_COLUMNS:
+        return None
+    return divmod(index, PLATE_COLUMNS)
+
+
+def well_label(well):
+    position = well_position(well)
+    if position is None:
+        return str(well)
+    return f"{chr(ord('A') + position[0])}{position[1] + 1}"
+
+
+def read_peaks(log_path):
+    """Peak frames written under "Peaks detected at points (frames):" in a Log_file.txt."""
+    peaks = []
+    try:
+        with open(log_path, "r") as log_file:
+            lines = log_file.read().splitlines()
+    except OSError:
+        return peaks
+    for i, line in enumerate(lines[:-1]):
+        if line.startswith("Peaks detected at points"):
+            peaks = [int(value) for value in lines[i + 1].split(",") if value.strip()]
+    return peaks
+
+
+def read_summary(base_dir):
+    """{results folder name: summary row} of the plate summary, empty if there is none."""
+    path = os.path.join(base_dir, SUMMARY_FILE)
+    if not os.path.isfile(path):
+        return {}
+    summary = pd.read_csv(path)
+    return {os.path.basename(str(row["File Name"])): row for row in summary.to_dict("records")}
+
+
+def load_plate_wells(base_dir, catalog=None):
+    """
+    Traces, peaks and summary row of every -Contr-Results folder of base_dir, sorted by well.
+    Traces come from the binary containers (loaded in bulk) where there are any.
+    """
+    if catalog is None:
+        catalog = ResultsCatalog(base_dir)
+    summary = read_summary(base_dir)
+
+    wells = []
+    containers = []
+    for name in sorted(catalog.subfolders()):
+        fields = parse_results_fields(name)
+        if fields is None:
+            continue
+        folder = os.path.join(base_dir, name)
+        files = catalog.regular_files(folder)
+        log_path = find_log_file(folder, catalog)
+        well = {
+            "name": name, "folder": folder, "fields": fields,
+            "peaks": read_peaks(log_path), "summary": summary.get(name, {}),
+        }
+        container_path = find_result_file(folder, TRACE_FILE, files)
+        if container_path is not None and is_current_container(container_path):
+            containers.append((container_path, well))
+        else:
+            contraction_path = find_result_file(folder, "contraction.txt", files)
+            speed_path = find_result_file(folder, "speed-of-contraction.txt", files)
+            if contraction_path is None:
+                continue
+            well.update(
+                contraction=read_trace_file(contraction_path),
+                speed=read_trace_file(speed_path) if speed_path else np.zeros(0),
+                fps=read_log_framerate(log_path) or 100, source=contraction_path,
+            )
+        wells.append(well)
+
+    if containers:
+        paths = [path for path, _ in containers]
+        for key, trace in (("contraction", "contraction"), ("speed", "speed-of-contraction")):
+            matrix, lengths, headers = load_trace_matrix(paths, trace)
+            for (path, well), row, length, header in zip(containers, matrix, lengths, headers):
+                well.update({key: text_values(row[:length]), "fps": header["fps"], "source": path})
+
+    wells.sort(key=lambda well: int(well["fields"]["well"]))
+    return wells
+
+
+def read_log_framerate(log_path):
+    """recordedFramerate of a Log_file.txt, or None."""
+    try:
+        with open(log_path, "r") as log_file:
+            for line in log_file:
+                if line.startswith("recordedFramerate:"):
+                    return float(line.split(":", 1)[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def time_axis(values, fps):
+    """Time (ms) of every sample, as customPlotZaxis draws it."""
+    return np.arange(len(values)) * (1000 / fps)
+
+
+def normalize(values):
+    low, high = np.nanmin(values), np.nanmax(values)
+    if high == low:
+        return np.zeros_like(values)
+    return (values - low) / (high - low)
+
+
+# -------------------------------
+# Per-well plots
+# -------------------------------
+
+def draw_trace(ax, values, fps, peaks=(), label=None, small=False):
+    """A trace over time with its detected peaks, like customPlotZaxis."""
+    times = time_axis(values, fps)
+    ax.plot(times, values, color="black", linewidth=0.6 if small else 1)
+    peaks = [p for p in peaks if 0 <= p < len(values)]
+    if peaks:
+        ax.plot(times[peaks], values[peaks], "o", color="red", markersize=2 if small else 4)
+    if not small:
+        ax.set_xlabel("Time (ms)")
+        ax.set_ylabel(f"{label} (a.u.)")
+
+
+def render_well_plots(well, out_dir, dpi=DEFAULT_DPI, force=False):
+    """
+    Draw the macro's three plots of one well into out_dir/<results folder>/.
+    Plots newer than the well's traces are kept. Returns the paths of the plots.
+    """
+    well_dir = os.path.join(out_dir, well["name"])
+    os.makedirs(well_dir, exist_ok=True)
+    source_mtime = os.path.getmtime(well["source"])
+    paths = [os.path.join(well_dir, f"{name}.jpg") for name in WELL_PLOTS]
+    if not force and all(os.path.isfile(p) and os.path.getmtime(p) >= source_mtime for p in paths):
+        return paths
+
+    contraction, speed, fps = well["contraction"], well["speed"], well["fps"]
+    for path, name in zip(paths, WELL_PLOTS):
+        fig, ax = plt.subplots(figsize=(8, 4))
+        if name == "Contraction":
+            draw_trace(ax, contraction, fps, well["peaks"], name)
+        elif name == "Speed of contraction":
+            draw_trace(ax, speed, fps, (), name)
+        else:
+            # speedLinCompare: |contraction[j+1] - contraction[j]| against the measured speed
+            n = min(len(speed), len(contraction) - 1)
+            calculated = np.abs(np.diff(contraction[:n + 1]))
+            times = time_axis(calculated, fps)
+            ax.plot(times, normalize(speed[:n]), color="black")
+            ax.plot(times, normalize(calculated), color="red")
+            ax.set_xlabel("Time (ms)")
+            ax.set_ylabel("Normalized contraction speed (a.u.)")
+        ax.set_title(f"{well['name']} - {name}", fontsize=9)
+        fig.tight_layout()
+        fig.savefig(path, dpi=dpi)
+        plt.close(fig)
+    return paths
+
+
+def _render_well(args):
+    well, out_dir, dpi, force = args
+    return render_well_plots(well, out_dir, dpi, force)
+
+
+def render_wells(wells, out_dir, workers=None, dpi=DEFAULT_DPI, force=False):
+    """Per-well plots of the given wells, drawn in a process pool. Returns the plot paths."""
+    if not wells:
+        return []
+    jobs = [(well, out_dir, dpi, force) for well in wells]
+    if workers == 1 or len(jobs) == 1:
+        results = map(_render_well, jobs)
+        return [path for paths in results for path in paths]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return [path for paths in pool.map(_render_well, jobs) for path in paths]
+
+
+# -------------------------------
+# Plate views
+# -------------------------------
+
+def render_montage(wells, path, trace="contraction", title=None, dpi=DEFAULT_DPI):
+    """All wells of a plate as small traces at their plate positions."""
+    fig, axes = plt.subplots(PLATE_ROWS, PLATE_COLUMNS, figsize=(PLATE_COLUMNS * 1.6, PLATE_ROWS * 1.2),
+                             sharex=True)
+    for ax in axes.flat:
+        ax.set_xticks([])
+        ax.set_yticks([])
+    for well in wells:
+        position = well_position(well["fields"]["well"])
+        if position is None:
+            print(f"Warning: well {well['name']} is outside the {PLATE_ROWS}x{PLATE_COLUMNS} plate, not in the montage")
+            continue
+        ax = axes[position]
+        peaks = well["peaks"] if trace == "contraction" else ()
+        draw_trace(ax, well[trace], well["fps"], peaks, small=True)
+        ax.set_title(f"{well_label(well['fields']['well'])} ({well['fields']['well']})", fontsize=6, pad=2)
+    fig.suptitle(title or f"{trace.capitalize()} traces")
+    fig.tight_layout()
+    fig.savefig(path, dpi=dpi)
+    plt.close(fig)
+    return path
+
+
+def plate_grid(wells, column):
+    """(rows, columns) array of a summary column by well position, NaN where there is no value."""
+    grid = np.full((PLATE_ROWS, PLATE_COLUMNS), np.nan)
+    for well in wells:
+        position = well_position(well["fields"]["well"])
+        value = pd.to_numeric(well["summary"].get(column), errors="coerce")
+        if position is not None and pd.notna(value):
+            grid[position] = value
+    return grid
+
+
+def render_heatmap(wells, column, path, title=None, dpi=DEFAULT_DPI):
+    """A summary column (e.g. Heart Beat (BPM)) by well position, values written in the wells."""
+    grid = plate_grid(wells, column)
+    fig, ax = plt.subplots(figsize=(PLATE_COLUMNS * 0.8 + 1.5, PLATE_ROWS * 0.8))
+    image = ax.imshow(np.ma.masked_invalid(grid), cmap="viridis")
+    image.cmap.set_bad("lightgrey")
+    ax.set_xticks(range(PLATE_COLUMNS))
+    ax.set_xticklabels([str(c + 1) for c in range(PLATE_COLUMNS)])
+    ax.set_yticks(range(PLATE_ROWS))
+    ax.set_yticklabels([chr(ord("A") + r) for r in range(PLATE_ROWS)])
+    finite = grid[np.isfinite(grid)]
+    middle = (finite.min() + finite.max()) / 2 if len(finite) else 0
+    for (r, c), value in np.ndenumerate(grid):
+        if np.isfinite(value):
+            ax.text(c, r, f"{value:.4g}", ha="center", va="center", fontsize=6,
+                    color="white" if value < middle else "black")
+    fig.colorbar(image, ax=ax, label=column)
+    ax.set_title(title or column)
+    fig.tight_layout()
+    fig.savefig(path, dpi=dpi)
+    plt.close(fig)
+    return path
+
+
+def file_label(column):
+    """A summary column as part of a file name, e.g. "Heart Beat (BPM)" -> heart-beat-bpm."""
+    return "-".join("".join(c.lower() if c.isalnum() else " " for c in column).split())
+
+
+def render_plate(base_dir, plots_dir=None, heatmap_columns=DEFAULT_HEATMAP_COLUMNS, wells=None,
+                 workers=None, dpi=DEFAULT_DPI, force=False):
+    """
+    Plate montages and heatmaps of a results folder and, for the wells asked for
+    ("all" or well numbers / folder names), the per-well plots. Returns the written paths.
+    """
+    if plt is None:
+        print("matplotlib is not installed, no plots are rendered")
+        return []
+    plots_dir = plots_dir or get_plots_dir(base_dir)
+    os.makedirs(plots_dir, exist_ok=True)
+    with stage("load_plot_data", base_dir=base_dir):
+        plate_wells = load_plate_wells(base_dir)
+    if not plate_wells:
+        print(f"No traces found under {base_dir}")
+        return []
+
+    name = os.path.basename(os.path.normpath(base_dir))
+    paths = []
+    with stage("render_plate_plots", base_dir=base_dir):
+        for trace in ("contraction", "speed"):
+            paths.append(render_montage(plate_wells, os.path.join(plots_dir, f"montage-{trace}.png"), trace,
+                                        f"{name}: {trace} traces", dpi))
+        for column in heatmap_columns:
+            paths.append(render_heatmap(plate_wells, column, os.path.join(plots_dir, f"heatmap-{file_label(column)}.png"),
+                                        f"{name}: {column}", dpi))
+
+    if wells:
+        selected = plate_wells if "all" in wells else [
+            well for well in plate_wells
+            if well["name"] in wells or well["fields"]["well"] in wells
+            or well["fields"]["well"].lstrip("0") in wells or well_label(well["fields"]["well"]) in wells
+        ]
+        with stage("render_well_plots", base_dir=base_dir, wells=len(selected)):
+            paths.extend(render_wells(selected, plots_dir, workers, dpi, force))
+    print(f"[✓] Plots of {name}: {len(paths)} files in {plots_dir}")
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render plate montages, heatmaps and per-well plots from stored traces.")
+    parser.add_argument("base_dir", help="Results folder of a plate, e.g. Plate_1_results")
+    parser.add_argument("--output", default=None, help="Plots folder (default: <base_dir>_plots next to it)")
+    parser.add_argument("--heatmap", nargs="+", default=list(DEFAULT_HEATMAP_COLUMNS),
+                        help="Summary columns to draw as plate heatmaps")
+    parser.add_argument("--wells", nargs="+", default=None,
+                        help="Also draw the per-well plots of these wells (001, 1, A1, folder name or 'all')")
+    parser.add_argument("--workers", type=int, default=None, help="Processes for the per-well plots (default: all cores)")
+    parser.add_argument("--dpi", type=int, default=DEFAULT_DPI, help="Resolution of the plots")
+    parser.add_argument("--force", action="store_true", help="Redraw per-well plots that are up to date")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.base_dir):
+        print(f"Error: '{args.base_dir}' is not a valid directory.")
+        sys.exit(1)
+
+    render_plate(args.base_dir, args.output, args.heatmap, args.wells, args.workers, args.dpi, args.force)
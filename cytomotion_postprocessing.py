@@ -1,10 +1,16 @@
 import sys
 import os
+import argparse
 
 # Import functions
-from update_csv_file_headers_2 import process_directory  
-from generate_summary_file import generate_summary_table  
+from update_csv_file_headers_2 import process_directory
+from generate_summary_file import generate_summary_table, update_summary_table
 from adding_prefixes_to_cytomotion_files import prepend_tag_to_files
+from cytomotion_manifest import load_manifest, save_manifest, find_changed_folders, record_folder, forget_folders
+from cytomotion_catalog import ResultsCatalog
+from cytomotion_metrics import stage, configure_metrics, get_metrics_path, collect_log_elapsed, export_prometheus
+from cytomotion_results_store import write_results_store, pa
+from cytomotion_trace_container import is_trace_file
 
 # Headers list
 HEADERS = [
@@ -20,20 +26,21 @@ HEADERS = [
     "Peak to Peak Interval (ms)"
 ]
 
-def check_file_count(base_dir, expected_count=96, log_file="ERR_FILE_COUNT.log"):
+def check_file_count(base_dir, expected_count=96, log_file="ERR_FILE_COUNT.log", catalog=None):
     """
     Check that each subfolder in base_dir has the expected number of files.
-    If not, write an error log.
+    If not, write an error log. The binary trace container is not one of the
+    expected files, so folders written with and without it are counted alike.
     """
     errors = []
+    if catalog is None:
+        catalog = ResultsCatalog(base_dir)
 
-    for subfolder in os.listdir(base_dir):
+    for subfolder in catalog.subfolders():
         subfolder_path = os.path.join(base_dir, subfolder)
-        if not os.path.isdir(subfolder_path):
-            continue
 
-        # Count only files
-        num_files = len([f for f in os.listdir(subfolder_path) if os.path.isfile(os.path.join(subfolder_path, f))])
+        # Count only files, without the trace container
+        num_files = len([name for name in catalog.regular_files(subfolder_path) if not is_trace_file(name)])
         if num_files != expected_count:
             errors.append(f" Subfolder '{subfolder}' has {num_files} files (expected {expected_count})")
 
@@ -46,32 +53,113 @@ def check_file_count(base_dir, expected_count=96, log_file="ERR_FILE_COUNT.log")
         print(f" All subfolders have {expected_count} files.")
 
 
-def main(base_dir):
+def update_results_store(base_dir, store_dir=None, folders=None, removed=(), catalog=None):
+    """Write the Parquet results store and the well aggregates (only the aggregates without pyarrow)."""
+    if pa is None:
+        print(" pyarrow is not installed, only the well aggregates are written to the results store")
+    write_results_store(base_dir, HEADERS, store_dir, folders, removed, catalog)
+
+
+def main_incremental(base_dir, store_dir=None):
+    """
+    Run the postprocessing steps only on results folders that are new or changed since
+    the last run (tracked in the manifest), merging their rows into the existing summary.
+    """
+    catalog = ResultsCatalog(base_dir)
+    manifest = load_manifest(base_dir)
+    changed, removed = find_changed_folders(base_dir, manifest, catalog=catalog)
+    print(f"Incremental run: {len(changed)} new/changed folders, {len(removed)} removed\n")
+    changed_paths = [os.path.join(base_dir, name) for name in changed]
+
+    print("STEP 1: Adding headers to CSV files - START")
+    with stage("add_headers", base_dir=base_dir):
+        for folder in changed_paths:
+            process_directory(folder, catalog)
+    print("STEP 1: Adding headers - COMPLETED\n")
+
+    print("STEP 2: Generating summary CSV - START")
+    with stage("generate_summary", base_dir=base_dir):
+        if changed or removed:
+            update_summary_table(base_dir, HEADERS, changed_paths, removed, catalog=catalog)
+    print("STEP 2: Summary generation - COMPLETED\n")
+
+    print("STEP 3: Adding prefixes to cytomotion output files - START")
+    with stage("prepend_tags", base_dir=base_dir):
+        prepend_tag_to_files(base_dir, changed, catalog)
+    print("STEP 3: Adding prefixes to cytomotion output files - COMPLETED\n")
+
+    # Record the folders as they are after all stages, so the next run sees them unchanged
+    for name in changed:
+        record_folder(base_dir, manifest, name, catalog=catalog)
+    forget_folders(manifest, removed)
+    save_manifest(base_dir, manifest)
+
+    print("STEP 4: Checking file counts in subfolders - START")
+    with stage("check_file_count", base_dir=base_dir):
+        check_file_count(base_dir, catalog=catalog)
+    print("STEP 4: File count check - COMPLETED\n")
+
+    print("STEP 5: Writing results store - START")
+    with stage("results_store", base_dir=base_dir):
+        update_results_store(base_dir, store_dir, changed, removed, catalog)
+    print("STEP 5: Results store - COMPLETED\n")
+
+    if get_metrics_path():
+        collect_log_elapsed(base_dir, catalog)
+        export_prometheus()
+
+
+def main(base_dir, incremental=False, store_dir=None):
     if not os.path.isdir(base_dir):
         print(f"Error: '{base_dir}' is not a valid directory.")
         sys.exit(1)
 
+    if incremental:
+        main_incremental(base_dir, store_dir)
+        return
+
+    # Scan the results tree once; every step below works from this catalog
+    catalog = ResultsCatalog(base_dir)
+
     print("STEP 1: Adding headers to CSV files - START")
-    process_directory(base_dir)
+    with stage("add_headers", base_dir=base_dir):
+        process_directory(base_dir, catalog)
     print("STEP 1: Adding headers - COMPLETED\n")
 
     print("STEP 2: Generating summary CSV - START")
-    generate_summary_table(base_dir, HEADERS)
+    with stage("generate_summary", base_dir=base_dir):
+        generate_summary_table(base_dir, HEADERS, catalog=catalog)
     print("STEP 2: Summary generation - COMPLETED\n")
 
     print("STEP 3: Adding prefixes to cytomotion output files - START")
-    prepend_tag_to_files(base_dir)
+    with stage("prepend_tags", base_dir=base_dir):
+        prepend_tag_to_files(base_dir, catalog=catalog)
     print("STEP 3: Adding prefixes to cytomotion output files - COMPLETED\n")
 
     print("STEP 4: Checking file counts in subfolders - START")
-    check_file_count(base_dir)
+    with stage("check_file_count", base_dir=base_dir):
+        check_file_count(base_dir, catalog=catalog)
     print("STEP 4: File count check - COMPLETED\n")
 
+    print("STEP 5: Writing results store - START")
+    with stage("results_store", base_dir=base_dir):
+        update_results_store(base_dir, store_dir, catalog=catalog)
+    print("STEP 5: Results store - COMPLETED\n")
+
+    if get_metrics_path():
+        collect_log_elapsed(base_dir, catalog)
+        export_prometheus()
+
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python main_script.py <base_directory>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Postprocess the -Contr-Results folders of a base directory.")
+    parser.add_argument("base_directory")
+    parser.add_argument("--incremental", action="store_true", help="Only process folders that changed since the last run")
+    parser.add_argument("--store", default=None, help="Results store directory (default: results_store next to base_directory)")
+    parser.add_argument("--metrics", default=None, help="Append per-stage metrics and the wells' elapsed times to this JSON-lines file")
+    parser.add_argument("--prometheus", default=None, help="Also export the metrics as a Prometheus textfile")
+    args = parser.parse_args()
+
+    configure_metrics(args.metrics, args.prometheus)
 
-    base_directory = sys.argv[1]
-    main(base_directory)
\ No newline at end of file
+    main(args.base_directory, incremental=args.incremental, store_dir=args.store)
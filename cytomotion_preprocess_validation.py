@@ -2,6 +2,8 @@ import os
 import re
 import sys
 
+from cytomotion_video_probe import probe_videos, summarize_plate, DEFAULT_PROBE_WORKERS
+
 COUNTER_FILE = "run_counter.txt"
 FINAL_LOG = "Validation_log.log"
 
@@ -25,7 +27,11 @@ def write_log(run_number, suffix, messages):
             f.write(msg + "\n")
     print(f"❌ Wrote log: {filename}")
 
-def validate_files(path):
+def validate_files(path, probe=True, workers=DEFAULT_PROBE_WORKERS):
+    """
+    Check names, count and uniqueness of the MP4s in path and, with probe=True, their content.
+    Returns the plate's frame count / fps / dimensions from the probe (None without probing).
+    """
     print("PRE_START")
     run_number = get_run_number()
     log_messages = [f"Validation Run: {run_number}", f"Folder: {path}", ""]
@@ -78,6 +84,20 @@ def validate_files(path):
     else:
         log_messages.append("Filename uniqueness: PASSED")
 
+    # --- Check 4: Video content (metadata, first and last frame) ---
+    plate = None
+    if probe and files:
+        plate, problems = summarize_plate(probe_videos(files, workers))
+        if problems:
+            log_messages.append("Video content: FAILED")
+            log_messages.extend(problems)
+            write_log(run_number, "PRE_VIDEO_CONTENT", ["Video content problems:"] + problems)
+            all_passed = False
+        else:
+            log_messages.append("Video content: PASSED")
+        log_messages.append(f"Plate frame count: {plate['frame_count']}, fps: {plate['fps']}, "
+                            f"size: {plate['width']}x{plate['height']}")
+
     # --- Write final log (UTF-8) ---
     with open(FINAL_LOG, "a", encoding="utf-8") as f:
         f.write("\n".join(log_messages))
@@ -86,6 +106,7 @@ def validate_files(path):
     print("PRE_COMPLETED")
     if all_passed:
         print("OK")
+    return plate
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
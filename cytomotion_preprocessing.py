@@ -1,52 +1,73 @@
 import os
 import sys
-from rename_videos_mp4 import rename_videos
+import argparse
+from rename_videos_mp4 import rename_videos, STAGING_MODES, DEFAULT_STAGING_MODE
 from cytomotion_preprocess_validation import validate_files
-from convert_mp4_to_uncompressed_avi_2 import convert_all_mp4_to_avi
+from cytomotion_motion_analysis import analyze_directory, get_recorded_framerate
+from cytomotion_metrics import stage, configure_metrics, export_prometheus
+from cytomotion_frame_cache import configure_frame_cache, DEFAULT_CACHE_DIR
 
 # -------------------------------
 # Import or define your three functions
 # -------------------------------
-# 1. rename_videos(base_path) -> outputs renamed files in a folder
+# 1. rename_videos(base_path) -> stages renamed files (links or copies) in a folder
 # 2. validate_files(path) -> the validation function we wrote
-# 3. convert_mp4_to_avi(path) -> converts all mp4s in path to avi
+# 3. analyze_directory(path, save_dir) -> streams the MP4s in path straight into the
+#    motion analysis (optionally exporting uncompressed AVIs on the way)
 
-def main(base_path):
+def get_results_path(base_path):
+    """Folder the -Contr-Results of a plate are written to, e.g. .../Plate_1 -> .../Plate_1_results"""
+    return os.path.join(os.path.dirname(base_path), f"{os.path.basename(base_path)}_results")
+
+def main(base_path, export_avi=False, staging_mode=DEFAULT_STAGING_MODE, framerate=None):
     print("=== WORKFLOW START ===")
-    
+
     # Step 1: Rename MP4s
     print("STEP 1: Renaming MP4s - START")
-    renamed_path = rename_videos(base_path)  # Should return the folder with renamed files
+    with stage("rename_videos", plate=base_path):
+        renamed_path = rename_videos(base_path, staging_mode)  # Should return the folder with renamed files
     print("STEP 1: Renaming MP4s - COMPLETED\n")
-    
+
     # Step 2: Validate renamed files
     print("STEP 2: Validation - START")
-    validate_files(renamed_path)
+    with stage("validate_files", plate=base_path):
+        plate = validate_files(renamed_path)
+    if plate and plate["frame_count"]:
+        print(f"Plate recording: {plate['frame_count']} frames at {plate['fps']:g} fps")
+    recorded_framerate = get_recorded_framerate(plate["fps"] if plate else None, framerate)
+    print(f"Analyzing at recordedFramerate {recorded_framerate:g}")
     print("STEP 2: Validation - COMPLETED\n")
-    
-    # Step 3: Convert MP4 to AVI
-    print("STEP 3: MP4 → AVI Conversion - START")
-    convert_all_mp4_to_avi(renamed_path)
-    print("STEP 3: MP4 → AVI Conversion - COMPLETED\n")
-    
+
+    # Step 3: Analyze MP4s (streamed, no AVI conversion needed)
+    print("STEP 3: Motion analysis - START")
+    results_path = get_results_path(base_path)
+    with stage("motion_analysis", plate=base_path):
+        analyze_directory(renamed_path, results_path, export_avi=export_avi, recorded_framerate=recorded_framerate)
+    print(f"Results stored in: {results_path}")
+    print("STEP 3: Motion analysis - COMPLETED\n")
+
+    export_prometheus()
     print("=== WORKFLOW COMPLETED ===")
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python main_workflow.py <path_to_folder>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Rename, validate and analyze the MP4s of a plate.")
+    parser.add_argument("base_path", help="Plate folder, e.g. CP011_20250609_D25/Plate_1")
+    parser.add_argument("--export-avi", action="store_true", help="Also write uncompressed AVIs")
+    parser.add_argument("--staging", choices=STAGING_MODES, default=DEFAULT_STAGING_MODE,
+                        help="How renamed MP4s are staged (default: auto = hardlink, else reflink, else copy)")
+    parser.add_argument("--framerate", type=float, default=None,
+                        help="recordedFramerate to analyze with (default: the plate's fps from the videos)")
+    parser.add_argument("--frame-cache", nargs="?", const=DEFAULT_CACHE_DIR, default=None,
+                        help=f"Decode each well once into this cache directory (default: {DEFAULT_CACHE_DIR})")
+    parser.add_argument("--frame-cache-mb", type=float, default=None, help="Size cap of the frame cache in MB")
+    parser.add_argument("--metrics", default=None, help="Append per-stage/per-well metrics to this JSON-lines file")
+    parser.add_argument("--prometheus", default=None, help="Also export the metrics as a Prometheus textfile")
+    args = parser.parse_args()
 
-    base_path = sys.argv[1]
-    if not os.path.isdir(base_path):
-        print(f"Error: {base_path} is not a valid directory")
+    if not os.path.isdir(args.base_path):
+        print(f"Error: {args.base_path} is not a valid directory")
         sys.exit(1)
 
-    main(base_path)
-
-
-
-
-
-
-
-
+    configure_metrics(args.metrics, args.prometheus)
+    configure_frame_cache(args.frame_cache, args.frame_cache_mb)
+    main(args.base_path, export_avi=args.export_avi, staging_mode=args.staging, framerate=args.framerate)
@@ -0,0 +1,306 @@
+import os
+import sys
+import json
+import shutil
+import argparse
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency, the store is skipped without it
+    pa = ds = pq = None
+
+from cytomotion_catalog import ResultsCatalog, parse_results_fields
+from generate_summary_file import (
+    METRICS, DEFAULT_READ_WORKERS, find_csv_files, read_summary_inputs, summarize_frames, collect_metric_values,
+)
+from cytomotion_aggregates import build_well_aggregate, rollup_aggregates, AGGREGATE_VERSION
+
+# -------------------------------
+# Columnar results store
+# -------------------------------
+# Per-beat rows and per-well summary rows of every results folder, written as Parquet
+# datasets partitioned like the folder tags:
+#
+#   <store>/beats/cp=CP012/day=D33/plate=P001/well=001/part-0.parquet
+#   <store>/wells/cp=CP012/day=D33/plate=P001/well=001/part-0.parquet
+#
+# A well's partition is rewritten as a whole, so re-running a folder replaces its rows.
+# A well analysed again gets a new <tag>-Contr-Results-N folder next to the old one; both
+# map to the same partition, which always holds the newest run (highest N) of the well.
+# Older runs stay in the results folder but are not stored.
+# The store sits next to the results folder by default (not inside it, so it is not
+# taken for a results folder) and can be shared by several experiments.
+# Each well also gets a mergeable aggregate record (see cytomotion_aggregates) under
+# <store>/aggregates/..., written without pyarrow too, so plate/day/compound rollups
+# merge 96 small records per plate instead of re-reading the beats.
+# Queries only visit the partition directories matching the cp/day/plate/well filters
+# and only read the requested columns.
+
+STORE_DIR = "results_store"
+BEATS = "beats"
+WELLS = "wells"
+AGGREGATES = "aggregates"
+AGGREGATE_FILE = "aggregate.json"
+PARTITION_FIELDS = ("cp", "day", "plate", "well")
+PART_FILE = "part-0.parquet"
+
+BEAT_COLUMNS = [metric for metric, _ in METRICS]
+
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError("The results store needs pyarrow (pip install pyarrow)")
+
+
+def get_store_dir(base_dir):
+    """Default store location: results_store next to base_dir."""
+    return os.path.join(os.path.dirname(os.path.abspath(base_dir)), STORE_DIR)
+
+
+def get_partition_dir(store_dir, table, fields):
+    return os.path.join(store_dir, table, *(f"{key}={fields[key]}" for key in PARTITION_FIELDS))
+
+
+def beat_schema():
+    return pa.schema(
+        [("folder", pa.string()), ("source_file", pa.string()), ("beat", pa.int64())]
+        + [(column, pa.float64()) for column in BEAT_COLUMNS]
+    )
+
+
+def well_schema(columns):
+    return pa.schema(
+        [("source_file", pa.string()), ("File Name", pa.string())]
+        + [(column, pa.float64()) for column in columns if column not in ("source_file", "File Name")]
+    )
+
+
+def build_beat_frame(folder, file_path, df):
+    """Per-beat rows of one CSV (header row already dropped), metrics as floats."""
+    beats = pd.DataFrame({
+        "folder": folder,
+        "source_file": os.path.basename(file_path),
+        "beat": np.arange(len(df), dtype=np.int64),
+    })
+    for metric, header in METRICS:
+        beats[metric] = pd.to_numeric(df[header], errors="coerce").to_numpy(dtype=np.float64)
+    return beats
+
+
+def write_partition(store_dir, table, fields, df, schema):
+    """Replace one well's partition with df (written to a temp file first)."""
+    partition_dir = get_partition_dir(store_dir, table, fields)
+    os.makedirs(partition_dir, exist_ok=True)
+    path = os.path.join(partition_dir, PART_FILE)
+    tmp_path = path + ".tmp"
+    arrow_table = pa.Table.from_pandas(df[schema.names], schema=schema, preserve_index=False)
+    pq.write_table(arrow_table, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def newest_runs(names):
+    """{partition key: folder name of the newest run of that well} of results folder names."""
+    newest = {}
+    for name in names:
+        fields = parse_results_fields(name)
+        if fields is None:
+            continue
+        key = tuple(fields[field] for field in PARTITION_FIELDS)
+        if key not in newest or fields["run"] > parse_results_fields(newest[key])["run"]:
+            newest[key] = name
+    return newest
+
+
+def write_well_aggregate(store_dir, fields, record):
+    partition_dir = get_partition_dir(store_dir, AGGREGATES, fields)
+    os.makedirs(partition_dir, exist_ok=True)
+    path = os.path.join(partition_dir, AGGREGATE_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(record, f)
+    os.replace(path + ".tmp", path)
+
+
+def remove_partitions(store_dir, fields):
+    for table in (BEATS, WELLS, AGGREGATES):
+        shutil.rmtree(get_partition_dir(store_dir, table, fields), ignore_errors=True)
+
+
+def write_results_store(base_dir, headers, store_dir=None, folders=None, removed=(),
+                        catalog=None, workers=DEFAULT_READ_WORKERS, parquet=True):
+    """
+    Write the per-beat and per-well rows and the aggregate record of the results folders
+    of base_dir to the store. `folders` limits the update to those folder names; partitions
+    of `removed` folder names are deleted. A well with several runs is stored from its
+    newest run, also when `folders` or `removed` name an older one. Without pyarrow (or
+    with parquet=False) only the aggregate records are written. Returns the number of
+    wells written.
+    """
+    parquet = parquet and pa is not None
+    store_dir = store_dir or get_store_dir(base_dir)
+    names = catalog.subfolders() if catalog is not None else sorted(
+        f for f in os.listdir(base_dir) if os.path.isdir(os.path.join(base_dir, f)))
+    newest = newest_runs(names)
+    if folders is None:
+        folders = names
+
+    selected = set()
+    for name in list(folders) + list(removed):
+        fields = parse_results_fields(name)
+        if fields is None:
+            continue
+        key = tuple(fields[field] for field in PARTITION_FIELDS)
+        if key in newest:
+            selected.add(newest[key])
+        elif name in removed:
+            remove_partitions(store_dir, fields)
+
+    wells = {}
+    csv_files = []
+    for name in names:
+        if name not in selected:
+            continue
+        folder_path = os.path.join(base_dir, name)
+        wells[folder_path] = parse_results_fields(name)
+        csv_files.extend(find_csv_files(folder_path, catalog))
+
+    logs, entries, frames = read_summary_inputs(csv_files, headers, workers, catalog)
+    rows = summarize_frames(logs, entries, frames)
+    metric_values = collect_metric_values(frames)
+
+    beats_per_well = {folder_path: [] for folder_path in wells}
+    rows_per_well = {folder_path: [] for folder_path in wells}
+    values_per_well = {folder_path: {} for folder_path in wells}
+    for index, ((root, file_path), df, row) in enumerate(zip(entries, frames, rows)):
+        if root not in wells:
+            continue  # CSV in a nested folder, stored with its own results folder only
+        beats_per_well[root].append(build_beat_frame(os.path.basename(root), file_path, df))
+        rows_per_well[root].append(dict(row, source_file=os.path.basename(file_path)))
+        for m, (metric, _) in enumerate(METRICS):
+            if (index, m) in metric_values:
+                values_per_well[root].setdefault(metric, []).append(metric_values[(index, m)])
+
+    written = 0
+    for folder_path, fields in wells.items():
+        if not rows_per_well[folder_path]:
+            # Nothing readable left in this folder: do not keep stale rows
+            remove_partitions(store_dir, fields)
+            continue
+        values = {metric: np.concatenate(parts) for metric, parts in values_per_well[folder_path].items()}
+        write_well_aggregate(store_dir, fields, build_well_aggregate(fields, os.path.basename(folder_path), values))
+        if parquet:
+            beats = pd.concat(beats_per_well[folder_path], ignore_index=True)
+            well_rows = pd.DataFrame(rows_per_well[folder_path])
+            write_partition(store_dir, BEATS, fields, beats, beat_schema())
+            write_partition(store_dir, WELLS, fields, well_rows, well_schema(well_rows.columns))
+        written += 1
+
+    print(f"\n Results store updated at: {store_dir} ({written} wells written"
+          + ("" if parquet else ", aggregates only") + ")")
+    return written
+
+
+# -------------------------------
+# Query API
+# -------------------------------
+
+def _as_values(value):
+    return None if value is None else [value] if isinstance(value, str) else [str(v) for v in value]
+
+
+def find_partition_files(store_dir, table, cp=None, day=None, plate=None, well=None, suffix=".parquet"):
+    """
+    Files (Parquet by default) of the partitions matching the filters (a value or a list of
+    values per field). Directories of fixed values are visited directly instead of being listed.
+    """
+    filters = dict(zip(PARTITION_FIELDS, map(_as_values, (cp, day, plate, well))))
+
+    def visit(dir_path, depth):
+        if depth == len(PARTITION_FIELDS):
+            try:
+                with os.scandir(dir_path) as entries:
+                    return sorted(e.path for e in entries if e.is_file() and e.name.endswith(suffix))
+            except OSError:
+                return []
+        field = PARTITION_FIELDS[depth]
+        if filters[field] is not None:
+            names = [f"{field}={value}" for value in filters[field]]
+        else:
+            try:
+                with os.scandir(dir_path) as entries:
+                    names = sorted(e.name for e in entries if e.is_dir() and e.name.startswith(f"{field}="))
+            except OSError:
+                return []
+        files = []
+        for name in names:
+            files.extend(visit(os.path.join(dir_path, name), depth + 1))
+        return files
+
+    return visit(os.path.join(store_dir, table), 0)
+
+
+def load_table(store_dir, table, columns=None, cp=None, day=None, plate=None, well=None):
+    """
+    Load rows of the beats or wells table as a DataFrame. Only the partitions matching the
+    filters and only the requested columns (plus cp/day/plate/well) are read.
+    """
+    require_pyarrow()
+    if columns is not None:
+        columns = list(PARTITION_FIELDS) + [c for c in columns if c not in PARTITION_FIELDS]
+
+    files = find_partition_files(store_dir, table, cp, day, plate, well)
+    if not files:
+        return pd.DataFrame(columns=columns or list(PARTITION_FIELDS))
+
+    partitioning = ds.partitioning(pa.schema([(field, pa.string()) for field in PARTITION_FIELDS]), flavor="hive")
+    dataset = ds.dataset(files, format="parquet", partitioning=partitioning,
+                         partition_base_dir=os.path.join(store_dir, table))
+    return dataset.to_table(columns=columns).to_pandas()
+
+
+def load_beats(store_dir, columns=None, cp=None, day=None, plate=None, well=None):
+    """Per-beat rows, e.g. load_beats(store, ["TTP"], cp="CP012") for TTP over the days of CP012."""
+    return load_table(store_dir, BEATS, columns, cp, day, plate, well)
+
+
+def load_wells(store_dir, columns=None, cp=None, day=None, plate=None, well=None):
+    """Per-well summary rows (the columns of summary-final-updated.csv)."""
+    return load_table(store_dir, WELLS, columns, cp, day, plate, well)
+
+
+def load_well_aggregates(store_dir, cp=None, day=None, plate=None, well=None):
+    """Aggregate records of the wells matching the filters."""
+    records = []
+    for path in find_partition_files(store_dir, AGGREGATES, cp, day, plate, well, suffix=".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            record = json.load(f)
+        if record.get("version") == AGGREGATE_VERSION:
+            records.append(record)
+    return records
+
+
+def rollup(store_dir, level="plate", cp=None, day=None, plate=None, well=None):
+    """
+    Per-metric statistics per cp, day, plate or well, merged from the aggregate records,
+    e.g. rollup(store, "day", cp="CP012") for the days of CP012 without reading any beats.
+    """
+    return rollup_aggregates(load_well_aggregates(store_dir, cp, day, plate, well), level)
+
+
+if __name__ == "__main__":
+    from cytomotion_postprocessing import HEADERS
+
+    parser = argparse.ArgumentParser(description="Write the results folders of a base directory to the Parquet results store.")
+    parser.add_argument("base_dir", help="Folder containing the -Contr-Results folders")
+    parser.add_argument("--store", default=None, help="Store directory (default: results_store next to base_dir)")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.base_dir):
+        print(f"Error: '{args.base_dir}' is not a valid directory.")
+        sys.exit(1)
+
+    write_results_store(args.base_dir, HEADERS, args.store, catalog=ResultsCatalog(args.base_dir))
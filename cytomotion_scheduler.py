@@ -0,0 +1,197 @@
+import os
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from rename_videos_mp4 import rename_videos, STAGING_MODES, DEFAULT_STAGING_MODE
+from cytomotion_preprocess_validation import validate_files, get_run_number, write_log
+from cytomotion_preprocessing import get_results_path
+from cytomotion_frame_reader import get_video_info, DEFAULT_BUFFER_SIZE
+from cytomotion_motion_analysis import (
+    analyze_video, get_recorded_framerate, get_autodetect_frame_count, DEFAULT_CHUNK_SIZE, BINNING_FACTORS,
+)
+from cytomotion_metrics import stage, configure_metrics, export_prometheus
+from cytomotion_frame_cache import configure_frame_cache, DEFAULT_CACHE_DIR
+
+# -------------------------------
+# Plate-level scheduler
+# -------------------------------
+# Wells are independent, so after renaming and validating each plate, every well of
+# every plate is submitted to one process pool. The worker count is capped so that
+# workers * memory budget fits in the available RAM, and each worker sizes its frame
+# buffers to stay within its budget. Failed wells are logged to ERR_<run>_WELL_ANALYSIS.log.
+#
+# A worker's budget covers, besides the decode queue and the analysis chunk:
+#   - the SNR mask (maxProject), held for the whole analysis
+#   - the autodetectReferenceFrame block (the first ~300 frames, held together with the
+#     decode queue while the reference frame is detected). At full resolution it is
+#     1 byte per pixel per frame, e.g. ~1.3 GB for 2048 x 2048 video; when it does not
+#     fit, it is read downsampled (float32 tiles of 4, 8, ...), which is approximate and
+#     logged as *referenceDownsample in the Log_file.
+
+DEFAULT_MEMORY_BUDGET_MB = 1024
+
+# Bytes held per frame: uint8 frame in the decode queue, and float32 data + difference
+# images for a frame in the analysis chunk
+QUEUE_BYTES_PER_PIXEL = 1
+CHUNK_BYTES_PER_PIXEL = 12
+# float32 projection, reference and mask of the SNR mask
+MASK_BYTES_PER_PIXEL = 12
+
+
+def get_available_memory():
+    """Available physical memory in bytes, or None if it cannot be determined."""
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def get_worker_count(workers=None, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB):
+    """Requested worker count (default: all cores), capped by available memory / per-worker budget."""
+    count = workers or os.cpu_count() or 1
+    available = get_available_memory()
+    if available is not None and memory_budget_mb:
+        count = min(count, max(1, available // (memory_budget_mb * 1024 * 1024)))
+    return max(1, int(count))
+
+
+def get_reference_block_bytes(pixels, frame_count, downsample=1):
+    """Bytes of the autodetectReferenceFrame block: uint8 at full resolution, float32 tiles when downsampled."""
+    if downsample <= 1:
+        return frame_count * pixels
+    return frame_count * (pixels // (downsample * downsample)) * 4
+
+
+def get_buffer_sizes(video_path, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, max_project=False, binning=1,
+                     autodetect_frames=0, reference_downsample=1):
+    """
+    Split a worker's memory budget between the decode queue and the analysis chunk, after
+    the SNR mask (max_project) and the autodetectReferenceFrame block of autodetect_frames
+    frames. Returns (buffer_size, chunk_size, reference_downsample): the block is
+    downsampled further than reference_downsample if it does not fit otherwise.
+    """
+    info = get_video_info(video_path)
+    pixels = max(1, info["width"] * info["height"])
+    budget = memory_budget_mb * 1024 * 1024
+    if max_project:
+        budget -= pixels // (binning * binning) * MASK_BYTES_PER_PIXEL
+    half_budget = max(0, budget // 2)
+    buffer_size = max(1, min(DEFAULT_BUFFER_SIZE, half_budget // (pixels * QUEUE_BYTES_PER_PIXEL)))
+    chunk_size = max(1, min(DEFAULT_CHUNK_SIZE, half_budget // (pixels * CHUNK_BYTES_PER_PIXEL)))
+
+    if autodetect_frames:
+        # Held next to the decode queue and one chunk of uint8 frames (and their blurred copies)
+        room = budget - buffer_size * pixels * QUEUE_BYTES_PER_PIXEL - 2 * chunk_size * pixels
+        factors = [f for f in (1,) + BINNING_FACTORS if f >= reference_downsample] or [reference_downsample]
+        fitting = [f for f in factors if get_reference_block_bytes(pixels, autodetect_frames, f) <= room]
+        reference_downsample = fitting[0] if fitting else factors[-1]
+    return buffer_size, chunk_size, reference_downsample
+
+
+def analyze_well(video_path, save_dir, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, **kwargs):
+    """Worker entry point: analyze one well within the memory budget."""
+    well = os.path.splitext(os.path.basename(video_path))[0]
+    with stage("analyze_video", well=well):
+        autodetect_frames = 0
+        if kwargs.get("autodetect_reference"):
+            autodetect_frames = get_autodetect_frame_count(
+                **{name: kwargs[name] for name in ("speed_window", "auto_detect_start", "auto_detect_stop") if name in kwargs})
+        requested = kwargs.pop("reference_downsample", 1)
+        buffer_size, chunk_size, reference_downsample = get_buffer_sizes(
+            video_path, memory_budget_mb, kwargs.get("max_project", False), kwargs.get("binning", 1),
+            autodetect_frames, requested)
+        if reference_downsample != requested:
+            print(f"{well}: autodetect block does not fit in {memory_budget_mb} MB at full resolution, "
+                  f"downsampling it by {reference_downsample}")
+        return analyze_video(video_path, save_dir, buffer_size=buffer_size, chunk_size=chunk_size,
+                             reference_downsample=reference_downsample, **kwargs)
+
+
+def prepare_plate(base_path, staging_mode=DEFAULT_STAGING_MODE):
+    """Rename and validate one plate. Returns (save_dir, list of well videos, plate fps or None)."""
+    renamed_path = rename_videos(base_path, staging_mode)
+    plate = validate_files(renamed_path)
+    if plate and plate["frame_count"]:
+        print(f"Plate recording: {plate['frame_count']} frames at {plate['fps']:g} fps")
+    save_dir = get_results_path(base_path)
+    os.makedirs(save_dir, exist_ok=True)
+    videos = [
+        os.path.join(renamed_path, f)
+        for f in sorted(os.listdir(renamed_path))
+        if f.lower().endswith(".mp4") and os.path.isfile(os.path.join(renamed_path, f))
+    ]
+    return save_dir, videos, plate["fps"] if plate else None
+
+
+def schedule_plates(plate_paths, workers=None, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB,
+                    staging_mode=DEFAULT_STAGING_MODE, framerate=None, **kwargs):
+    """
+    Analyze all wells of one or more plates on a process pool, at each plate's fps
+    (or at framerate, if given).
+    Returns a dict {video_path: results folder} of the wells that succeeded.
+    """
+    errors = []
+    jobs = []
+    for base_path in plate_paths:
+        print(f"=== PLATE {base_path} ===")
+        try:
+            with stage("prepare_plate", plate=base_path):
+                save_dir, videos, fps = prepare_plate(base_path, staging_mode)
+        except Exception as e:
+            errors.append(f"Plate {base_path}: preparation failed: {e}")
+            continue
+        recorded_framerate = get_recorded_framerate(fps, framerate)
+        jobs.extend((video, save_dir, recorded_framerate) for video in videos)
+
+    worker_count = get_worker_count(workers, memory_budget_mb)
+    print(f"Analyzing {len(jobs)} wells on {worker_count} workers ({memory_budget_mb} MB each)")
+
+    results = {}
+    with stage("motion_analysis", wells=len(jobs), workers=worker_count), \
+            ProcessPoolExecutor(max_workers=worker_count) as pool:
+        futures = {
+            pool.submit(analyze_well, video, save_dir, memory_budget_mb,
+                        recorded_framerate=recorded_framerate, **kwargs): video
+            for video, save_dir, recorded_framerate in jobs
+        }
+        for future in as_completed(futures):
+            video = futures[future]
+            try:
+                results[video] = future.result()
+            except Exception as e:
+                print(f"[!] Failed to analyze {video}: {e}")
+                errors.append(f"Well {video}: {type(e).__name__}: {e}")
+
+    if errors:
+        run_number = get_run_number()
+        write_log(run_number, "WELL_ANALYSIS", [f"Failed wells: {len(errors)}"] + errors)
+    print(f"Analyzed {len(results)}/{len(jobs)} wells")
+    export_prometheus()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyze the wells of one or more plates on a process pool.")
+    parser.add_argument("plates", nargs="+", help="Plate folders, e.g. CP011_20250609_D25/Plate_1")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--memory-mb", type=int, default=DEFAULT_MEMORY_BUDGET_MB, help="Memory budget per worker in MB")
+    parser.add_argument("--staging", choices=STAGING_MODES, default=DEFAULT_STAGING_MODE, help="How renamed MP4s are staged")
+    parser.add_argument("--framerate", type=float, default=None,
+                        help="recordedFramerate to analyze with (default: each plate's fps from the videos)")
+    parser.add_argument("--frame-cache", nargs="?", const=DEFAULT_CACHE_DIR, default=None,
+                        help=f"Decode each well once into this cache directory (default: {DEFAULT_CACHE_DIR})")
+    parser.add_argument("--frame-cache-mb", type=float, default=None, help="Size cap of the frame cache in MB")
+    parser.add_argument("--metrics", default=None, help="Append per-stage/per-well metrics to this JSON-lines file")
+    parser.add_argument("--prometheus", default=None, help="Also export the metrics as a Prometheus textfile")
+    args = parser.parse_args()
+
+    for plate in args.plates:
+        if not os.path.isdir(plate):
+            print(f"Error: {plate} is not a valid directory")
+            sys.exit(1)
+
+    configure_metrics(args.metrics, args.prometheus)
+    configure_frame_cache(args.frame_cache, args.frame_cache_mb)
+    schedule_plates(args.plates, workers=args.workers, memory_budget_mb=args.memory_mb, staging_mode=args.staging,
+                    framerate=args.framerate)
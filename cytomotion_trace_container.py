@@ -0,0 +1,172 @@
+import os
+import sys
+import json
+import struct
+import argparse
+
+import numpy as np
+
+# -------------------------------
+# Binary trace container
+# -------------------------------
+# Next to contraction.txt and speed-of-contraction.txt, every -Contr-Results folder gets
+# one traces.cmtrace file holding both traces as float64, so batch consumers (the
+# parameter sweep, plate plots) do not have to re-parse text files:
+#   bytes 0..7     b"CYTOTRC1"
+#   bytes 8..11    uint32 JSON length
+#   JSON header    {"version", "fps", "reference_frame", "well", "source",
+#                   "traces": ["contraction", "speed-of-contraction"], "lengths", "length", "dtype"}
+#   padding        up to a multiple of 64 bytes
+#   data           (traces, length) float64, C order; "lengths" are the lengths of the
+#                  traces (the speed trace is shorter), the rest of a row is NaN
+# The values are the ones written to the text files (rounded to TRACE_DECIMALS) and are
+# stored as float64, so text_values() of a trace gives back exactly what
+# read_trace_file() reads. (Version 1 stored float32, which cannot hold 4 decimals of
+# values above ~1000; consumers read the text files of such containers instead.)
+# load_trace_matrix() memory-maps many containers and copies one trace of each into a
+# single (wells, frames) array, NaN-padded, optionally itself a memory-mapped .npy file.
+
+TRACE_FILE = "traces.cmtrace"
+TRACE_MAGIC = b"CYTOTRC1"
+TRACE_VERSION = 2
+TRACE_NAMES = ("contraction", "speed-of-contraction")
+TRACE_DECIMALS = 4  # format_number in cytomotion_motion_analysis
+HEADER_ALIGN = 64
+
+
+def is_trace_file(file_name):
+    """True for a trace container, also after the prefix step renamed it to <tag>_traces.cmtrace."""
+    return file_name == TRACE_FILE or file_name.endswith("_" + TRACE_FILE)
+
+
+def text_values(values):
+    """Trace values as float64, exactly as they read back from the text trace files."""
+    return np.round(np.asarray(values, dtype=np.float64), TRACE_DECIMALS)
+
+
+def write_trace_container(file_path, traces, fps, reference_frame, well, source=None):
+    """Write {trace name: values} (the TRACE_NAMES present) to a container file."""
+    names = [name for name in TRACE_NAMES if name in traces]
+    lengths = [len(traces[name]) for name in names]
+    length = max(lengths, default=0)
+    data = np.full((len(names), length), np.nan, dtype=np.float64)
+    for i, name in enumerate(names):
+        values = text_values(traces[name])
+        data[i, :len(values)] = values
+
+    header = {
+        "version": TRACE_VERSION, "fps": float(fps), "reference_frame": int(reference_frame),
+        "well": well, "source": source, "traces": names, "lengths": lengths, "length": length, "dtype": "float64",
+    }
+    raw = json.dumps(header, sort_keys=True).encode("utf-8")
+    prefix = TRACE_MAGIC + struct.pack("<I", len(raw)) + raw
+    prefix += b"\0" * (-len(prefix) % HEADER_ALIGN)
+
+    part_path = f"{file_path}.part"
+    with open(part_path, "wb") as f:
+        f.write(prefix)
+        f.write(data.tobytes())
+    os.replace(part_path, file_path)
+
+
+def read_trace_header(file_path):
+    """(header, data offset) of a container; raises ValueError if it is not a complete container."""
+    with open(file_path, "rb") as f:
+        start = f.read(len(TRACE_MAGIC) + 4)
+        if len(start) < len(TRACE_MAGIC) + 4 or not start.startswith(TRACE_MAGIC):
+            raise ValueError(f"{file_path} is not a trace container")
+        (length,) = struct.unpack_from("<I", start, len(TRACE_MAGIC))
+        header = json.loads(f.read(length).decode("utf-8"))
+    if header.get("version") != TRACE_VERSION:
+        raise ValueError(f"{file_path} has container version {header.get('version')}, expected {TRACE_VERSION}")
+    offset = len(TRACE_MAGIC) + 4 + length
+    offset += -offset % HEADER_ALIGN
+    expected = offset + len(header["traces"]) * header["length"] * np.dtype(header["dtype"]).itemsize
+    if os.path.getsize(file_path) != expected:
+        raise ValueError(f"{file_path} is truncated")
+    return header, offset
+
+
+def is_current_container(file_path):
+    """True if file_path is a complete container of TRACE_VERSION; otherwise its text files should be read."""
+    try:
+        read_trace_header(file_path)
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+def map_trace_container(file_path):
+    """(header, read-only (traces, length) memory map) of a container."""
+    header, offset = read_trace_header(file_path)
+    shape = (len(header["traces"]), header["length"])
+    if not header["length"]:
+        return header, np.zeros(shape, dtype=np.float64)
+    return header, np.memmap(file_path, dtype=np.dtype(header["dtype"]), mode="r", offset=offset, shape=shape)
+
+
+def read_trace_container(file_path, trace="contraction"):
+    """(header, float64 values) of one trace of a container, as text_values()."""
+    header, data = map_trace_container(file_path)
+    if trace not in header["traces"]:
+        raise ValueError(f"{file_path} has no {trace} trace")
+    index = header["traces"].index(trace)
+    return header, text_values(data[index, :header["lengths"][index]])
+
+
+def find_trace_files(base_dir):
+    """Paths of the trace containers under base_dir, in os.walk order."""
+    paths = []
+    for root, _, files in os.walk(base_dir):
+        paths.extend(os.path.join(root, name) for name in sorted(files) if is_trace_file(name))
+    return paths
+
+
+def load_trace_matrix(paths, trace="contraction", out_path=None):
+    """
+    One trace of every container in paths as a single (wells, frames) float64 array,
+    NaN-padded to the longest well. With out_path, the array is a memory-mapped .npy
+    file there instead of being held in memory.
+    Returns (array, lengths, headers).
+    """
+    mapped = [map_trace_container(path) for path in paths]
+    headers = [header for header, _ in mapped]
+    for path, header in zip(paths, headers):
+        if trace not in header["traces"]:
+            raise ValueError(f"{path} has no {trace} trace")
+    rows = [header["traces"].index(trace) for header in headers]
+    lengths = np.array([header["lengths"][row] for header, row in zip(headers, rows)], dtype=np.int64)
+    shape = (len(paths), int(lengths.max()) if len(paths) else 0)
+
+    if out_path:
+        matrix = np.lib.format.open_memmap(out_path, mode="w+", dtype=np.float64, shape=shape)
+        matrix[:] = np.nan
+    else:
+        matrix = np.full(shape, np.nan, dtype=np.float64)
+    for i, ((_, data), row, length) in enumerate(zip(mapped, rows, lengths)):
+        matrix[i, :length] = data[row, :length]
+    if out_path:
+        matrix.flush()
+    return matrix, lengths, headers
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List the trace containers under a folder, or load them into one array.")
+    parser.add_argument("base_dir", help="Folder containing the -Contr-Results folders")
+    parser.add_argument("--trace", choices=TRACE_NAMES, default="contraction", help="Trace to load")
+    parser.add_argument("--output", default=None, help="Write the (wells, frames) array to this .npy file")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.base_dir):
+        print(f"Error: '{args.base_dir}' is not a valid directory.")
+        sys.exit(1)
+
+    paths = find_trace_files(args.base_dir)
+    if not paths:
+        print(f"No trace containers found under {args.base_dir}")
+        sys.exit(1)
+
+    matrix, lengths, headers = load_trace_matrix(paths, args.trace, args.output)
+    for header, length in zip(headers, lengths):
+        print(f"{header['well']}: {length} frames at {header['fps']:g} fps, reference frame {header['reference_frame']}")
+    print(f"{matrix.shape[0]} wells x {matrix.shape[1]} frames" + (f" written to {args.output}" if args.output else ""))
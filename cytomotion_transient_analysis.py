@@ -0,0 +1,341 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+# -------------------------------
+# NumPy port of transientAnalysis(yValues)
+# -------------------------------
+# Peak detection runs on a whole batch of contraction traces (wells x frames) at once;
+# the per-beat levels, baselines and durations are then derived per well from the
+# detected peaks. Quirks of the macro are kept on purpose so the per-beat table matches
+# the Overview-results it writes (see the comments below).
+
+# Defaults mirror the DEFAULT VALUES block of MUSCLEMOTION v1.0.ijm
+DEFAULT_PEAK_DETECTION_WINDOW = 20
+DEFAULT_PEAK_THRESHOLD = 30
+DEFAULT_PERCENTAGES = (10, 50, 90)  # binaryFormatPercentages "100010001"
+DEFAULT_BASELINE_THRESHOLD = 2
+DEFAULT_BASELINE_NUMBER_OF_POINTS = 5
+DEFAULT_HIGH_FREQ_BASELINE_DETECTION = True
+
+RESULTS_FILE = "Overview-results.csv"
+
+
+def get_result_columns(percentages=DEFAULT_PERCENTAGES):
+    """Per-beat columns in the order the macro creates them (the headerless CSV layout)."""
+    return (
+        ["Contraction Duration [10% baseline] (ms)", "Time to Peak (ms)", "Relaxation Time (ms)"]
+        + [f"{100 - p}-{100 - p} Transient (ms)" for p in percentages]
+        + ["Baseline Value (a.u.)", "Peak Amplitude (a.u.)", "Contraction Amplitude (a.u.)", "Peak to Peak Interval (ms)"]
+    )
+
+
+def imagej_round(value):
+    """ImageJ's round(): Math.round, i.e. halves are rounded up."""
+    return int(np.floor(value + 0.5))
+
+
+def to_trace_batch(traces):
+    """Stack traces of possibly different lengths into a NaN-padded (wells, frames) array."""
+    if isinstance(traces, np.ndarray) and traces.ndim == 2:
+        data = traces.astype(np.float64)
+        lengths = np.full(len(data), data.shape[1])
+        return data, lengths
+    traces = [np.asarray(t, dtype=np.float64) for t in traces]
+    lengths = np.array([len(t) for t in traces], dtype=int)
+    data = np.full((len(traces), lengths.max() if len(traces) else 0), np.nan)
+    for i, trace in enumerate(traces):
+        data[i, :len(trace)] = trace
+    return data, lengths
+
+
+def detect_peaks(traces, lengths, reference_frames, peak_detection_window=DEFAULT_PEAK_DETECTION_WINDOW,
+                 peak_threshold=DEFAULT_PEAK_THRESHOLD):
+    """
+    Batch peak detection: a frame is a peak if it rises more than peakThreshold % of the
+    (max - trace[referenceFrameSlice]) range above trace[referenceFrameSlice] and no frame
+    within PeakDetectionWindow / 2 - 1 on either side is higher.
+    Returns a boolean (wells, frames) array.
+    """
+    n_wells, n_frames = traces.shape
+    half = peak_detection_window // 2
+
+    # perc0 = yValues[referenceFrameSlice]: the slice number is used as a trace index, as in the macro
+    reference_index = np.clip(reference_frames, 0, np.maximum(lengths - 1, 0))
+    perc0 = traces[np.arange(n_wells), reference_index]
+    perc100 = np.nanmax(traces, axis=1)
+    threshold = (peak_threshold / 100) * (perc100 - perc0)
+
+    with np.errstate(invalid="ignore"):
+        is_peak = (traces - perc0[:, None]) > threshold[:, None]
+        for r in range(1, half):
+            left = np.full_like(traces, -np.inf)
+            left[:, r:] = traces[:, :-r]
+            right = np.full_like(traces, -np.inf)
+            right[:, :-r] = traces[:, r:]
+            is_peak &= ~((left > traces) | (right > traces))
+
+    frames = np.arange(n_frames)
+    in_range = (frames[None, :] >= half) & (frames[None, :] < (lengths[:, None] - 1 - half))
+    return is_peak & in_range
+
+
+def _speed_max_values(y, max_list):
+    """Largest rising step around every peak (only used by the threshold baseline detection)."""
+    speed_max = np.zeros(len(max_list))
+    for j, peak in enumerate(max_list):
+        if j == len(max_list) - 1:
+            range_speed_max = imagej_round((peak - max_list[j - 1]) / 4)
+        else:
+            range_speed_max = imagej_round((max_list[j + 1] - peak) / 4)
+        if peak - range_speed_max > 0 and peak + range_speed_max < len(y):
+            steps = np.diff(y[peak - range_speed_max:peak + range_speed_max])
+            if len(steps):
+                speed_max[j] = max(0.0, steps.max())
+    return speed_max
+
+
+def _baseline_values(y, max_list, high_freq_baseline_detection, baseline_threshold, baseline_number_of_points):
+    """Baseline level before every peak (minValueList)."""
+    baselines = np.zeros(len(max_list))
+
+    if high_freq_baseline_detection:
+        for c, peak in enumerate(max_list):
+            # For the first peak the macro skips the search, so its baseline is the peak value
+            if c == 0:
+                baselines[c] = y[peak]
+                continue
+            start_range = peak - imagej_round((peak - max_list[c - 1]) / 2)
+            window = y[max(start_range, 0):peak]
+            baselines[c] = min(y[peak], window.min()) if len(window) else y[peak]
+        return baselines
+
+    speed_max = _speed_max_values(y, max_list)
+    y_mean = y.mean()
+    # baselineNumberOfPoints is lowered for the following peaks once a region has too few points
+    number_of_points = baseline_number_of_points
+    for c, peak in enumerate(max_list):
+        threshold_value = (baseline_threshold / 100) * speed_max[c]
+        start_range = 0 if c == 0 else peak - imagej_round((peak - max_list[c - 1]) / 2)
+        j = np.arange(max(start_range, 0), peak)
+        selected = (np.abs(y[j + 1] - y[j]) < threshold_value) & (y[j] < y_mean * 1.5)
+        region = y[j][selected]
+        if len(region) == 0:
+            region = np.zeros(1)  # newArray(1)
+
+        if len(region) > number_of_points:
+            start_f = len(region) - number_of_points
+        else:
+            start_f = 0
+            number_of_points = len(region)
+        total = region[start_f:].sum() if len(region) > 1 else 0.0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            baselines[c] = np.float64(total) / number_of_points
+    return baselines
+
+
+def _first_crossing(y, indices, offsets, level):
+    """First index in `indices` where y is below level there and at the two `offsets` positions."""
+    below = (y[indices] < level) & (y[indices + offsets[0]] < level) & (y[indices + offsets[1]] < level)
+    hits = np.flatnonzero(below)
+    return int(indices[hits[0]]) if len(hits) else None
+
+
+def analyze_trace(y, peaks, sampling_time, percentages=DEFAULT_PERCENTAGES,
+                  baseline_threshold=DEFAULT_BASELINE_THRESHOLD,
+                  baseline_number_of_points=DEFAULT_BASELINE_NUMBER_OF_POINTS,
+                  high_freq_baseline_detection=DEFAULT_HIGH_FREQ_BASELINE_DETECTION):
+    """Per-beat table of one contraction trace, given its detected peak indices."""
+    columns = get_result_columns(percentages)
+    max_count = len(peaks)
+    if max_count == 0:
+        return pd.DataFrame(columns=columns, dtype=float)
+
+    # With a single peak the macro appends `false` (0) to keep its array arithmetic working
+    max_list = [int(p) for p in peaks]
+    if max_count < 2:
+        max_list.append(0)
+
+    baselines = _baseline_values(y, max_list, high_freq_baseline_detection,
+                                 baseline_threshold, baseline_number_of_points)
+    fractions = np.asarray(percentages, dtype=np.float64) / 100
+
+    # Level crossings are not reset between peaks: a level that is not found keeps the
+    # position found at the previous peak
+    data_down = np.zeros(len(percentages), dtype=int)
+    data_up = np.zeros(len(percentages), dtype=int)
+    peak_to_peak_distance = 0
+    rows = []
+    for c in range(max_count):
+        peak = max_list[c]
+        if c < len(max_list) - 1:
+            peak_to_peak_distance = max_list[c + 1] - peak
+
+        levels = fractions * (y[peak] - baselines[c]) + baselines[c]
+        min_border = max(peak - abs(peak_to_peak_distance), 2)
+        max_border = min(peak + abs(peak_to_peak_distance), len(y) - 3)
+        down_indices = np.arange(peak, min_border, -1)
+        up_indices = np.arange(peak, max_border)
+
+        # 0 doubles as `false`, as in the macro
+        low_down = 0
+        low_up = 0
+        for m, level in enumerate(levels):
+            # 3 points down / up required to exclude noise
+            found = _first_crossing(y, down_indices, (-1, -2), level) if len(down_indices) else None
+            if found is not None:
+                data_down[m] = found
+                if m == 0:
+                    low_down = found
+            found = _first_crossing(y, up_indices, (1, 2), level) if len(up_indices) else None
+            if found is not None:
+                data_up[m] = found
+                if m == 0:
+                    low_up = found
+
+        if not low_down:
+            contraction_time = 0
+            transient_duration = 0
+            relaxation_time = abs((peak - low_up) * sampling_time) if low_up else 0
+        else:
+            contraction_time = abs((peak - low_down) * sampling_time)
+            if not low_up:
+                relaxation_time = 0
+                transient_duration = 0
+            else:
+                relaxation_time = abs((peak - low_up) * sampling_time)
+                transient_duration = abs((low_up - low_down) * sampling_time)
+
+        if transient_duration:
+            transients = list((data_up - data_down) * sampling_time)
+        else:
+            transients = [0] * len(percentages)
+
+        peak_to_peak = (peak - max_list[c - 1]) * sampling_time if c > 0 else 0
+        rows.append(
+            [transient_duration, contraction_time, relaxation_time]
+            + transients
+            + [baselines[c], y[peak], y[peak] - baselines[c], peak_to_peak]
+        )
+    return pd.DataFrame(rows, columns=columns, dtype=float)
+
+
+def transient_analysis(traces, reference_frames=1, recorded_framerate=100,
+                       peak_detection_window=DEFAULT_PEAK_DETECTION_WINDOW, peak_threshold=DEFAULT_PEAK_THRESHOLD,
+                       percentages=DEFAULT_PERCENTAGES, baseline_threshold=DEFAULT_BASELINE_THRESHOLD,
+                       baseline_number_of_points=DEFAULT_BASELINE_NUMBER_OF_POINTS,
+                       high_freq_baseline_detection=DEFAULT_HIGH_FREQ_BASELINE_DETECTION):
+    """
+    Run transientAnalysis on a batch of contraction traces.
+
+    traces           : (wells, frames) array, or a list of 1-D traces of any length
+    reference_frames : referenceFrameSlice per well (or one value for all)
+
+    Returns (tables, peaks): one per-beat DataFrame per well (columns get_result_columns())
+    and the detected peak frame indices per well.
+    """
+    data, lengths = to_trace_batch(traces)
+    reference_frames = np.broadcast_to(np.asarray(reference_frames, dtype=int), lengths.shape)
+
+    # make sure PeakDetectionWindow is even
+    if peak_detection_window % 2 != 0:
+        peak_detection_window += 1
+        print(f"Warning: PeakDetectionWindow was not even: it has been automatically set to {peak_detection_window}")
+
+    is_peak = detect_peaks(data, lengths, reference_frames, peak_detection_window, peak_threshold)
+    sampling_time = (1 / recorded_framerate) * 1000
+
+    tables = []
+    peaks = []
+    for i, length in enumerate(lengths):
+        well_peaks = np.flatnonzero(is_peak[i])
+        peaks.append(well_peaks)
+        tables.append(analyze_trace(
+            data[i, :length], well_peaks, sampling_time,
+            percentages=percentages,
+            baseline_threshold=baseline_threshold,
+            baseline_number_of_points=baseline_number_of_points,
+            high_freq_baseline_detection=high_freq_baseline_detection,
+        ))
+    return tables, peaks
+
+
+def write_results_csv(file_path, table):
+    """Write a per-beat table as the headerless CSV the postprocessing reads (3 decimals, as ImageJ)."""
+    table.to_csv(file_path, index=False, header=False, float_format="%.3f")
+
+
+def read_trace_file(file_path):
+    """Read the values of a contraction.txt / speed-of-contraction.txt trace (time<TAB>value lines)."""
+    values = np.loadtxt(file_path, delimiter="\t", ndmin=2)
+    return values[:, 1] if len(values) else np.zeros(0)
+
+
+def read_log_values(log_path):
+    """Read the `name: value` lines of a Log_file.txt into a dict (later lines win)."""
+    values = {}
+    with open(log_path, "r") as log_file:
+        for line in log_file:
+            name, sep, value = line.strip().partition(":")
+            if sep:
+                values[name.strip()] = value.strip()
+    return values
+
+
+def get_reference_frame(log_values):
+    """referenceFrameSlice of a well from its log values, or the automatically detected one."""
+    reference_frame = int(float(log_values.get("referenceFrameSlice", 1)))
+    detected = log_values.get("Automatic detected reference frame")
+    if detected:
+        reference_frame = int(detected.split()[-1])
+    return reference_frame
+
+
+def reanalyze_directory(base_dir, recorded_framerate=None, **kwargs):
+    """
+    Recompute Overview-results.csv for every -Contr-Results folder under base_dir from its
+    saved contraction.txt. Wells are analyzed in batches, one per recorded frame rate
+    (taken from each Log_file.txt unless recorded_framerate is given).
+    """
+    batches = {}
+    for root, _, files in os.walk(base_dir):
+        if "contraction.txt" not in files:
+            continue
+        log_values = {}
+        log_path = os.path.join(root, "Log_file.txt")
+        if os.path.isfile(log_path):
+            log_values = read_log_values(log_path)
+
+        reference_frame = get_reference_frame(log_values)
+        framerate = recorded_framerate or float(log_values.get("recordedFramerate", 100))
+
+        batch = batches.setdefault(framerate, ([], [], []))
+        batch[0].append(root)
+        batch[1].append(read_trace_file(os.path.join(root, "contraction.txt")))
+        batch[2].append(reference_frame)
+
+    if not batches:
+        print(f"No contraction traces found under {base_dir}")
+        return
+
+    for framerate, (folders, traces, reference_frames) in batches.items():
+        tables, _ = transient_analysis(traces, reference_frames, framerate, **kwargs)
+        for folder, table in zip(folders, tables):
+            write_results_csv(os.path.join(folder, RESULTS_FILE), table)
+            print(f"[✓] Updated: {os.path.join(folder, RESULTS_FILE)} ({len(table)} beats)")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python cytomotion_transient_analysis.py <base_directory> [recorded_framerate]")
+        sys.exit(1)
+
+    base_dir = sys.argv[1]
+    if not os.path.isdir(base_dir):
+        print(f"Error: '{base_dir}' is not a valid directory.")
+        sys.exit(1)
+
+    framerate = float(sys.argv[2]) if len(sys.argv) == 3 else None
+    reanalyze_directory(base_dir, recorded_framerate=framerate)
@@ -0,0 +1,222 @@
+import os
+import sys
+import json
+import hashlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+from cytomotion_frame_reader import get_video_info
+
+# -------------------------------
+# Video content prober
+# -------------------------------
+# Reads the container metadata of every well (frame count, fps, dimensions, duration)
+# and decodes its first frame and its tail, so truncated or corrupt MP4s and wells
+# recorded at another frame rate or resolution are caught before the analysis runs.
+# For MP4/H.264 the container frame count is an estimate that is often off by a frame
+# or more, so the tail is decoded forward from TAIL_FRAMES before the estimate: the
+# number of frames that actually decode becomes the well's frame_count, and a well is
+# only taken for truncated when that is more than FRAME_COUNT_TOLERANCE short. Wells are
+# probed on a thread pool (OpenCV releases the GIL while decoding).
+#
+# Results are cached per folder in .video_probe_cache.json, keyed by file name and
+# checked by size + mtime, or by a quick content hash (size, first and last MB) when only
+# the mtime moved, so re-validating an unchanged plate does not open any video.
+
+PROBE_CACHE_FILE = ".video_probe_cache.json"
+PROBE_CACHE_VERSION = 2
+DEFAULT_PROBE_WORKERS = 8
+QUICK_HASH_BYTES = 1024 * 1024
+TAIL_FRAMES = 8
+FRAME_COUNT_TOLERANCE = 2
+
+
+def quick_hash(path, size=None):
+    """SHA-256 of the file size and its first and last QUICK_HASH_BYTES."""
+    size = os.path.getsize(path) if size is None else size
+    digest = hashlib.sha256(str(size).encode())
+    with open(path, "rb") as f:
+        digest.update(f.read(QUICK_HASH_BYTES))
+        if size > QUICK_HASH_BYTES:
+            f.seek(max(QUICK_HASH_BYTES, size - QUICK_HASH_BYTES))
+            digest.update(f.read(QUICK_HASH_BYTES))
+    return digest.hexdigest()
+
+
+def load_probe_cache(folder):
+    path = os.path.join(folder, PROBE_CACHE_FILE)
+    if os.path.isfile(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                cache = json.load(f)
+            if cache.get("version") == PROBE_CACHE_VERSION:
+                return cache
+        except (OSError, ValueError) as e:
+            print(f"Warning: could not read probe cache {path}: {e}")
+    return {"version": PROBE_CACHE_VERSION, "files": {}}
+
+
+def save_probe_cache(folder, cache):
+    """Write the cache atomically; a read-only folder only costs the cache."""
+    path = os.path.join(folder, PROBE_CACHE_FILE)
+    try:
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(cache, f, indent=1, sort_keys=True)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        print(f"Warning: could not write probe cache {path}: {e}")
+
+
+def _read_frame_at(capture, index):
+    if index > 0:
+        capture.set(cv2.CAP_PROP_POS_FRAMES, index)
+    ok, frame = capture.read()
+    return bool(ok and frame is not None and frame.size)
+
+
+def _count_tail_frames(capture, start, limit):
+    """Number of frames that decode reading forward from frame `start`, at most `limit`."""
+    if start > 0:
+        capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+    count = 0
+    while count < limit:
+        ok, frame = capture.read()
+        if not (ok and frame is not None and frame.size):
+            break
+        count += 1
+    return count
+
+
+def probe_video(path):
+    """
+    Container metadata of one video plus whether its first frame and its tail decode.
+    frame_count is the number of frames that decode (the container's estimate is kept
+    as container_frame_count). Returns a dict; "error" is None when the video looks complete.
+    """
+    result = {"frame_count": 0, "container_frame_count": 0, "fps": 0.0, "width": 0, "height": 0,
+              "duration": 0.0, "first_frame_ok": False, "last_frame_ok": False, "error": None}
+    try:
+        result.update(get_video_info(path))
+    except Exception as e:
+        result["error"] = f"cannot open: {e}"
+        return result
+    estimate = result["container_frame_count"] = result["frame_count"]
+
+    capture = cv2.VideoCapture(path)
+    try:
+        result["first_frame_ok"] = _read_frame_at(capture, 0)
+        if estimate > 0 and result["first_frame_ok"]:
+            start = max(0, estimate - TAIL_FRAMES)
+            decoded = start + _count_tail_frames(capture, start, 2 * TAIL_FRAMES)
+            result["frame_count"] = decoded
+            result["last_frame_ok"] = decoded >= estimate - FRAME_COUNT_TOLERANCE
+    finally:
+        capture.release()
+
+    if result["fps"] > 0:
+        result["duration"] = result["frame_count"] / result["fps"]
+
+    if estimate <= 0:
+        result["error"] = "no frames in container"
+    elif result["fps"] <= 0:
+        result["error"] = "no frame rate in container"
+    elif not result["first_frame_ok"]:
+        result["error"] = "first frame does not decode"
+    elif not result["last_frame_ok"]:
+        result["error"] = (f"only {result['frame_count']} of {estimate} frames decode, "
+                           f"file may be truncated")
+    return result
+
+
+def probe_videos(paths, workers=DEFAULT_PROBE_WORKERS, use_cache=True, caches=None):
+    """
+    Probe a list of videos in parallel. Returns {path: probe result}.
+    Cached results are reused per folder when the file is unchanged.
+    If caches ({folder: cache}) is given it is used and updated in place, and the caller
+    saves it (save_probe_cache), e.g. once per plate when wells are probed one at a time.
+    """
+    save = caches is None
+    caches = {} if caches is None else caches
+    results = {}
+    pending = []
+    for path in paths:
+        folder, name = os.path.split(path)
+        stat = os.stat(path)
+        if use_cache:
+            cache = caches.setdefault(folder, load_probe_cache(folder))
+            entry = cache["files"].get(name)
+            if entry and entry["size"] == stat.st_size:
+                if entry["mtime_ns"] == stat.st_mtime_ns:
+                    results[path] = entry["result"]
+                    continue
+                if entry["hash"] == quick_hash(path, stat.st_size):
+                    entry["mtime_ns"] = stat.st_mtime_ns
+                    results[path] = entry["result"]
+                    continue
+        pending.append((path, stat))
+
+    def probe(item):
+        path, stat = item
+        return probe_video(path), (quick_hash(path, stat.st_size) if use_cache else None)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for (path, stat), (result, digest) in zip(pending, pool.map(probe, pending)):
+            results[path] = result
+            if use_cache:
+                folder, name = os.path.split(path)
+                caches[folder]["files"][name] = {
+                    "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": digest, "result": result,
+                }
+
+    if save:
+        for folder, cache in caches.items():
+            save_probe_cache(folder, cache)
+    print(f"Probed {len(pending)} videos ({len(paths) - len(pending)} from cache)")
+    return results
+
+
+def summarize_plate(results):
+    """
+    Plate-level frame count, fps and dimensions (the most common values) and the wells
+    that are unreadable or deviate from them. Returns (plate info, list of problems).
+    """
+    readable = {path: r for path, r in results.items() if r["error"] is None}
+    plate = {"frame_count": None, "fps": None, "width": None, "height": None, "duration": None}
+    problems = [f"{os.path.basename(path)}: {r['error']}" for path, r in sorted(results.items()) if r["error"]]
+    if not readable:
+        return plate, problems
+
+    for key in ("frame_count", "fps", "width", "height"):
+        plate[key] = Counter(r[key] for r in readable.values()).most_common(1)[0][0]
+    plate["duration"] = plate["frame_count"] / plate["fps"]
+
+    for path, r in sorted(readable.items()):
+        name = os.path.basename(path)
+        if r["frame_count"] != plate["frame_count"]:
+            problems.append(f"{name}: {r['frame_count']} frames (plate: {plate['frame_count']})")
+        if r["fps"] != plate["fps"]:
+            problems.append(f"{name}: {r['fps']:g} fps (plate: {plate['fps']:g})")
+        if (r["width"], r["height"]) != (plate["width"], plate["height"]):
+            problems.append(f"{name}: {r['width']}x{r['height']} (plate: {plate['width']}x{plate['height']})")
+    return plate, problems
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python cytomotion_video_probe.py <path_to_folder>")
+        sys.exit(1)
+
+    path = sys.argv[1]
+    if not os.path.isdir(path):
+        print(f"Error: {path} is not a valid directory")
+        sys.exit(1)
+
+    videos = [os.path.join(path, f) for f in sorted(os.listdir(path))
+              if f.lower().endswith(".mp4") and os.path.isfile(os.path.join(path, f))]
+    plate, problems = summarize_plate(probe_videos(videos))
+    print(f"Frame count: {plate['frame_count']}, fps: {plate['fps']}, "
+          f"size: {plate['width']}x{plate['height']}, duration: {plate['duration']}")
+    for problem in problems:
+        print(f"  {problem}")
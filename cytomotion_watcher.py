@@ -0,0 +1,485 @@
+import os
+import sys
+import json
+import time
+import shutil
+import struct
+import select
+import argparse
+import ctypes
+import ctypes.util
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from rename_videos_mp4 import plan_plate, renamed_file_name, stage_file, STAGING_MODES, DEFAULT_STAGING_MODE
+from cytomotion_preprocess_validation import validate_files
+from cytomotion_preprocessing import get_results_path
+from cytomotion_video_probe import probe_videos, save_probe_cache
+from cytomotion_scheduler import analyze_well, get_worker_count, DEFAULT_MEMORY_BUDGET_MB
+from cytomotion_motion_analysis import get_recorded_framerate
+from cytomotion_orchestrator import find_plate_folders
+from update_csv_file_headers_2 import process_directory
+from generate_summary_file import generate_summary_table, update_summary_table, find_log_file, SUMMARY_FILE
+from adding_prefixes_to_cytomotion_files import prepend_tag_to_files
+from cytomotion_postprocessing import check_file_count, update_results_store, HEADERS
+from cytomotion_manifest import load_manifest, save_manifest, record_folder
+from cytomotion_catalog import ResultsCatalog, parse_results_tag
+from cytomotion_metrics import stage, emit, configure_metrics, export_prometheus
+from cytomotion_frame_cache import configure_frame_cache, DEFAULT_CACHE_DIR
+
+# -------------------------------
+# Watch-folder daemon
+# -------------------------------
+# Watches an experiment folder (CPxxx_YYYYMMDD_Dxx) while the microscope writes it, and
+# processes every well as soon as its MP4 is complete instead of waiting for the plate:
+#
+#   new Plate_N/..._NNN.mp4 -> complete? -> stage + probe -> analyze (process pool)
+#                           -> headers, summary rows merged, prefixes, store
+#
+# A file is complete when inotify reports it closed after writing (IN_CLOSE_WRITE or
+# moved in), or, with the polling fallback (no inotify, or a network filesystem), when
+# its size and mtime have not changed for `stable_seconds`. Folders are also rescanned
+# every `rescan_seconds`, so events lost by an overflowing inotify queue are caught up.
+# When all EXPECTED_WELLS of a plate are done, or no new well arrived for
+# `plate_timeout` seconds, the plate barrier runs: validation log, summary rebuilt in
+# results-tree order, file count check, manifest and results store.
+#
+# Each plate being watched keeps its rename plan, results catalog and probe cache in
+# memory, so a well costs no rescan of the plate or results folder; the probe cache
+# and the manifest are written once, at the barrier.
+#
+# Progress is kept in .cytomotion_watch_state.json in the experiment folder (written
+# atomically after every well), keyed by the raw file and its size + mtime, so a
+# restarted daemon skips finished wells. Results folders a crash left without a
+# Log_file are removed before such a well is analysed again.
+
+STATE_FILE = ".cytomotion_watch_state.json"
+STATE_VERSION = 1
+EXPECTED_WELLS = 96
+DEFAULT_POLL_SECONDS = 2.0
+DEFAULT_STABLE_SECONDS = 10.0
+DEFAULT_RESCAN_SECONDS = 60.0
+DEFAULT_PLATE_TIMEOUT = 600.0
+
+# linux/inotify.h
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify:
+    """Minimal inotify binding (libc through ctypes). Raises OSError where inotify is unavailable."""
+
+    def __init__(self):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.paths = {}  # watch descriptor -> folder
+
+    def add_watch(self, path, mask):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+        self.paths[wd] = path
+
+    def read_events(self, timeout):
+        """[(folder, name, mask)] received within timeout seconds; folder is None on queue overflow."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            events.append((None if mask & IN_Q_OVERFLOW else self.paths.get(wd), name, mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+def load_state(experiment_dir):
+    path = os.path.join(experiment_dir, STATE_FILE)
+    if os.path.isfile(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            if state.get("version") == STATE_VERSION:
+                return state
+        except (OSError, ValueError) as e:
+            print(f"Warning: could not read watch state {path}: {e}")
+    return {"version": STATE_VERSION, "wells": {}, "plates": {}}
+
+
+def save_state(experiment_dir, state):
+    """Write the state atomically and durably (temp file, fsync, rename)."""
+    path = os.path.join(experiment_dir, STATE_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def remove_partial_results(save_dir, tag):
+    """Delete results folders of a well that have no Log_file (the analysis was interrupted). Returns how many."""
+    if not os.path.isdir(save_dir):
+        return 0
+    removed = 0
+    for name in os.listdir(save_dir):
+        folder = os.path.join(save_dir, name)
+        if os.path.isdir(folder) and parse_results_tag(name) == tag and not os.path.isfile(find_log_file(folder)):
+            print(f"Removing incomplete results folder {folder}")
+            shutil.rmtree(folder)
+            removed += 1
+    return removed
+
+
+class PlateWatcher:
+    """Completion tracking, staging and postprocessing of the wells of one experiment folder."""
+
+    def __init__(self, experiment_dir, state, staging_mode=DEFAULT_STAGING_MODE, store_dir=None,
+                 stable_seconds=DEFAULT_STABLE_SECONDS, plate_timeout=DEFAULT_PLATE_TIMEOUT):
+        self.experiment_dir = experiment_dir
+        self.state = state
+        self.staging_mode = staging_mode
+        self.store_dir = store_dir
+        self.stable_seconds = stable_seconds
+        self.plate_timeout = plate_timeout
+        self.candidates = {}  # raw path -> {"size", "mtime_ns", "since", "closed"}
+        self.busy = set()  # raw paths being analysed
+        self.last_activity = {}  # plate folder -> time a well of it was last seen
+        self.plates = {}  # plate folder -> {"renamed_base", "name_prefix", "save_dir", "catalog", "probe_caches"}
+
+    def key(self, path):
+        return os.path.relpath(path, self.experiment_dir)
+
+    def is_done(self, path, st):
+        entry = self.state["wells"].get(self.key(path))
+        return bool(entry and entry["status"] in ("done", "failed")
+                    and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns)
+
+    def observe(self, path, closed=False):
+        """Note a raw MP4 that was created, written or closed (or found by a scan)."""
+        if path in self.busy:
+            return
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.candidates.pop(path, None)
+            return
+        if self.is_done(path, st):
+            return
+        now = time.monotonic()
+        self.last_activity[os.path.dirname(path)] = now
+        candidate = self.candidates.get(path)
+        if candidate is None or (candidate["size"], candidate["mtime_ns"]) != (st.st_size, st.st_mtime_ns):
+            self.candidates[path] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "since": now, "closed": closed}
+        elif closed:
+            candidate["closed"] = True
+
+    def scan(self, plate_path):
+        for name in os.listdir(plate_path):
+            if name.lower().endswith(".mp4"):
+                self.observe(os.path.join(plate_path, name))
+
+    def take_ready(self, limit):
+        """Up to `limit` complete files (closed, or size and mtime stable long enough), oldest first."""
+        now = time.monotonic()
+        ready = []
+        for path, candidate in sorted(self.candidates.items(), key=lambda item: item[1]["since"]):
+            if len(ready) >= limit:
+                break
+            try:
+                st = os.stat(path)
+            except OSError:
+                del self.candidates[path]
+                continue
+            if (st.st_size, st.st_mtime_ns) != (candidate["size"], candidate["mtime_ns"]):
+                self.candidates[path] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "since": now, "closed": False}
+                continue
+            if st.st_size and (candidate["closed"] or now - candidate["since"] >= self.stable_seconds):
+                ready.append(path)
+        for path in ready:
+            del self.candidates[path]
+        return ready
+
+    def set_well(self, path, status, **fields):
+        st = os.stat(path)
+        entry = {"status": status, "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                 "updated": datetime.now().isoformat(timespec="seconds")}
+        entry.update(fields)
+        self.state["wells"][self.key(path)] = entry
+        plate = self.state["plates"].setdefault(self.key(os.path.dirname(path)), {})
+        plate["finished"] = False
+        save_state(self.experiment_dir, self.state)
+
+    def plate(self, plate_path):
+        """Rename plan, results catalog and probe cache of a plate, set up when its first well arrives."""
+        plate = self.plates.get(plate_path)
+        if plate is None:
+            renamed_base, name_prefix = plan_plate(plate_path)
+            os.makedirs(renamed_base, exist_ok=True)
+            save_dir = get_results_path(plate_path)
+            os.makedirs(save_dir, exist_ok=True)
+            plate = {"renamed_base": renamed_base, "name_prefix": name_prefix, "save_dir": save_dir,
+                     "catalog": ResultsCatalog(save_dir), "probe_caches": {}}
+            self.plates[plate_path] = plate
+        return plate
+
+    def prepare(self, path):
+        """Stage and probe one complete raw MP4. Returns (renamed path, save_dir, fps) or None if it is skipped."""
+        new_name = renamed_file_name(plan_plate(os.path.dirname(path))[1], os.path.basename(path))
+        if new_name is None:
+            self.set_well(path, "failed", error="no trailing well index in the file name")
+            return None
+        plate = self.plate(os.path.dirname(path))
+        new_path = os.path.join(plate["renamed_base"], new_name)
+        save_dir = plate["save_dir"]
+
+        entry = self.state["wells"].get(self.key(path))
+        if entry and entry["status"] == "analyzing":
+            # Interrupted by a crash or restart: start this well over
+            if remove_partial_results(save_dir, os.path.splitext(new_name)[0]):
+                plate["catalog"] = ResultsCatalog(save_dir)
+            if os.path.lexists(new_path):
+                os.remove(new_path)
+
+        well = os.path.splitext(new_name)[0]
+        with stage("stage_well", well=well):
+            stage_file(path, new_path, self.staging_mode)
+            result = probe_videos([new_path], caches=plate["probe_caches"])[new_path]
+        if result["error"]:
+            print(f"[!] {new_path}: {result['error']}")
+            self.set_well(path, "failed", error=result["error"])
+            return None
+        self.set_well(path, "analyzing", video=new_path)
+        self.busy.add(path)
+        return new_path, save_dir, result["fps"]
+
+    def finish_well(self, path, folder, detected):
+        """Postprocess one results folder and merge its row into the plate summary."""
+        save_dir = os.path.dirname(folder)
+        name = os.path.basename(folder)
+        catalog = self.plate(os.path.dirname(path))["catalog"]
+        with stage("postprocess_well", well=name):
+            catalog.scan_folder(folder)
+            process_directory(folder, catalog)
+            update_summary_table(save_dir, HEADERS, [folder], catalog=catalog)
+            prepend_tag_to_files(save_dir, [name], catalog)
+            update_results_store(save_dir, self.store_dir, [name], catalog=catalog)
+        self.busy.discard(path)
+        self.set_well(path, "done", results=folder)
+        latency = time.monotonic() - detected
+        print(f"[✓] {name}: summary updated {latency:.1f} s after the MP4 was complete")
+        emit({"event": "watch_well", "well": name, "latency_s": round(latency, 3)})
+
+    def fail_well(self, path, error):
+        self.busy.discard(path)
+        self.set_well(path, "failed", error=error)
+
+    def plates_to_finish(self, force=False):
+        """Plates whose wells are all done (or that have been idle for plate_timeout) and not finished yet."""
+        now = time.monotonic()
+        plates = []
+        for plate_path in find_plate_folders(self.experiment_dir):
+            plate = self.state["plates"].get(self.key(plate_path))
+            if not plate or plate.get("finished"):
+                continue
+            if any(os.path.dirname(p) == plate_path for p in list(self.candidates) + list(self.busy)):
+                continue
+            wells = [entry for key, entry in self.state["wells"].items()
+                     if os.path.dirname(key) == self.key(plate_path)]
+            idle = now - self.last_activity.get(plate_path, now) >= self.plate_timeout
+            if len(wells) >= EXPECTED_WELLS or idle or force:
+                plates.append(plate_path)
+        return plates
+
+    def finish_plate(self, plate_path):
+        """Plate barrier: validation log, summary in results-tree order, file count, manifest, results store."""
+        print(f"=== PLATE {plate_path}: finishing ===")
+        plate = self.plates.pop(plate_path, None)
+        renamed_base, _ = plan_plate(plate_path)
+        save_dir = get_results_path(plate_path)
+        for folder, cache in (plate["probe_caches"] if plate is not None else {}).items():
+            save_probe_cache(folder, cache)
+        if os.path.isdir(renamed_base):
+            with stage("validate_files", plate=plate_path):
+                validate_files(renamed_base)
+        if os.path.isdir(save_dir):
+            catalog = plate["catalog"] if plate is not None else ResultsCatalog(save_dir)
+            catalog.reorder_subfolders()
+            summary_path = os.path.join(save_dir, SUMMARY_FILE)
+            if os.path.isfile(summary_path):
+                os.remove(summary_path)  # merged row by row, rebuilt in results-tree order
+                catalog.refresh_file(summary_path)
+            with stage("generate_summary", base_dir=save_dir):
+                generate_summary_table(save_dir, HEADERS, catalog=catalog)
+            with stage("check_file_count", base_dir=save_dir):
+                check_file_count(save_dir, catalog=catalog)
+            # Every well of the plate finished so far, also those done before a restart
+            folders = [os.path.basename(entry["results"]) for key, entry in self.state["wells"].items()
+                       if os.path.dirname(key) == self.key(plate_path) and entry["status"] == "done"
+                       and os.path.isdir(entry["results"])]
+            manifest = load_manifest(save_dir)
+            for name in folders:
+                record_folder(save_dir, manifest, name, catalog=catalog)
+            save_manifest(save_dir, manifest)
+            with stage("results_store", base_dir=save_dir):
+                update_results_store(save_dir, self.store_dir, catalog=catalog)
+        self.state["plates"][self.key(plate_path)] = {"finished": True,
+                                                      "finished_at": datetime.now().isoformat(timespec="seconds")}
+        save_state(self.experiment_dir, self.state)
+        export_prometheus()
+
+
+def open_inotify(experiment_dir):
+    try:
+        inotify = Inotify()
+        inotify.add_watch(experiment_dir, IN_CREATE | IN_MOVED_TO)
+    except OSError as e:
+        print(f"inotify not available ({e}), polling instead")
+        return None
+    return inotify
+
+
+def watch_experiment(experiment_dir, workers=None, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB,
+                     staging_mode=DEFAULT_STAGING_MODE, store_dir=None, poll_seconds=DEFAULT_POLL_SECONDS,
+                     stable_seconds=DEFAULT_STABLE_SECONDS, rescan_seconds=DEFAULT_RESCAN_SECONDS,
+                     plate_timeout=DEFAULT_PLATE_TIMEOUT, use_inotify=True, once=False, framerate=None, **kwargs):
+    """
+    Process the wells of an experiment folder as they are written, each at the fps
+    probed from its video (or at framerate, if given). Runs until interrupted;
+    with once=True it processes what is there, finishes every plate and returns.
+    Returns the watch state.
+    """
+    experiment_dir = os.path.abspath(experiment_dir)
+    state = load_state(experiment_dir)
+    watcher = PlateWatcher(experiment_dir, state, staging_mode, store_dir, stable_seconds, plate_timeout)
+    worker_count = get_worker_count(workers, memory_budget_mb)
+    inotify = open_inotify(experiment_dir) if use_inotify else None
+    watched = set()
+    print(f"=== WATCHING {experiment_dir} ({'inotify' if inotify else 'polling'}, {worker_count} workers) ===")
+
+    def rescan():
+        for plate_path in find_plate_folders(experiment_dir):
+            if inotify is not None and plate_path not in watched:
+                try:
+                    inotify.add_watch(plate_path, IN_CLOSE_WRITE | IN_MOVED_TO | IN_MODIFY | IN_CREATE)
+                except OSError as e:
+                    print(f"Warning: {e}")
+                watched.add(plate_path)
+            watcher.scan(plate_path)
+
+    pending = {}  # future -> (raw path, time the MP4 was complete)
+    last_scan = None
+    try:
+        with ProcessPoolExecutor(max_workers=worker_count) as pool:
+            while True:
+                # --- Wait for events, a finished well or the next poll ---
+                timeout = min(poll_seconds, 0.2) if pending or last_scan is None else poll_seconds
+                if last_scan is None:
+                    pass  # first round: scan right away
+                elif inotify is not None:
+                    for folder, name, mask in inotify.read_events(timeout):
+                        if folder is None or (folder == experiment_dir and mask & IN_ISDIR):
+                            last_scan = 0  # queue overflow or new plate folder: rescan now
+                        elif folder != experiment_dir and name.lower().endswith(".mp4"):
+                            watcher.observe(os.path.join(folder, name),
+                                            closed=bool(mask & (IN_CLOSE_WRITE | IN_MOVED_TO)))
+                elif pending:
+                    wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+                else:
+                    time.sleep(timeout)
+                if last_scan is None or inotify is None or time.monotonic() - last_scan >= rescan_seconds:
+                    rescan()
+                    last_scan = time.monotonic()
+
+                # --- Start complete wells while workers are free ---
+                for path in watcher.take_ready(worker_count - len(pending)):
+                    detected = time.monotonic()
+                    try:
+                        prepared = watcher.prepare(path)
+                    except Exception as e:
+                        print(f"[!] Failed to stage {path}: {e}")
+                        watcher.fail_well(path, f"staging failed: {e}")
+                        continue
+                    if prepared:
+                        video, save_dir, fps = prepared
+                        future = pool.submit(analyze_well, video, save_dir, memory_budget_mb,
+                                             recorded_framerate=get_recorded_framerate(fps, framerate), **kwargs)
+                        pending[future] = (path, detected)
+
+                # --- Postprocess finished wells ---
+                for future in [f for f in pending if f.done()]:
+                    path, detected = pending.pop(future)
+                    try:
+                        watcher.finish_well(path, future.result(), detected)
+                    except Exception as e:
+                        print(f"[!] Failed to process {path}: {e}")
+                        watcher.fail_well(path, f"{type(e).__name__}: {e}")
+
+                # --- Plate barriers ---
+                idle = once and not pending and not watcher.candidates
+                for plate_path in watcher.plates_to_finish(force=idle):
+                    watcher.finish_plate(plate_path)
+                if idle:
+                    break
+    except KeyboardInterrupt:
+        print("Stopped; finished wells are kept in the watch state")
+    finally:
+        if inotify is not None:
+            inotify.close()
+    return state
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyze the wells of an experiment folder as the microscope writes them.")
+    parser.add_argument("experiment", help="Experiment folder, e.g. CP011_20250609_D25")
+    parser.add_argument("--workers", type=int, default=None, help="Analysis processes (default: all cores)")
+    parser.add_argument("--memory-mb", type=int, default=DEFAULT_MEMORY_BUDGET_MB, help="Memory budget per worker in MB")
+    parser.add_argument("--staging", choices=STAGING_MODES, default=DEFAULT_STAGING_MODE, help="How renamed MP4s are staged")
+    parser.add_argument("--store", default=None, help="Results store directory (default: results_store next to each results folder)")
+    parser.add_argument("--poll", type=float, default=DEFAULT_POLL_SECONDS, help="Poll interval in seconds")
+    parser.add_argument("--stable", type=float, default=DEFAULT_STABLE_SECONDS,
+                        help="Seconds a file's size must stay unchanged when no close event is seen")
+    parser.add_argument("--rescan", type=float, default=DEFAULT_RESCAN_SECONDS, help="Full rescan interval with inotify")
+    parser.add_argument("--plate-timeout", type=float, default=DEFAULT_PLATE_TIMEOUT,
+                        help="Finish a plate with fewer than 96 wells after this many idle seconds")
+    parser.add_argument("--no-inotify", action="store_true", help="Always poll (e.g. on network filesystems)")
+    parser.add_argument("--once", action="store_true", help="Process what is there, finish the plates and exit")
+    parser.add_argument("--framerate", type=float, default=None,
+                        help="recordedFramerate to analyze with (default: each well's fps from the video)")
+    parser.add_argument("--frame-cache", nargs="?", const=DEFAULT_CACHE_DIR, default=None,
+                        help=f"Decode each well once into this cache directory (default: {DEFAULT_CACHE_DIR})")
+    parser.add_argument("--frame-cache-mb", type=float, default=None, help="Size cap of the frame cache in MB")
+    parser.add_argument("--metrics", default=None, help="Append per-stage/per-well metrics to this JSON-lines file")
+    parser.add_argument("--prometheus", default=None, help="Also export the metrics as a Prometheus textfile")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.experiment):
+        print(f"Error: {args.experiment} is not a valid directory")
+        sys.exit(1)
+
+    configure_metrics(args.metrics, args.prometheus)
+    configure_frame_cache(args.frame_cache, args.frame_cache_mb)
+    watch_experiment(args.experiment, workers=args.workers, memory_budget_mb=args.memory_mb,
+                     staging_mode=args.staging, store_dir=args.store, poll_seconds=args.poll,
+                     stable_seconds=args.stable, rescan_seconds=args.rescan, plate_timeout=args.plate_timeout,
+                     use_inotify=not args.no_inotify, once=args.once, framerate=args.framerate)
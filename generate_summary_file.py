@@ -1,8 +1,27 @@
 import os
 import sys
+import io
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
 
+# Summary prefix -> CSV column, in the order the metrics appear in the summary
+METRICS = [
+    ("CD", "Contraction Duration [10% baseline] (ms)"),
+    ("PPT", "Peak to Peak Interval (ms)"),
+    ("TTP", "Time to Peak (ms)"),
+    ("RT", "Relaxation Time (ms)"),
+    ("CA", "Contraction Amplitude (a.u.)"),
+    ("T90", "90-90 Transient (ms)"),
+    ("T50", "50-50 Transient (ms)"),
+    ("T10", "10-10 Transient (ms)"),
+    ("Baseline", "Baseline Value (a.u.)"),
+    ("PeakAmp", "Peak Amplitude (a.u.)"),
+]
+
+DEFAULT_READ_WORKERS = 8
+SUMMARY_FILE = "summary-final-updated.csv"
+
 def compute_stats_for_col(values):
     n = len(values)
     mean = values.mean()
@@ -15,125 +34,245 @@ def compute_stats_for_col(values):
         "95% CI": ci_95, "CV%": cv, "Count": n
     }
 
-def generate_summary_table(base_dir, headers):
-    summary_rows = []
+def compute_stats_for_array(values):
+    """
+    compute_stats_for_col for a contiguous float64 array.
+    Uses the same reductions as pandas' Series.mean/std/median (two-pass variance,
+    numpy sums) so the rounded summary values are identical.
+    """
+    n = len(values)
+    if n == 0:
+        mean = std = median = np.nan
+    else:
+        the_sum = values.sum(dtype=np.float64)
+        mean = the_sum / np.float64(n)
+        if n > 1:
+            std = np.sqrt(((the_sum / np.float64(n) - values) ** 2).sum(dtype=np.float64) / np.float64(n - 1))
+        else:
+            std = np.nan
+        median = np.median(values)
+    ci_95 = 1.96 * std / np.sqrt(n) if n > 1 else np.nan
+    cv = (std / mean) * 100 if mean != 0 else np.nan
+    return {
+        "Mean": mean, "Std": std, "Median": median,
+        "95% CI": ci_95, "CV%": cv, "Count": n
+    }
 
-    for root, _, files in os.walk(base_dir):
+def read_log_file(log_path):
+    """Extract (Slices, recordedFramerate) from a Log_file.txt; NaN for values that are missing."""
+    slices = np.nan
+    frame_rate = np.nan
+    if os.path.isfile(log_path):
+        try:
+            with open(log_path, 'r') as log_file:
+                for line in log_file:
+                    line = line.strip()
+                    if line.startswith("Slices"):
+                        parts = line.split(":")
+                        if len(parts) == 2:
+                            slices = int(parts[1].strip())
+                    elif line.startswith("recordedFramerate"):
+                        parts = line.split(":")
+                        if len(parts) == 2:
+                            frame_rate = float(parts[1].strip())
+        except Exception as e:
+            print(f" Error reading Log_file.txt from {log_path}: {e}")
+    return slices, frame_rate
+
+def find_log_file(folder, catalog=None):
+    """Log_file.txt of a results folder, also after step 3 prefixed it with the folder tag."""
+    log_path = os.path.join(folder, "Log_file.txt")
+    if catalog is not None:
+        names = catalog.regular_files(folder)
+        if "Log_file.txt" in names:
+            return log_path
+    else:
+        if os.path.isfile(log_path):
+            return log_path
+        try:
+            names = os.listdir(folder)
+        except OSError:
+            names = []
+    prefixed = sorted(f for f in names if f.endswith("_Log_file.txt"))
+    return os.path.join(folder, prefixed[0]) if prefixed else log_path
+
+def read_results_csv(file_path, headers):
+    """Read one headerless per-beat CSV. Returns (DataFrame, None) or (None, error)."""
+    try:
+        df = pd.read_csv(file_path, header=None)
+        df.columns = headers
+        return df, None
+    except Exception as e:
+        return None, e
+
+def find_csv_files(base_dir, catalog=None):
+    """All CSV files under base_dir, in os.walk order, as (folder, file path) pairs."""
+    walk = catalog.walk(base_dir) if catalog is not None else ((root, files) for root, _, files in os.walk(base_dir))
+    csv_files = []
+    for root, files in walk:
         for file in files:
             if file.lower().endswith('.csv'):
-                file_path = os.path.join(root, file)
-                subdir_name = os.path.basename(root)
-
-                # --- Extract Slices, Frame Rate from Log_file.txt ---
-                slices = np.nan
-                frame_rate = np.nan
-                log_path = os.path.join(root, "Log_file.txt")
-                if os.path.isfile(log_path):
-                    try:
-                        with open(log_path, 'r') as log_file:
-                            for line in log_file:
-                                line = line.strip()
-                                if line.startswith("Slices"):
-                                    parts = line.split(":")
-                                    if len(parts) == 2:
-                                        slices = int(parts[1].strip())
-                                elif line.startswith("recordedFramerate"):
-                                    parts = line.split(":")
-                                    if len(parts) == 2:
-                                        frame_rate = float(parts[1].strip())
-                    except Exception as e:
-                        print(f" Error reading Log_file.txt from {log_path}: {e}")
-
-                # --- Read CSV and set headers ---
-                try:
-                    df = pd.read_csv(file_path, header=None)
-                    df.columns = headers
-                except Exception as e:
-                    print(f"Error reading {file_path}: {e}")
-                    continue
-
-                # --- Skip first row for computation ---
-                df_data = df.iloc[1:].reset_index(drop=True)
-
-                # Convert duration to seconds
-                duration_ms = slices / frame_rate if slices and frame_rate else np.nan
-                duration_s = duration_ms / 1.0 if pd.notna(duration_ms) else np.nan
-
-                try:
-                    # Extract and convert columns safely
-                    def safe_float(col):
-                        return pd.to_numeric(df_data[col], errors="coerce").dropna()
-
-                    cd_values = safe_float("Contraction Duration [10% baseline] (ms)")
-                    ppt_values = safe_float("Peak to Peak Interval (ms)")
-                    ttp_values = safe_float("Time to Peak (ms)")
-                    rt_values = safe_float("Relaxation Time (ms)")
-                    ca_values = safe_float("Contraction Amplitude (a.u.)")
-                    t90_values = safe_float("90-90 Transient (ms)")
-                    t50_values = safe_float("50-50 Transient (ms)")
-                    t10_values = safe_float("10-10 Transient (ms)")
-                    baseline_values = safe_float("Baseline Value (a.u.)")
-                    peak_amp_values = safe_float("Peak Amplitude (a.u.)")
-
-                    # --- Handle Peak to Peak edge case (starting from second row) ---
-                    if not ppt_values.empty:
-                        if len(ppt_values) == 1 and ppt_values.iloc[0] == 0:
-                            ppt_values = pd.Series(dtype=float)
-                        elif ppt_values.iloc[0] == 0:
-                            ppt_values = ppt_values.iloc[1:]
-
-                    # --- Compute statistics ---
-                    stats = {
-                        "CD": compute_stats_for_col(cd_values),
-                        "PPT": compute_stats_for_col(ppt_values),
-                        "TTP": compute_stats_for_col(ttp_values),
-                        "RT": compute_stats_for_col(rt_values),
-                        "CA": compute_stats_for_col(ca_values),
-                        "T90": compute_stats_for_col(t90_values),
-                        "T50": compute_stats_for_col(t50_values),
-                        "T10": compute_stats_for_col(t10_values),
-                        "Baseline": compute_stats_for_col(baseline_values),
-                        "PeakAmp": compute_stats_for_col(peak_amp_values)
-                    }
-
-                    # --- Heart Beat (BPM) ---
-                    bpm = np.nan
-                    if stats["PPT"]["Mean"] and not np.isnan(stats["PPT"]["Mean"]) and stats["PPT"]["Mean"] != 0:
-                        bpm = 60000 / stats["PPT"]["Mean"]
-                    bpm_rounded = int(round(bpm)) if pd.notna(bpm) else np.nan
-
-                    # --- Estimated BPM from log ---
-                    estimated_bpm = np.nan
-                    if pd.notna(duration_s) and duration_s > 0 and stats["CD"]["Count"] > 0:
-                        est = (stats["CD"]["Count"] / duration_s) * 60
-                        estimated_bpm = int(round(est)) if pd.notna(est) else np.nan
-
-                    # --- Combine all into one row ---
-                    summary_row = {
-                        "File Name": subdir_name,
-                        "Slices": slices,
-                        "Video Time (s)": duration_s,
-                        "No of Peaks": stats["CD"]["Count"],
-                        "Heart Beat (BPM)": bpm_rounded,
-                        "Estimated BPM (from log)": estimated_bpm
-                    }
-
-                    # Flatten all metric stats
-                    for metric, values in stats.items():
-                        prefix = metric
-                        for key, val in values.items():
-                            summary_row[f"{prefix} {key}"] = round(val, 3) if pd.notna(val) else np.nan
-
-                    summary_rows.append(summary_row)
-
-                except Exception as e:
-                    print(f"Error processing {file_path}: {e}")
+                csv_files.append((root, os.path.join(root, file)))
+    return csv_files
+
+def collect_metric_values(frames):
+    """
+    Stack the per-beat rows of all files and split them per (file, metric) in one pass.
+    Returns {(file index, metric index): contiguous float64 array of the non-NaN values}.
+    """
+    columns = [header for _, header in METRICS]
+    if not frames:
+        return {}
+    lengths = [len(df) for df in frames]
+    combined = pd.concat(frames, ignore_index=True)[columns]
+    values = np.column_stack([pd.to_numeric(combined[col], errors="coerce").to_numpy(dtype=np.float64) for col in columns])
+    file_index = np.repeat(np.arange(len(frames)), lengths)
+
+    # Long format: one entry per (row, metric), NaNs dropped, row order kept within a group
+    keys = (file_index[:, None] * len(columns) + np.arange(len(columns))[None, :]).ravel()
+    flat = values.ravel()
+    keep = ~np.isnan(flat)
+
+    # --- Handle Peak to Peak edge case: drop the first PPT value of a file if it is 0 ---
+    ppt = [metric for metric, _ in METRICS].index("PPT")
+    is_ppt = (keys % len(columns) == ppt) & keep
+    ppt_positions = np.flatnonzero(is_ppt)
+    if len(ppt_positions):
+        first_per_file = ppt_positions[np.unique(keys[ppt_positions], return_index=True)[1]]
+        keep[first_per_file[flat[first_per_file] == 0]] = False
+
+    keys, flat = keys[keep], flat[keep]
+    order = np.argsort(keys, kind="stable")
+    keys, flat = keys[order], np.ascontiguousarray(flat[order])
+    unique_keys, starts = np.unique(keys, return_index=True)
+    ends = np.append(starts[1:], len(keys))
+    return {
+        divmod(int(key), len(columns)): flat[start:end]
+        for key, start, end in zip(unique_keys, starts, ends)
+    }
+
+def read_summary_inputs(csv_files, headers, workers=DEFAULT_READ_WORKERS, catalog=None):
+    """
+    Read the logs and per-beat CSVs of a list of (folder, file path) pairs in parallel.
+    Returns (logs, entries, frames): {folder: (slices, frame rate)}, and for every readable
+    CSV its (folder, file path) pair and its rows without the header row.
+    """
+
+    # --- Extract Slices, Frame Rate once per results folder ---
+    folders = list(dict.fromkeys(root for root, _ in csv_files))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        logs = dict(zip(folders, pool.map(lambda root: read_log_file(find_log_file(root, catalog)), folders)))
+        results = list(pool.map(lambda item: read_results_csv(item[1], headers), csv_files))
+
+    # --- Read CSVs and skip first (header) row for computation ---
+    entries = []
+    frames = []
+    for (root, file_path), (df, error) in zip(csv_files, results):
+        if error is not None:
+            print(f"Error reading {file_path}: {error}")
+            continue
+        entries.append((root, file_path))
+        frames.append(df.iloc[1:].reset_index(drop=True))
+    return logs, entries, frames
+
+def build_summary_rows(csv_files, headers, workers=DEFAULT_READ_WORKERS, catalog=None):
+    """Summary rows (one dict per readable CSV) for a list of (folder, file path) pairs."""
+    logs, entries, frames = read_summary_inputs(csv_files, headers, workers, catalog)
+    return summarize_frames(logs, entries, frames)
+
+def summarize_frames(logs, entries, frames):
+    """Summary rows for the output of read_summary_inputs."""
+    metric_values = collect_metric_values(frames)
+    empty = np.zeros(0, dtype=np.float64)
+
+    summary_rows = []
+    for index, (root, _) in enumerate(entries):
+        slices, frame_rate = logs[root]
+
+        # Convert duration to seconds
+        duration_ms = slices / frame_rate if slices and frame_rate else np.nan
+        duration_s = duration_ms / 1.0 if pd.notna(duration_ms) else np.nan
+
+        # --- Compute statistics ---
+        stats = {
+            metric: compute_stats_for_array(metric_values.get((index, m), empty))
+            for m, (metric, _) in enumerate(METRICS)
+        }
+
+        # --- Heart Beat (BPM) ---
+        bpm = np.nan
+        if stats["PPT"]["Mean"] and not np.isnan(stats["PPT"]["Mean"]) and stats["PPT"]["Mean"] != 0:
+            bpm = 60000 / stats["PPT"]["Mean"]
+        bpm_rounded = int(round(bpm)) if pd.notna(bpm) else np.nan
+
+        # --- Estimated BPM from log ---
+        estimated_bpm = np.nan
+        if pd.notna(duration_s) and duration_s > 0 and stats["CD"]["Count"] > 0:
+            est = (stats["CD"]["Count"] / duration_s) * 60
+            estimated_bpm = int(round(est)) if pd.notna(est) else np.nan
+
+        # --- Combine all into one row ---
+        summary_row = {
+            "File Name": os.path.basename(root),
+            "Slices": slices,
+            "Video Time (s)": duration_s,
+            "No of Peaks": stats["CD"]["Count"],
+            "Heart Beat (BPM)": bpm_rounded,
+            "Estimated BPM (from log)": estimated_bpm
+        }
+
+        # Flatten all metric stats
+        for metric, values in stats.items():
+            prefix = metric
+            for key, val in values.items():
+                summary_row[f"{prefix} {key}"] = round(val, 3) if pd.notna(val) else np.nan
+
+        summary_rows.append(summary_row)
+
+    return summary_rows
+
+def generate_summary_table(base_dir, headers, workers=DEFAULT_READ_WORKERS, catalog=None):
+    summary_rows = build_summary_rows(find_csv_files(base_dir, catalog), headers, workers, catalog)
 
     # --- Save summary ---
     summary_df = pd.DataFrame(summary_rows)
-    output_path = os.path.join(base_dir, "summary-final-updated.csv")
+    output_path = os.path.join(base_dir, SUMMARY_FILE)
+    summary_df.to_csv(output_path, index=False)
+    if catalog is not None:
+        catalog.refresh_file(output_path)
+    print(f"\n {SUMMARY_FILE} saved at: {output_path}")
+
+def update_summary_table(base_dir, headers, folders, removed=(), workers=DEFAULT_READ_WORKERS, catalog=None):
+    """
+    Merge the rows of the given results folders into an existing summary instead of
+    rebuilding it. Rows of those folders (and of the `removed` folder names) are replaced;
+    all other rows are kept exactly as they are in the file.
+    """
+    output_path = os.path.join(base_dir, SUMMARY_FILE)
+    if not os.path.isfile(output_path):
+        generate_summary_table(base_dir, headers, workers, catalog)
+        return
+
+    csv_files = []
+    for folder in folders:
+        csv_files.extend(find_csv_files(folder, catalog))
+    new_rows = build_summary_rows(csv_files, headers, workers, catalog)
+
+    # Round-trip the new rows through CSV text so both parts are merged as the strings they are written as
+    new_df = pd.read_csv(io.StringIO(pd.DataFrame(new_rows).to_csv(index=False)), dtype=str, keep_default_na=False) \
+        if new_rows else None
+    try:
+        existing_df = pd.read_csv(output_path, dtype=str, keep_default_na=False)
+    except pd.errors.EmptyDataError:
+        existing_df = pd.DataFrame(columns=["File Name"])
+
+    replaced = {os.path.basename(os.path.normpath(f)) for f in folders} | set(removed)
+    kept_df = existing_df[~existing_df["File Name"].isin(replaced)]
+    summary_df = pd.concat([kept_df, new_df], ignore_index=True) if new_df is not None else kept_df
     summary_df.to_csv(output_path, index=False)
-    print(f"\n summary-final-updated.csv saved at: {output_path}")
+    if catalog is not None:
+        catalog.refresh_file(output_path)
+    print(f"\n {SUMMARY_FILE} updated at: {output_path} ({len(new_rows)} rows refreshed)")
 
 if __name__ == "__main__":
     if len(sys.argv) != 2:
@@ -158,4 +297,4 @@ if __name__ == "__main__":
         "Peak to Peak Interval (ms)"
     ]
 
-    generate_summary_table(base_dir, headers)
\ No newline at end of file
+    generate_summary_table(base_dir, headers)
@@ -1,12 +1,177 @@
 import os
 import re
 import sys
+import zlib
 import shutil
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 
-def rename_videos(base_path):
+try:
+    import fcntl
+except ImportError:  # not available on Windows, reflinks are skipped there
+    fcntl = None
+
+# -------------------------------
+# Staging modes
+# -------------------------------
+# The renamed plate folder only has to expose the raw MP4s under their canonical
+# CPxxx_Dxx_Pxxx_yyy.mp4 names, so instead of copying every file it can be staged as:
+#   hardlink - same file, no data written (same filesystem only)
+#   reflink  - copy-on-write clone, no data written (btrfs/XFS/APFS-style filesystems, Linux)
+#   symlink  - link to the raw file (breaks if the plate folder is moved, so never picked by auto)
+#   copy     - real copy: parallel, chunked, CRC32 of every chunk taken while it is copied
+#   auto     - hardlink, else reflink, else copy (e.g. across filesystems)
+# A mode that fails for a file falls back to a copy.
+# verify=True (--verify) additionally reads every copy back from disk after flushing it
+# and dropping it from the page cache, and checks it against those CRC32s. It is off by
+# default: it costs an fsync and a full re-read per file, and the probe and analysis
+# then have to read the evicted file from disk again.
+
+STAGING_MODES = ("auto", "hardlink", "reflink", "symlink", "copy")
+DEFAULT_STAGING_MODE = "auto"
+DEFAULT_COPY_WORKERS = 4
+COPY_CHUNK_SIZE = 16 * 1024 * 1024
+FICLONE = 0x40049409  # linux/fs.h: _IOW(0x94, 9, int)
+
+def _hardlink(src, dst):
+    os.link(src, dst)
+
+def _symlink(src, dst):
+    os.symlink(os.path.abspath(src), dst)
+
+def _reflink(src, dst):
+    if fcntl is None:
+        raise OSError("reflinks are not supported on this platform")
+    created = False
+    try:
+        with open(src, "rb") as src_file, open(dst, "xb") as dst_file:
+            created = True
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+    except OSError:
+        if created:
+            os.remove(dst)
+        raise
+    shutil.copystat(src, dst)
+
+LINKERS = {"hardlink": _hardlink, "reflink": _reflink, "symlink": _symlink}
+LINK_ORDER = {
+    "auto": ("hardlink", "reflink"),
+    "hardlink": ("hardlink",),
+    "reflink": ("reflink",),
+    "symlink": ("symlink",),
+    "copy": (),
+}
+
+def link_file(src, dst, mode=DEFAULT_STAGING_MODE):
+    """Stage src as dst without copying data. Returns the method used, or None if a copy is needed."""
+    for method in LINK_ORDER[mode]:
+        try:
+            LINKERS[method](src, dst)
+            return method
+        except OSError:
+            continue
+    return None
+
+def _copy_chunk(src_fd, dst_fd, offset, length):
+    """Copy one chunk. Returns the CRC32 of the bytes read from src and written to dst."""
+    data = os.pread(src_fd, length, offset)
+    if len(data) != length:
+        raise IOError(f"short read at offset {offset}")
+    view = memoryview(data)
+    written = 0
+    while written < length:
+        written += os.pwrite(dst_fd, view[written:], offset + written)
+    return zlib.crc32(data)
+
+def _verify_chunk(dst_fd, offset, length, checksum):
+    """Read one chunk of the copy back and compare it with the CRC32 of the source bytes."""
+    if zlib.crc32(os.pread(dst_fd, length, offset)) != checksum:
+        raise IOError(f"checksum mismatch at offset {offset}")
+
+def _evict(fd):
+    """Flush a file to disk and drop it from the page cache. Returns False where it cannot be dropped."""
+    os.fsync(fd)
+    if not hasattr(os, "posix_fadvise"):
+        return False
+    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    return True
+
+def _wait_all(futures):
+    """(results, first error) of a list of futures."""
+    results, error = [], None
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            error = error or e
+    return results, error
+
+def copy_files(pairs, workers=DEFAULT_COPY_WORKERS, chunk_size=COPY_CHUNK_SIZE, verify=False):
+    """
+    Copy (src, dst) pairs with metadata, like shutil.copy2. The chunks of all files are
+    copied on one thread pool into dst + ".part", which is renamed to dst once every chunk
+    of the file is written, so an interrupted copy never leaves a truncated dst behind.
+    A file that fails does not stop the others; the failures are raised together at the end.
+    With verify, each copy is first flushed, dropped from the page cache and read back
+    against the CRC32s of its chunks (where the cache cannot be dropped, e.g. on Windows,
+    it is only flushed).
+    """
+    if not pairs:
+        return
+    if not hasattr(os, "pread"):
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(lambda pair: shutil.copy2(*pair), pairs))
+        return
+
+    binary = getattr(os, "O_BINARY", 0)
+    errors = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        jobs = []
+        for src, dst in pairs:
+            tmp_path = dst + ".part"
+            size = os.path.getsize(src)
+            src_fd = os.open(src, os.O_RDONLY | binary)
+            dst_fd = os.open(tmp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC | binary, 0o644)
+            os.ftruncate(dst_fd, size)
+            chunks = [(offset, min(chunk_size, size - offset)) for offset in range(0, size, chunk_size)]
+            futures = [pool.submit(_copy_chunk, src_fd, dst_fd, offset, length) for offset, length in chunks]
+            jobs.append((src, dst, tmp_path, src_fd, dst_fd, chunks, futures))
+
+        # --- verify: once a file is written, flush, evict and read it back ---
+        checks = []
+        for src, dst, tmp_path, src_fd, dst_fd, chunks, futures in jobs:
+            checksums, error = _wait_all(futures)
+            os.close(src_fd)
+            reads = []
+            if error is None and verify:
+                try:
+                    if _evict(dst_fd):
+                        reads = [pool.submit(_verify_chunk, dst_fd, offset, length, checksum)
+                                  for (offset, length), checksum in zip(chunks, checksums)]
+                except OSError as e:
+                    error = e
+            checks.append((src, dst, tmp_path, dst_fd, reads, error))
+
+        for src, dst, tmp_path, dst_fd, reads, error in checks:
+            _, verify_error = _wait_all(reads)
+            error = error or verify_error
+            os.close(dst_fd)
+            if error is not None:
+                os.remove(tmp_path)
+                print(f"[!] Failed to copy {src} -> {dst}: {error}")
+                errors.append(f"{src}: {error}")
+                continue
+            shutil.copystat(src, tmp_path)
+            os.replace(tmp_path, dst)
+
+    if errors:
+        raise IOError(f"{len(errors)} file(s) could not be copied: " + "; ".join(errors))
+
+def plan_plate(base_path):
+    """(renamed folder, CPxxx_Dxx_Pxxx prefix of the renamed files) of a plate folder."""
     # Example: base_path = "CP011_20250609_D25/Plate_1"
-    root_name = os.path.basename(os.path.dirname(base_path))  # e.g. CP011_20250609_D25
-    plate_name = os.path.basename(base_path)  # e.g. Plate_1
+    root_name = os.path.basename(os.path.dirname(os.path.abspath(base_path)))  # e.g. CP011_20250609_D25
+    plate_name = os.path.basename(os.path.normpath(base_path))  # e.g. Plate_1
 
     # Extract CP011 and D25
     match = re.match(r"(CP\d+)_\d{8}_(D\d+)", root_name)
@@ -21,46 +186,95 @@ def rename_videos(base_path):
     plate_number = int(plate_match.group(1))
     plate_str = f"P{plate_number:03d}"
 
-    # Create output directory for renamed files
-    renamed_base = os.path.join(os.path.dirname(base_path), f"{plate_name}_renamed")
-    os.makedirs(renamed_base, exist_ok=True)
+    renamed_base = os.path.join(os.path.dirname(os.path.normpath(base_path)), f"{plate_name}_renamed")
+    return renamed_base, f"{prefix}_{day_code}_{plate_str}"
+
+
+def renamed_file_name(name_prefix, filename):
+    """Canonical name of one raw MP4 of a plate, or None if it has no trailing well index."""
+    # Capture trailing index (_001, _002, etc.)
+    index_match = re.search(r"_(\d{3})\.mp4$", filename)
+    if not index_match:
+        return None
+    return f"{name_prefix}_{index_match.group(1)}.mp4"
 
-    # Process .mp4 files directly inside base_path
-    for filename in os.listdir(base_path):
+
+def plan_renames(base_path):
+    """
+    Canonical names of the MP4s of a plate folder.
+    Returns (renamed folder, [(raw path, renamed path), ...]) sorted by well index.
+    """
+    renamed_base, name_prefix = plan_plate(base_path)
+
+    # .mp4 files directly inside base_path
+    pairs = []
+    for filename in sorted(os.listdir(base_path)):
         old_path = os.path.join(base_path, filename)
         if not (os.path.isfile(old_path) and filename.lower().endswith(".mp4")):
             continue
 
-        # Capture trailing index (_001, _002, etc.)
-        index_match = re.search(r"_(\d{3})\.mp4$", filename)
-        if not index_match:
+        new_filename = renamed_file_name(name_prefix, filename)
+        if new_filename is None:
             print(f"Skipping {filename} (no trailing index found)")
             continue
-        index_str = index_match.group(1)
+        pairs.append((old_path, os.path.join(renamed_base, new_filename)))
 
-        new_filename = f"{prefix}_{day_code}_{plate_str}_{index_str}.mp4"
-        new_path = os.path.join(renamed_base, new_filename)
+    pairs.sort(key=lambda pair: os.path.basename(pair[1]))
+    return renamed_base, pairs
 
-        if os.path.exists(new_path):
-            print(f"Skipping {old_path}, target {new_path} already exists")
-            continue
 
+def link_or_defer(old_path, new_path, mode=DEFAULT_STAGING_MODE):
+    """
+    Stage one raw MP4 under its renamed path if that needs no copy.
+    Returns "exists", the link method used, or None if the file has to be copied.
+    """
+    if os.path.lexists(new_path):
+        print(f"Skipping {old_path}, target {new_path} already exists")
+        return "exists"
+    method = link_file(old_path, new_path, mode)
+    if method:
+        print(f"Linking ({method}) {old_path} -> {new_path}")
+    else:
         print(f"Copying {old_path} -> {new_path}")
-        shutil.copy2(old_path, new_path)  # copy keeps original files
+    return method
+
+
+def stage_file(old_path, new_path, mode=DEFAULT_STAGING_MODE, workers=DEFAULT_COPY_WORKERS, verify=False):
+    """Stage one raw MP4 under its renamed path (link, else copy). Returns False if it already exists."""
+    method = link_or_defer(old_path, new_path, mode)
+    if method is None:
+        copy_files([(old_path, new_path)], workers, verify=verify)
+    return method != "exists"
+
+
+def rename_videos(base_path, mode=DEFAULT_STAGING_MODE, workers=DEFAULT_COPY_WORKERS, verify=False):
+    if mode not in STAGING_MODES:
+        raise ValueError(f"Unknown staging mode {mode}, expected one of {', '.join(STAGING_MODES)}")
+
+    # Create output directory for renamed files
+    renamed_base, pairs = plan_renames(base_path)
+    os.makedirs(renamed_base, exist_ok=True)
+
+    # Linking or copying keeps the original files; all copies go through one batch
+    to_copy = [(old_path, new_path) for old_path, new_path in pairs
+               if link_or_defer(old_path, new_path, mode) is None]
+    copy_files(to_copy, workers, verify=verify)
 
     # Return the renamed folder path so it can be used by validation/conversion
     return renamed_base
 
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python rename_videos.py <path_to_plate_folder>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Stage the MP4s of a plate under their canonical names in <plate>_renamed.")
+    parser.add_argument("base_path", help="Plate folder, e.g. CP011_20250609_D25/Plate_1")
+    parser.add_argument("--mode", choices=STAGING_MODES, default=DEFAULT_STAGING_MODE, help="Staging mode (default: auto)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_COPY_WORKERS, help="Copy threads")
+    parser.add_argument("--verify", action="store_true", help="Read every copy back from disk and check its CRC32s")
+    args = parser.parse_args()
 
-    base_path = sys.argv[1]
-    if not os.path.isdir(base_path):
-        print(f"Error: {base_path} is not a valid directory")
+    if not os.path.isdir(args.base_path):
+        print(f"Error: {args.base_path} is not a valid directory")
         sys.exit(1)
 
-    renamed_folder = rename_videos(base_path)
-    print(f"Renamed files stored in: {renamed_folder}")
\ No newline at end of file
+    renamed_folder = rename_videos(args.base_path, args.mode, args.workers, args.verify)
+    print(f"Renamed files stored in: {renamed_folder}")
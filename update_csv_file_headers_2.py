@@ -16,25 +16,39 @@ NEW_HEADERS = [
     "Peak to peak time (ms)"
 ]
 
+def has_headers(df):
+    """True if the first row of a headerless-read CSV already is NEW_HEADERS."""
+    return len(df) > 0 and [str(v) for v in df.iloc[0]] == NEW_HEADERS
+
 def update_csv_file(file_path):
+    """Prepend NEW_HEADERS to a CSV. Files that already start with them are left untouched."""
     try:
         df = pd.read_csv(file_path, header=None)
-        
+
+        if has_headers(df):
+            print(f"[=] Already has headers: {file_path}")
+            return False
+
         # Insert headers as the first row
         df_with_headers = pd.DataFrame([NEW_HEADERS])
         df = pd.concat([df_with_headers, df], ignore_index=True)
 
         df.to_csv(file_path, index=False, header=False)
         print(f"[✓] Updated: {file_path}")
+        return True
     except Exception as e:
         print(f"[!] Failed to process {file_path}: {e}")
+        return False
 
-def process_directory(root_dir):
-    for subdir, _, files in os.walk(root_dir):
+def process_directory(root_dir, catalog=None):
+    """Add headers to every CSV under root_dir (listed from `catalog` if one is given)."""
+    walk = catalog.walk(root_dir) if catalog is not None else ((subdir, files) for subdir, _, files in os.walk(root_dir))
+    for subdir, files in walk:
         for file in files:
             if file.endswith('.csv'):
                 file_path = os.path.join(subdir, file)
-                update_csv_file(file_path)
+                if update_csv_file(file_path) and catalog is not None:
+                    catalog.refresh_file(file_path)
 
 if __name__ == "__main__":
     if len(sys.argv) != 2: